@@ -0,0 +1,278 @@
+'''
+async_player.py
+
+Players whose decisions are awaited. This lets a strategy engine
+that lives in another process sit at an AsyncTable.
+
+The wire protocol is one line of text per message. Messages that
+need no answer are sent as
+
+  decks 6
+  min 100.0
+  max 3000.0
+  card X
+  debit 100.0
+  pay 200.0
+
+Requests carry an id which is echoed in the one line reply
+
+  bet 7              ->  7 150.0
+  insurance 8 XX A   ->  8 y
+  surrender 9 X6 X   ->  9 n
+  split 10 88 6      -> 10 y
+  double 11 56 6     -> 11 n
+  stand 12 X6 7      -> 12 y
+
+A reply that arrives after its request timed out is recognised
+by its id and thrown away.
+'''
+
+import sys
+import abc
+import asyncio
+from player import Player
+
+DECISIONS = ('insurance', 'surrender', 'split', 'double', 'stand')
+
+class AsyncPlayer(abc.ABC):
+  '''
+  The Player interface with the decisions turned into coroutines.
+  Notifications stay synchronous so that dealing never waits.
+  '''
+  @abc.abstractmethod
+  async def get_bet_amount(self) -> float:
+    pass
+  @abc.abstractmethod
+  async def accepts_insurance(self, hand : str, upcard : str) -> bool:
+    pass
+  @abc.abstractmethod
+  async def accepts_surrender(self, hand : str, upcard : str) -> bool:
+    pass
+  @abc.abstractmethod
+  async def accepts_split(self, hand : str, upcard : str) -> bool:
+    pass
+  @abc.abstractmethod
+  async def accepts_double(self, hand : str, upcard : str) -> bool:
+    pass
+  @abc.abstractmethod
+  async def accepts_stand(self, hand : str, upcard : str) -> bool:
+    pass
+  @abc.abstractmethod
+  def show_card(self, card : str) -> None:
+    pass
+  @abc.abstractmethod
+  def show_decks_in_shoe(self, decks_in_shoe : int) -> None:
+    pass
+  @abc.abstractmethod
+  def receive_payoff(self, amount) -> None:
+    pass
+  @abc.abstractmethod
+  def set_minimum_bet(self, amount:float) -> None:
+    pass
+  @abc.abstractmethod
+  def set_maximum_bet(self, amount:float) -> None:
+    pass
+  @abc.abstractmethod
+  def make_bet(self, amount:float) -> None:
+    pass
+  async def close(self) -> None:
+    'release whatever the player holds on to'
+
+class LocalPlayer(AsyncPlayer):
+  '''
+  Wraps an in-process Player such as a Counter. This is the
+  baseline that out-of-process engines are measured against.
+  '''
+  def __init__(self, player: Player):
+    self.player = player
+
+  async def get_bet_amount(self) -> float:
+    return self.player.get_bet_amount()
+  async def accepts_insurance(self, hand, upcard) -> bool:
+    return self.player.accepts_insurance(hand, upcard)
+  async def accepts_surrender(self, hand, upcard) -> bool:
+    return self.player.accepts_surrender(hand, upcard)
+  async def accepts_split(self, hand, upcard) -> bool:
+    return self.player.accepts_split(hand, upcard)
+  async def accepts_double(self, hand, upcard) -> bool:
+    return self.player.accepts_double(hand, upcard)
+  async def accepts_stand(self, hand, upcard) -> bool:
+    return self.player.accepts_stand(hand, upcard)
+  def show_card(self, card):
+    self.player.show_card(card)
+  def show_decks_in_shoe(self, decks_in_shoe):
+    self.player.show_decks_in_shoe(decks_in_shoe)
+  def receive_payoff(self, amount):
+    self.player.receive_payoff(amount)
+  def set_minimum_bet(self, amount):
+    self.player.set_minimum_bet(amount)
+  def set_maximum_bet(self, amount):
+    self.player.set_maximum_bet(amount)
+  def make_bet(self, amount):
+    self.player.make_bet(amount)
+
+class StreamPlayer(AsyncPlayer):
+  '''
+  A player at the other end of a pair of asyncio streams.
+  Use spawn for a subprocess speaking on stdin/stdout or
+  connect for a Unix socket.
+  '''
+  def __init__(self, reader, writer, process=None):
+    self.reader = reader
+    self.writer = writer
+    self.process = process
+    self.request_id = 0
+    self.lock = asyncio.Lock()    # one request on the reader at a time
+    self.bankrole = 0.0
+
+  @classmethod
+  async def spawn(cls, *args):
+    'start a bot process, e.g. spawn(sys.executable, "async_player.py", "strategy1.json")'
+    process = await asyncio.create_subprocess_exec(
+        *args, stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE)
+    return cls(process.stdout, process.stdin, process)
+
+  @classmethod
+  async def connect(cls, path):
+    'connect to a bot listening on a Unix socket'
+    reader, writer = await asyncio.open_unix_connection(path)
+    return cls(reader, writer)
+
+  def _send(self, *words) -> None:
+    self.writer.write((' '.join(str(x) for x in words) + '\n').encode())
+
+  async def _request(self, verb, *args) -> str:
+    '''
+    Send a request and wait for the reply with the same id.
+    Replies to earlier requests that were given up on are skipped.
+    Concurrent requests take turns, so only one reads the replies.
+    '''
+    async with self.lock:
+      self.request_id += 1
+      request_id = self.request_id
+      self._send(verb, request_id, *args)
+      await self.writer.drain()
+      while True:
+        line = await self.reader.readline()
+        if not line:
+          raise EOFError('player closed the connection')
+        reply_id, answer = line.decode().split(None, 1)
+        if int(reply_id) == request_id:
+          return answer.strip()
+
+  async def _ask(self, verb, hand, upcard) -> bool:
+    return await self._request(verb, hand, upcard) == 'y'
+
+  async def get_bet_amount(self) -> float:
+    return float(await self._request('bet'))
+  async def accepts_insurance(self, hand, upcard) -> bool:
+    return await self._ask('insurance', hand, upcard)
+  async def accepts_surrender(self, hand, upcard) -> bool:
+    return await self._ask('surrender', hand, upcard)
+  async def accepts_split(self, hand, upcard) -> bool:
+    return await self._ask('split', hand, upcard)
+  async def accepts_double(self, hand, upcard) -> bool:
+    return await self._ask('double', hand, upcard)
+  async def accepts_stand(self, hand, upcard) -> bool:
+    return await self._ask('stand', hand, upcard)
+
+  def show_card(self, card):
+    self._send('card', card)
+  def show_decks_in_shoe(self, decks_in_shoe):
+    self._send('decks', decks_in_shoe)
+  def receive_payoff(self, amount):
+    self.bankrole += amount
+    self._send('pay', amount)
+  def set_minimum_bet(self, amount):
+    self._send('min', amount)
+  def set_maximum_bet(self, amount):
+    self._send('max', amount)
+  def make_bet(self, amount):
+    self.bankrole -= amount
+    self._send('debit', amount)
+
+  async def close(self):
+    self.writer.close()
+    if self.process is not None:
+      await self.process.wait()
+
+def handle_line(player: Player, line: str):
+  '''
+  Apply one protocol message to a synchronous Player. Returns
+  the reply line for a request and None for a notification.
+  '''
+  words = line.split()
+  verb = words[0]
+  if verb == 'card':
+    player.show_card(words[1])
+  elif verb == 'decks':
+    player.show_decks_in_shoe(int(words[1]))
+  elif verb == 'pay':
+    player.receive_payoff(float(words[1]))
+  elif verb == 'debit':
+    player.make_bet(float(words[1]))
+  elif verb == 'min':
+    player.set_minimum_bet(float(words[1]))
+  elif verb == 'max':
+    player.set_maximum_bet(float(words[1]))
+  elif verb == 'bet':
+    return '{0} {1}\n'.format(words[1], player.get_bet_amount())
+  elif verb in DECISIONS:
+    accepts = getattr(player, 'accepts_' + verb)
+    answer = 'y' if accepts(words[2], words[3]) else 'n'
+    return '{0} {1}\n'.format(words[1], answer)
+  else:
+    raise ValueError('unknown message: ' + line)
+  return None
+
+def serve(player: Player, fin=sys.stdin, fout=sys.stdout) -> None:
+  'Run a synchronous Player as a bot on a pair of text files'
+  for line in fin:
+    reply = handle_line(player, line)
+    if reply is not None:
+      fout.write(reply)
+      fout.flush()
+
+async def serve_unix(make_player, path: str) -> None:
+  '''
+  Run synchronous Players as a bot listening on a Unix socket,
+  make_player() giving a fresh one for each connection so that
+  tables connected at once keep their counts apart
+  '''
+  async def on_connect(reader, writer):
+    player = make_player()
+    while True:
+      line = await reader.readline()
+      if not line:
+        break
+      reply = handle_line(player, line.decode())
+      if reply is not None:
+        writer.write(reply.encode())
+        await writer.drain()
+    writer.close()
+  server = await asyncio.start_unix_server(on_connect, path)
+  async with server:
+    await server.serve_forever()
+
+def main():
+  '''
+  Run a Counter as a bot: python async_player.py strategy1.json [socket]
+  Without a socket path the bot speaks on stdin and stdout.
+  '''
+  if len(sys.argv) not in (2, 3):
+    print()
+    print("Run a Counter as a bot on stdin and stdout or a Unix socket")
+    print()
+    print("  Syntax:")
+    print()
+    print("    > python async_player.py strategy.json [socket]")
+    print()
+    sys.exit(1)
+  from counter import Counter
+  if len(sys.argv) > 2:
+    asyncio.run(serve_unix(lambda: Counter(json_file_path=sys.argv[1]), sys.argv[2]))
+  else:
+    serve(Counter(json_file_path=sys.argv[1]))
+
+if __name__ == '__main__':
+  main()
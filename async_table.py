@@ -0,0 +1,251 @@
+'''
+async_table.py
+
+A Table whose players are AsyncPlayers. The dealing and the
+settling are those of table.Table; only the decisions are
+awaited. Decisions that do not depend on each other, the bets
+and the insurance, are asked of every place at once and the
+table waits for them together.
+
+Each decision is given a timeout. When a player does not answer
+in time the default action is taken instead.
+'''
+
+import os
+import sys
+import time
+import asyncio
+from table import Table
+from rules import DEFAULT_RULES
+from counter import Counter
+from async_player import LocalPlayer, StreamPlayer
+
+DEFAULT_ACTIONS = {
+    'bet' : None,          # None means the table minimum
+    'insurance' : False,
+    'surrender' : False,
+    'split' : False,
+    'double' : False,
+    'stand' : True,
+}
+
+class DecisionStats:
+  '''
+  Number of decisions of one kind, how many timed out and the
+  total and worst latency in seconds.
+  '''
+  def __init__(self):
+    self.count = 0
+    self.timeouts = 0
+    self.total = 0.0
+    self.worst = 0.0
+
+  def add(self, latency):
+    self.count += 1
+    self.total += latency
+    if latency > self.worst:
+      self.worst = latency
+
+  def mean(self):
+    return self.total / self.count if self.count else 0.0
+
+class AsyncTable(Table):
+  '''
+  Each table is a list of Places whose players are awaited
+  '''
+  def __init__(self, n_places, n_decks, seed, decks_cut,
+               minimum_bet=100.0, maximum_bet=3000.0,
+               timeout=1.0, defaults=None, rules=DEFAULT_RULES):
+    '''
+    timeout is the number of seconds a player is given for
+    each decision and defaults maps a decision to the action
+    taken when the player does not answer in time.
+    '''
+    super().__init__(n_places, n_decks, seed, decks_cut,
+                     minimum_bet=minimum_bet, maximum_bet=maximum_bet, rules=rules)
+    self.timeout = timeout
+    self.defaults = dict(DEFAULT_ACTIONS)
+    if defaults is not None:
+      self.defaults.update(defaults)
+    self.stats = {name : DecisionStats() for name in DEFAULT_ACTIONS}
+    self.elapsed = 0.0
+
+  def specialize(self, rules):
+    '''
+    As Table.specialize, with the early surrender awaited. Resplit
+    aces are decided in the middle of process_split, which cannot
+    wait for a player, so they are not offered here.
+    '''
+    if rules.resplit_aces and not rules.hit_split_aces:
+      raise ValueError('an AsyncTable cannot offer resplit aces')
+    super().specialize(rules)
+    if rules.surrender == 'early':
+      self.early_surrender = self._early_surrender_async
+    else:
+      self.early_surrender = self._no_early_surrender_async
+
+  async def decide(self, name, request):
+    'await a decision, falling back to the default action on a timeout'
+    stats = self.stats[name]
+    start = time.perf_counter()
+    try:
+      answer = await asyncio.wait_for(request, self.timeout)
+    except asyncio.TimeoutError:
+      stats.timeouts += 1
+      answer = self.defaults[name]
+      if answer is None:
+        answer = self.minimum_bet
+    stats.add(time.perf_counter() - start)
+    return answer
+
+  async def make_bets(self):
+    '''
+    every place is asked for a bet at the same time
+    '''
+    places = list(self.occupied_places())
+    wagers = await asyncio.gather(
+        *[self.decide('bet', place.player.get_bet_amount()) for place in places])
+    for place, wager in zip(places, wagers):
+      self.place_bet(place, wager)
+
+  async def players_take_insurance(self):
+    '''
+    every place is asked about insurance at the same time
+    '''
+    places = list(self.occupied_places())
+    answers = await asyncio.gather(
+        *[self.decide('insurance',
+                      place.player.accepts_insurance(place.hands[0].cards, self.upcard))
+          for place in places])
+    for place, accepts in zip(places, answers):
+      if accepts:
+        self.process_insurance(place.player, place, place.hands[0])
+
+  async def _early_surrender_async(self):
+    '''
+    every place without a blackjack is asked about early surrender
+    at the same time
+    '''
+    places = [place for place in self.occupied_places()
+              if not place.hands[0].is_blackjack()]
+    answers = await asyncio.gather(
+        *[self.decide('surrender',
+                      place.player.accepts_surrender(place.hands[0].cards, self.upcard))
+          for place in places])
+    for place, accepts in zip(places, answers):
+      if accepts:
+        self.process_surrender(place.player, place, place.hands[0])
+
+  async def _no_early_surrender_async(self):
+    pass
+
+  async def play_hand(self, player, place, hand):
+    '''
+    The same decisions as Table.play_hand, each one awaited
+    '''
+    if hand.settled or self.is_finished(hand):
+      return
+    cards = hand.cards
+    if self.can_surrender(hand) and \
+       await self.decide('surrender', player.accepts_surrender(cards, self.upcard)):
+      self.process_surrender(player, place, hand)
+      return
+    if self.can_split(place, hand) and \
+       await self.decide('split', player.accepts_split(cards, self.upcard)):
+      self.process_split(player, place, hand)
+      await self.play_hand(player, place, hand)
+      return
+    if self.can_double(hand) and \
+       await self.decide('double', player.accepts_double(cards, self.upcard)):
+      self.process_double(player, place, hand)
+      return
+    while not self.is_finished(hand) and \
+          not await self.decide('stand', player.accepts_stand(hand.cards, self.upcard)):
+      self.process_hit(player, place, hand)
+    self.process_stand(player, place, hand)
+
+  async def play_place(self, place):
+    i_hand = 0
+    while i_hand < len(place.hands):
+      await self.play_hand(place.player, place, place.hands[i_hand])
+      i_hand += 1
+
+  async def play_each_place(self):
+    for place in self.occupied_places():
+      await self.play_place(place)
+
+  async def finish_round(self):
+    if self.dealer_peeks():
+      self.show_card_to_all_players(self.downcard)
+      if self.upcard == 'A':
+        self.dealer_blackjack_ace_up()
+      else:
+        self.dealer_blackjack_ten_up()
+    else:
+      self.pay_blackjacks()
+      await self.play_each_place()
+      self.play_dealer()
+      self.settle()
+    self.end_round()
+
+  async def play_round(self):
+    await self.make_bets()
+    self.start_round()
+    if self.upcard == 'A':
+      await self.players_take_insurance()
+    await self.early_surrender()
+    await self.finish_round()
+
+  async def play_shoe(self):
+    self.shuffle()
+    while not self.cut_card_seen():
+      await self.play_round()
+
+  async def run(self, n_shoes):
+    start = time.perf_counter()
+    for _ in range(n_shoes):
+      await self.play_shoe()
+    self.elapsed += time.perf_counter() - start
+
+  def rounds_per_second(self):
+    return self.n_rounds / self.elapsed if self.elapsed else 0.0
+
+  def report(self, fout=sys.stdout):
+    'print the latency of each kind of decision and the round rate'
+    fout.write('{0:>10} {1:>9} {2:>9} {3:>11} {4:>11}\n'.format(
+        'decision', 'count', 'timeouts', 'mean (us)', 'worst (us)'))
+    for name, stats in self.stats.items():
+      fout.write('{0:>10} {1:>9} {2:>9} {3:>11.1f} {4:>11.1f}\n'.format(
+          name, stats.count, stats.timeouts, 1e6 * stats.mean(), 1e6 * stats.worst))
+    fout.write('rounds: {0}  rounds/sec: {1:.1f}\n'.format(
+        self.n_rounds, self.rounds_per_second()))
+
+async def benchmark(n_shoes=20, n_places=3, strategy=None):
+  '''
+  Play the same shoes with in-process Counters and with Counter
+  bots in subprocesses and report both. strategy is strategy1.json
+  beside this file unless given.
+  '''
+  here = os.path.dirname(os.path.abspath(__file__))
+  bot = os.path.join(here, 'async_player.py')
+  if strategy is None:
+    strategy = os.path.join(here, 'strategy1.json')
+  async def play(players):
+    table = AsyncTable(n_places=n_places, n_decks=6, seed=1, decks_cut=1.5)
+    for i_place, player in enumerate(players):
+      table.sit_down(i_place, player)
+    await table.run(n_shoes)
+    for player in players:
+      await player.close()
+    return table
+
+  local = [LocalPlayer(Counter(json_file_path=strategy)) for _ in range(n_places)]
+  print('in-process Counter')
+  (await play(local)).report()
+  remote = [await StreamPlayer.spawn(sys.executable, bot, strategy)
+            for _ in range(n_places)]
+  print('Counter bot in a subprocess')
+  (await play(remote)).report()
+
+if __name__ == '__main__':
+  asyncio.run(benchmark())
@@ -0,0 +1,25 @@
+'''
+cache.py
+
+Where precomputed tables are kept between runs. The directory is
+'cache' next to this file unless BJ_CACHE_DIR says otherwise.
+'''
+
+import os
+import threading
+
+CACHE_DIR = os.environ.get(
+    'BJ_CACHE_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache'))
+
+def cache_path(name: str) -> str:
+  'the path of a file in the cache directory, which is made if need be'
+  os.makedirs(CACHE_DIR, exist_ok=True)
+  return os.path.join(CACHE_DIR, name)
+
+def write_atomic(path: str, data: bytes) -> None:
+  'write a whole file so that readers never see part of it, from any process or thread'
+  tmp_path = '{0}.{1}.{2}.tmp'.format(path, os.getpid(), threading.get_ident())
+  with open(tmp_path, 'wb') as fobj:
+    fobj.write(data)
+  os.replace(tmp_path, path)
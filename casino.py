@@ -0,0 +1,331 @@
+'''
+casino.py
+
+Back-counting (wonging) across many tables.
+
+A Casino keeps a clock and a heap of the time each table deals its
+next round, and always deals the round that comes first. Every
+table has a few other players, Fillers who bet the minimum and play
+like the dealer. A Wonger watches a table, counting every card from
+its shuffle, sits down when the true count reaches its entry
+threshold and gets up when the count falls below its exit
+threshold, to walk to another table and watch that one from its
+next shuffle.
+
+Nobody needs a Hand, a bet or a decision at a table where no
+Wonger sits, so those rounds go through CasinoTable.play_empty_round,
+which deals the Fillers' cards as they would be dealt at a full
+Table and shows them to anyone watching, and nothing else. Only a
+table with a Wonger in a place plays a full Table round.
+
+A round takes ROUND_SECONDS plus HAND_SECONDS for each hand and a
+shuffle SHUFFLE_SECONDS, so a heads up table deals about 200 rounds
+an hour and a full one about 60. The results are the win per hour
+and the hands per hour of each back-counting profile.
+
+  > python casino.py [n_tables] [hours] [strategy.json]
+  > python casino.py test
+'''
+
+import sys
+import math
+import time
+import heapq
+import random
+from table import Table
+from counter import Counter
+from player import Player
+from stats import Moments
+from rules import DEFAULT_RULES, dealer_must_hit_s17, hand_value, is_blackjack
+
+ROUND_SECONDS = 10.0
+HAND_SECONDS = 7.0
+SHUFFLE_SECONDS = 60.0
+
+# name, enter at true count, leave below true count
+PROFILES = (
+    ('play all', -math.inf, -math.inf),
+    ('wong in +1 out 0', 1.0, 0.0),
+    ('wong in +2 out +1', 2.0, 1.0),
+)
+
+class Filler(Player):
+  '''
+  Someone else at the table: bets the minimum, never insures,
+  surrenders, splits or doubles, and hits like the dealer
+  '''
+  def __init__(self):
+    self._bet = 0.0
+  def accepts_insurance(self, hand, upcard):
+    return False
+  def accepts_surrender(self, hand, upcard):
+    return False
+  def accepts_split(self, hand, upcard):
+    return False
+  def accepts_double(self, hand, upcard):
+    return False
+  def accepts_stand(self, hand, upcard):
+    return not dealer_must_hit_s17(hand)
+  def show_card(self, card):
+    pass
+  def show_decks_in_shoe(self, decks_in_shoe):
+    pass
+  def get_bet_amount(self):
+    return self._bet
+  def receive_payoff(self, amount):
+    pass
+  def set_minimum_bet(self, amount):
+    self._bet = amount
+  def set_maximum_bet(self, amount):
+    pass
+  def make_bet(self, amount):
+    pass
+
+class CasinoTable(Table):
+  '''
+  A Table with Fillers in its first n_fillers places. The players
+  list holds everyone counting the cards, seated or not, and the
+  Fillers are left out of it as they count nothing.
+  '''
+  def __init__(self, n_places, n_fillers, n_decks, seed, decks_cut,
+               minimum_bet=100.0, maximum_bet=3000.0, rules=DEFAULT_RULES):
+    super().__init__(n_places, n_decks, seed, decks_cut,
+                     minimum_bet=minimum_bet, maximum_bet=maximum_bet, rules=rules)
+    self.n_fillers = n_fillers
+    for place in self.places[:n_fillers]:
+      filler = Filler()
+      filler.set_minimum_bet(minimum_bet)
+      place.occupy(filler)
+
+  def show_decks(self):
+    for player in self.players:
+      player.show_decks_in_shoe(self.n_decks)
+
+  def free_place(self):
+    'the index of an empty place, or None'
+    for i_place, place in enumerate(self.places):
+      if place.player is None:
+        return i_place
+    return None
+
+  def n_hands(self):
+    return sum(1 for _ in self.occupied_places())
+
+  def play_empty_round(self):
+    '''
+    A round with only the Fillers, dealt as Table.play_round deals
+    it to them but with the cards kept as strings and no money
+    '''
+    hands = []
+    for _ in range(self.n_fillers):
+      card = self.deal_card()
+      self.show_card_to_all_players(card)
+      hands.append(card)
+    self.deal_down_card()
+    for i_hand in range(self.n_fillers):
+      card = self.deal_card()
+      self.show_card_to_all_players(card)
+      hands[i_hand] += card
+    self.deal_up_card()
+    if self.dealer_peeks():
+      self.show_card_to_all_players(self.downcard)
+    else:
+      live = False
+      for cards in hands:
+        if is_blackjack(cards):
+          continue
+        while dealer_must_hit_s17(cards):
+          card = self.deal_card()
+          self.show_card_to_all_players(card)
+          cards += card
+        live = live or hand_value(cards)[0] <= 21
+      self.show_card_to_all_players(self.downcard)
+      if live:
+        while self.dealer_must_hit(self.hand):
+          card = self.deal_card()
+          self.hand += card
+          self.show_card_to_all_players(card)
+    self.n_rounds += 1
+
+class Wonger:
+  '''
+  A Counter that sits down at a true count of enter_at or more and
+  gets up below leave_at
+  '''
+  def __init__(self, profile, json_file_path, enter_at, leave_at,
+               minimum_bet=100.0, maximum_bet=3000.0):
+    self.profile = profile
+    self.enter_at = enter_at
+    self.leave_at = leave_at
+    self.counter = Counter(json_file_path, track_composition=False)
+    self.counter.set_minimum_bet(minimum_bet)
+    self.counter.set_maximum_bet(maximum_bet)
+    self.i_table = None
+    self.i_place = None       # None while watching
+    self.results = Moments()  # net of each hand played
+    self.rounds_watched = 0
+
+  def wants_in(self):
+    return self.counter.true_count() >= self.enter_at
+
+  def wants_out(self):
+    return self.counter.true_count() < self.leave_at
+
+class Casino:
+  '''
+  n_tables tables of n_places places, each with one to n_places - 2
+  Fillers, and the Wongers of the profiles, n_each of each
+  '''
+  def __init__(self, n_tables, strategy='strategy1.json', profiles=PROFILES, n_each=1,
+               n_places=7, n_decks=6, decks_cut=1.5, seed=1,
+               minimum_bet=100.0, maximum_bet=3000.0, rules=DEFAULT_RULES):
+    self.rng = random.Random(seed)
+    self.clock = 0.0
+    self.tables = []
+    self.waiting = []     # per table: Wongers who start watching at the next shuffle
+    self.watching = []    # per table: Wongers counting its cards
+    self.events = []      # (time of the next round, table)
+    for i_table in range(n_tables):
+      table = CasinoTable(n_places, self.rng.randint(1, n_places - 2), n_decks,
+                          seed * 1000003 + i_table, decks_cut,
+                          minimum_bet=minimum_bet, maximum_bet=maximum_bet, rules=rules)
+      self.tables.append(table)
+      self.waiting.append([])
+      self.watching.append([])
+      table.set_recorder(self._recorder(i_table))
+      table.shuffle()
+      self.events.append((self.rng.uniform(0.0, ROUND_SECONDS), i_table))
+    heapq.heapify(self.events)
+    self.wongers = []
+    for name, enter_at, leave_at in profiles:
+      for _ in range(n_each):
+        wonger = Wonger(name, strategy, enter_at, leave_at, minimum_bet, maximum_bet)
+        self.wongers.append(wonger)
+        self._walk(wonger)
+
+  def _recorder(self, i_table):
+    watching = self.watching[i_table]
+    def recorder(record):
+      i_place, _, _, net = record
+      for wonger in watching:
+        if wonger.i_place == i_place:
+          wonger.results.add(net)
+    return recorder
+
+  def _walk(self, wonger):
+    'leave the current table, if any, for another one'
+    if wonger.i_table is not None:
+      table = self.tables[wonger.i_table]
+      if wonger.i_place is not None:
+        table.places[wonger.i_place].player = None
+        wonger.i_place = None
+      table.players.remove(wonger.counter)
+      self.watching[wonger.i_table].remove(wonger)
+    i_table = self.rng.randrange(len(self.tables))
+    if len(self.tables) > 1:
+      while i_table == wonger.i_table:
+        i_table = self.rng.randrange(len(self.tables))
+    wonger.i_table = i_table
+    self.waiting[i_table].append(wonger)
+
+  def play_round(self, i_table):
+    '''
+    Deal one round at a table, after a shuffle if the cut card came
+    out, and return how long it took
+    '''
+    table = self.tables[i_table]
+    seconds = 0.0
+    if table.cut_card_seen():
+      for wonger in self.waiting[i_table]:
+        table.players.append(wonger.counter)
+        self.watching[i_table].append(wonger)
+      self.waiting[i_table].clear()
+      table.shuffle()
+      seconds += SHUFFLE_SECONDS
+    seated = False
+    for wonger in list(self.watching[i_table]):
+      if wonger.i_place is not None:
+        if wonger.wants_out():
+          self._walk(wonger)
+          continue
+      elif wonger.wants_in():
+        i_place = table.free_place()
+        if i_place is not None:
+          table.places[i_place].occupy(wonger.counter)
+          wonger.i_place = i_place
+      if wonger.i_place is None:
+        wonger.rounds_watched += 1
+      else:
+        seated = True
+    seconds += ROUND_SECONDS + HAND_SECONDS * table.n_hands()
+    if seated:
+      table.play_round()
+    else:
+      table.play_empty_round()
+    return seconds
+
+  def run(self, hours):
+    'deal every table until the clock has moved on by hours'
+    end = self.clock + 3600.0 * hours
+    while self.events[0][0] < end:
+      when, i_table = self.events[0]
+      heapq.heapreplace(self.events, (when + self.play_round(i_table), i_table))
+    self.clock = end
+
+  def report(self, fout=sys.stdout):
+    'the win per hour and hands per hour of each profile'
+    hours = self.clock / 3600.0
+    fout.write('{0:<20} {1:>10} {2:>10} {3:>18} {4:>12}\n'.format(
+        'profile', 'hands/hr', 'watched/hr', 'win/hr', 'win/hand'))
+    for name in dict.fromkeys(wonger.profile for wonger in self.wongers):
+      results = Moments()
+      watched = 0
+      n_wongers = 0
+      for wonger in self.wongers:
+        if wonger.profile == name:
+          results.merge(wonger.results)
+          watched += wonger.rounds_watched
+          n_wongers += 1
+      player_hours = hours * n_wongers
+      total = results.mean * results.n
+      se = math.sqrt(results.n * results.variance()) if results.n > 1 else 0.0
+      fout.write('{0:<20} {1:>10.1f} {2:>10.1f} {3:>+10.2f} +/- {4:<6.2f} {5:>+10.3f}\n'.format(
+          name, results.n / player_hours, watched / player_hours,
+          total / player_hours, se / player_hours, results.mean))
+
+def test(n_shoes=200):
+  '''
+  The cards of play_empty_round are the cards a full Table round
+  with the same Fillers deals
+  '''
+  for seed in range(n_shoes):
+    cheap = CasinoTable(7, 1 + seed % 5, 6, seed, 1.5)
+    full = CasinoTable(7, 1 + seed % 5, 6, seed, 1.5)
+    for table in (cheap, full):
+      table.shuffle()
+    while not full.cut_card_seen():
+      cheap.play_empty_round()
+      full.play_round()
+      assert (cheap.n_cards_dealt, cheap.count) == (full.n_cards_dealt, full.count)
+
+def main():
+  'main entry point: args = [n_tables] [hours] [strategy.json], or test'
+  args = sys.argv[1:]
+  if args == ['test']:
+    test()
+    print('empty rounds deal the cards of full rounds')
+    return
+  n_tables = int(args[0]) if args else 100
+  hours = float(args[1]) if len(args) > 1 else 20.0
+  strategy = args[2] if len(args) > 2 else 'strategy1.json'
+  casino = Casino(n_tables, strategy, n_each=max(1, n_tables // 20))
+  start = time.perf_counter()
+  casino.run(hours)
+  elapsed = time.perf_counter() - start
+  n_rounds = sum(table.n_rounds for table in casino.tables)
+  print('{0} tables for {1:g} hours: {2} rounds in {3:.1f} s, {4:.0f} rounds/s'.format(
+      n_tables, hours, n_rounds, elapsed, n_rounds / elapsed))
+  casino.report()
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,329 @@
+'''
+coordinator.py
+
+Spreads the units of a simulate.py run config over workers on other
+machines, or other processes on this one, over TCP.
+
+The units are simulate.py's: unit k plays its shoes from seed
+seed + k, so the merged results are those of simulate.py with the
+same config, however the units are shared out. The coordinator
+hands each worker a range of units at a time and the worker sends
+back one BucketStats, and ShoeSample, for the range. The first range
+of a worker is one unit; after that a range is sized from the
+worker's measured rate to take about UNIT_SECONDS, but never more
+than a share of what is left, so the last ranges come out small and
+the workers finish together.
+
+A worker sends its progress, as simulate.run_unit reports it, at
+most every PROGRESS_INTERVAL while it plays. A worker that closes
+its connection, or says nothing for DEAD_SECONDS, is dropped and its
+range goes back to the front of the queue for the next worker to
+ask. The coordinator shows the progress of the run and, when every
+unit is in or the target_se or max_seconds of the config says stop,
+prints the report and writes the outputs as simulate.py does.
+
+Messages are pickles with a length in front, so run the coordinator
+only where the workers are trusted; it listens on localhost unless
+told otherwise. Workers read the strategy files, and any shoe pool,
+from the paths in the config, relative to where they are started.
+
+  > python coordinator.py serve run.json [host:port]
+  > python coordinator.py worker [host:port]
+  > python coordinator.py test [n_workers]
+'''
+
+import os
+import sys
+import time
+import queue
+import pickle
+import socket
+import struct
+import asyncio
+import threading
+import subprocess
+import simulate
+from stats import BucketStats
+
+DEFAULT_ADDRESS = ('localhost', 8754)
+UNIT_SECONDS = 5.0      # the time a range of units should take a worker
+DEAD_SECONDS = 30.0     # silence after which a worker is given up on
+_LENGTH = struct.Struct('<I')
+
+def parse_address(text):
+  'host:port, host or :port as (host, port)'
+  host, _, port = text.partition(':')
+  return (host or DEFAULT_ADDRESS[0], int(port) if port else DEFAULT_ADDRESS[1])
+
+def _frame(message):
+  data = pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+  return _LENGTH.pack(len(data)) + data
+
+async def _read_message(reader):
+  length, = _LENGTH.unpack(await reader.readexactly(_LENGTH.size))
+  return pickle.loads(await reader.readexactly(length))
+
+class Coordinator:
+  '''
+  The queue of unit ranges of a run config and the merged results of
+  those the workers have finished
+  '''
+  def __init__(self, config, show_progress=True):
+    self.config = config
+    self.units = [(seed, n_shoes) for _, seed, n_shoes in simulate._units(config)]
+    self.pending = [(0, len(self.units))]     # ranges [first, last) of units to hand out
+    self.n_done = 0
+    self.n_reassigned = 0
+    self.stats = BucketStats()
+    self.sample = simulate.make_sample(config)
+    self.summary = {'batches' : 0, 'shoes' : 0, 'cached' : 0, 'stopped' : 'shoe budget spent'}
+    self.progress = simulate.Progress(config['n_shoes']) if show_progress else None
+    self.rates = {}         # worker -> units/s of its last range
+    self.start = None
+    self.changed = None     # asyncio.Condition, made in serve
+    self.finished = None    # asyncio.Event
+    self.address = None     # where the server listens, once it does
+
+  def _size(self, rate):
+    'units in the next range for a worker playing rate units/s, None for the first range'
+    if rate is None:
+      return 1
+    n_left = sum(last - first for first, last in self.pending)
+    n_workers = max(1, len(self.rates))
+    share = max(1, -(-n_left // (2 * n_workers)))
+    return max(1, min(int(rate * UNIT_SECONDS), share))
+
+  def _take(self, size):
+    'the next range of at most size units'
+    first, last = self.pending.pop(0)
+    if last - first > size:
+      self.pending.insert(0, (first + size, last))
+      last = first + size
+    return first, last
+
+  def _give_back(self, first, last):
+    self.pending.insert(0, (first, last))
+    self.n_reassigned += last - first
+
+  def _merge(self, first, last, stats_bytes, sample, n_shoes):
+    self.stats.merge(BucketStats.from_bytes(stats_bytes))
+    if self.sample is not None:
+      self.sample.merge(sample)
+    self.n_done += last - first
+    self.summary['batches'] += last - first
+    self.summary['shoes'] += n_shoes
+    reason = simulate._stop_reason(self.config, self.stats, self.start)
+    if reason is not None:
+      self.summary['stopped'] = reason
+    if reason is not None or self.n_done == len(self.units):
+      self.finished.set()
+
+  async def _serve_worker(self, reader, writer):
+    'hand ranges to one worker until the run is over or the worker is lost'
+    worker = None
+    assigned = None
+    try:
+      _, name = await asyncio.wait_for(_read_message(reader), DEAD_SECONDS)
+      worker = '{0} {1}'.format(name, id(writer))
+      writer.write(_frame(('config', self.config)))
+      rate = None
+      while True:
+        async with self.changed:
+          await self.changed.wait_for(lambda: self.finished.is_set() or self.pending)
+        if self.finished.is_set():
+          break
+        assigned = self._take(self._size(rate))
+        first, last = assigned
+        writer.write(_frame(('work', self.units[first:last])))
+        await writer.drain()
+        while True:
+          message = await asyncio.wait_for(_read_message(reader), DEAD_SECONDS)
+          if message[0] != 'progress':
+            break
+          if self.progress is not None:
+            self.progress.update((worker,) + tuple(message[1][1:]))
+            self.progress.show()
+        _, stats_bytes, sample, n_shoes, elapsed = message
+        assigned = None
+        if not self.finished.is_set():
+          self._merge(first, last, stats_bytes, sample, n_shoes)
+        rate = (last - first) / max(elapsed, 1e-3)
+        self.rates[worker] = rate
+        async with self.changed:
+          self.changed.notify_all()
+      writer.write(_frame(('stop',)))
+      await writer.drain()
+    except (ConnectionError, EOFError, asyncio.IncompleteReadError, asyncio.TimeoutError,
+            pickle.UnpicklingError):
+      if assigned is not None and not self.finished.is_set():
+        self._give_back(*assigned)
+    finally:
+      self.rates.pop(worker, None)
+      writer.close()
+      async with self.changed:
+        self.changed.notify_all()
+
+  async def serve(self, address=DEFAULT_ADDRESS, ready=None):
+    '''
+    Listen at address until the run is over and return the merged
+    BucketStats, ShoeSample and summary. ready, if given, is called
+    once the server listens.
+    '''
+    self.start = time.perf_counter()
+    self.changed = asyncio.Condition()
+    self.finished = asyncio.Event()
+    if not self.units:
+      self.finished.set()
+    server = await asyncio.start_server(self._serve_worker, *address)
+    self.address = server.sockets[0].getsockname()[:2]
+    if ready is not None:
+      ready(self)
+    async with server:
+      await self.finished.wait()
+      async with self.changed:
+        self.changed.notify_all()
+      await asyncio.sleep(0)
+    if self.progress is not None:
+      self.progress.show(force=True)
+      self.progress.fout.write('\n')
+    return self.stats, self.sample, self.summary
+
+class _Connection:
+  'the worker end: whole messages over a blocking socket, sent from any thread'
+  def __init__(self, address):
+    self.sock = socket.create_connection(address)
+    self.fin = self.sock.makefile('rb')
+    self.lock = threading.Lock()
+
+  def send(self, message):
+    with self.lock:
+      self.sock.sendall(_frame(message))
+
+  def receive(self):
+    header = self.fin.read(_LENGTH.size)
+    if len(header) < _LENGTH.size:
+      return ('stop',)
+    length, = _LENGTH.unpack(header)
+    return pickle.loads(self.fin.read(length))
+
+  def close(self):
+    self.fin.close()
+    self.sock.close()
+
+def work(address=DEFAULT_ADDRESS):
+  '''
+  Play the ranges of units the coordinator at address hands out
+  until it says stop or goes away
+  '''
+  connection = _Connection(address)
+  progress_queue = queue.Queue()
+  simulate._init_worker(progress_queue)
+  def forward():
+    while True:
+      report = progress_queue.get()
+      if report is None:
+        return
+      try:
+        connection.send(('progress', report))
+      except OSError:
+        return
+  forwarder = threading.Thread(target=forward, daemon=True)
+  forwarder.start()
+  try:
+    connection.send(('hello', '{0}:{1}'.format(socket.gethostname(), os.getpid())))
+    message = connection.receive()
+    config = message[1] if message[0] == 'config' else None
+    while config is not None:
+      message = connection.receive()
+      if message[0] != 'work':
+        break
+      start = time.perf_counter()
+      stats = BucketStats()
+      sample = simulate.make_sample(config)
+      n_shoes = 0
+      for seed, unit_shoes in message[1]:
+        stats_bytes, unit_sample, played = simulate.run_unit((config, seed, unit_shoes))
+        stats.merge(BucketStats.from_bytes(stats_bytes))
+        if sample is not None:
+          sample.merge(unit_sample)
+        n_shoes += played
+      connection.send(('done', stats.to_bytes(), sample, n_shoes, time.perf_counter() - start))
+  except (ConnectionError, EOFError):
+    pass
+  finally:
+    progress_queue.put(None)
+    connection.close()
+
+def start_workers(address, n_workers):
+  'n_workers worker processes on this machine for the coordinator at address'
+  here = os.path.dirname(os.path.abspath(__file__))
+  return [subprocess.Popen([sys.executable, os.path.join(here, 'coordinator.py'), 'worker',
+                            '{0}:{1}'.format(*address)])
+          for _ in range(n_workers)]
+
+def test(n_workers=3):
+  '''
+  Run a config on local workers, killing one of them part way
+  through, and check the merged results against simulate.run
+  '''
+  config = dict(simulate.DEFAULT_CONFIG)
+  config.update(n_shoes=600, unit_shoes=20,
+                seats=[{'strategy' : 'strategy1.json'}, None, {'strategy' : 'strategy1.json'}])
+  coordinator = Coordinator(config, show_progress=False)
+  workers = []
+  async def kill_one():
+    while coordinator.n_done < 3:
+      await asyncio.sleep(0.01)
+    workers[0].kill()
+  async def serve():
+    task = None
+    def ready(coordinator):
+      nonlocal task
+      workers.extend(start_workers(coordinator.address, n_workers))
+      task = asyncio.ensure_future(kill_one())
+    answer = await coordinator.serve(('localhost', 0), ready)
+    task.cancel()
+    return answer
+  start = time.perf_counter()
+  stats, _, summary = asyncio.run(serve())
+  elapsed = time.perf_counter() - start
+  for process in workers:
+    process.wait()
+  expected, _, _ = simulate.run(config, show_progress=False)
+  assert stats.n_rounds() == expected.n_rounds()
+  assert abs(stats.total().mean - expected.total().mean) < 1e-9
+  print('{0} units, {1} shoes on {2} workers in {3:.1f} s, {4} units reassigned, '
+        'results match simulate.run'.format(summary['batches'], summary['shoes'], n_workers,
+                                            elapsed, coordinator.n_reassigned))
+
+def main():
+  'main entry point: args = serve run.json [host:port], worker [host:port] or test [n_workers]'
+  args = sys.argv[1:]
+  if args and args[0] == 'serve' and len(args) in (2, 3):
+    config = simulate.load_config(args[1])
+    address = parse_address(args[2]) if len(args) > 2 else DEFAULT_ADDRESS
+    start = time.perf_counter()
+    stats, sample, summary = asyncio.run(Coordinator(config).serve(address))
+    elapsed = time.perf_counter() - start
+    simulate.report(config, stats, sample, summary)
+    print('{0} shoes in {1:.1f} s, {2:.0f} shoes/sec'.format(
+        summary['shoes'], elapsed, summary['shoes'] / elapsed))
+    simulate.write_outputs(config, stats, sample, summary)
+  elif args and args[0] == 'worker' and len(args) in (1, 2):
+    work(parse_address(args[1]) if len(args) > 1 else DEFAULT_ADDRESS)
+  elif args and args[0] == 'test':
+    test(*[int(arg) for arg in args[1:2]])
+  else:
+    print()
+    print("Share a simulate.py run between workers over TCP")
+    print()
+    print("  Syntax:")
+    print()
+    print("    > python coordinator.py serve run.json [host:port]")
+    print("    > python coordinator.py worker [host:port]")
+    print("    > python coordinator.py test [n_workers]")
+    print()
+    sys.exit(1)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,174 @@
+'''
+count_tables.py
+
+The exact distribution of the running count after k cards have been
+dealt from a shuffled shoe, for every k, for Hi-Lo or any other
+linear count.
+
+The cards with the same count value are interchangeable as far as
+the count goes, so the shoe is a few groups of n_g cards with count
+value t_g. The number of ways to deal k cards with running count r
+is the coefficient of x^k y^r in the product over the groups of
+
+  sum over j of C(n_g, j) x^j y^(t_g j)
+
+which is built up one group at a time, and dividing by C(N, k)
+makes it a probability. Each table is cached as a .npy file in the
+cache directory; a six-deck table takes a fraction of a second to
+compute and less to load.
+
+  probabilities, counts = running_count_table(6)
+  probabilities[k, i]     chance of running count counts[i] after k cards
+'''
+
+import io
+import math
+import hashlib
+import threading
+import numpy                      # pylint: disable=import-error
+from cache import cache_path, write_atomic
+from rules import CARDS_PER_DECK
+
+FACES = '23456789XA'
+RANKS_PER_DECK = (4, 4, 4, 4, 4, 4, 4, 4, 16, 4)
+
+COUNT_SYSTEMS = {
+    'hi-lo' :     (+1, +1, +1, +1, +1, 0, 0, 0, -1, -1),
+    'hi-opt-i' :  (0, +1, +1, +1, +1, 0, 0, 0, -1, 0),
+    'hi-opt-ii' : (+1, +1, +2, +2, +1, +1, 0, 0, -2, 0),
+    'omega-ii' :  (+1, +1, +2, +2, +2, +1, 0, -1, -2, 0),
+    'zen' :       (+1, +1, +2, +2, +2, +1, 0, 0, -2, -1),
+    'ko' :        (+1, +1, +1, +1, +1, +1, 0, 0, -1, -1),
+}
+
+_TABLES = {}
+_TABLES_LOCK = threading.Lock()
+
+def _groups(n_decks, tags):
+  'count value -> number of cards in the shoe with it'
+  answer = {}
+  for tag, per_deck in zip(tags, RANKS_PER_DECK):
+    answer[tag] = answer.get(tag, 0) + per_deck * n_decks
+  return answer
+
+def count_range(n_decks, tags):
+  'the lowest and highest running counts possible'
+  groups = _groups(n_decks, tags)
+  low = sum(tag * n for tag, n in groups.items() if tag < 0)
+  high = sum(tag * n for tag, n in groups.items() if tag > 0)
+  return low, high
+
+def compute_table(n_decks, tags):
+  '''
+  [k, r - low] the chance of running count r after k cards, for
+  k = 0 .. all the cards in the shoe
+  '''
+  n_cards = CARDS_PER_DECK * n_decks
+  low, high = count_range(n_decks, tags)
+  ways = numpy.zeros((n_cards + 1, high - low + 1))
+  ways[0, -low] = 1.0
+  dealt = 0    # the most cards the groups so far can supply
+  for tag, n_group in _groups(n_decks, tags).items():
+    before = ways[:dealt + 1].copy()
+    ways[:dealt + 1] = 0.0
+    for j in range(n_group + 1):
+      shift = tag * j
+      src = before[:, max(0, -shift):before.shape[1] - max(0, shift)]
+      ways[j:j + dealt + 1, max(0, shift):max(0, shift) + src.shape[1]] += math.comb(n_group, j) * src
+    dealt += n_group
+  totals = numpy.array([float(math.comb(n_cards, k)) for k in range(n_cards + 1)])
+  return ways / totals[:, None]
+
+def _file_name(n_decks, tags):
+  for name, system in COUNT_SYSTEMS.items():
+    if tuple(tags) == system:
+      break
+  else:
+    name = hashlib.sha1(repr(tuple(tags)).encode('ascii')).hexdigest()[:12]
+  return 'counts-{0}-{1}d.npy'.format(name, n_decks)
+
+def running_count_table(n_decks=6, system='hi-lo'):
+  '''
+  (probabilities, counts) where probabilities[k, i] is the chance that
+  the running count is counts[i] after k cards. system is the name of
+  one of COUNT_SYSTEMS or the count values of the faces "23456789XA".
+  The arrays are shared, by threads too, so they are read only.
+  '''
+  tags = COUNT_SYSTEMS[system] if isinstance(system, str) else tuple(system)
+  key = (n_decks, tags)
+  table = _TABLES.get(key)
+  if table is not None:
+    return table
+  with _TABLES_LOCK:
+    table = _TABLES.get(key)
+    if table is None:
+      path = cache_path(_file_name(n_decks, tags))
+      low, high = count_range(n_decks, tags)
+      try:
+        probabilities = numpy.load(path)
+        if probabilities.shape != (CARDS_PER_DECK * n_decks + 1, high - low + 1):
+          raise ValueError('stale table ' + path)
+      except (FileNotFoundError, ValueError):
+        probabilities = compute_table(n_decks, tags)
+        buffer = io.BytesIO()
+        numpy.save(buffer, probabilities)
+        write_atomic(path, buffer.getvalue())
+      probabilities.setflags(write=False)
+      counts = numpy.arange(low, high + 1)
+      counts.setflags(write=False)
+      table = _TABLES[key] = (probabilities, counts)
+  return table
+
+def true_counts(n_decks, counts):
+  '''
+  [k, i] the true count for running count counts[i] after k cards,
+  the running count per deck unseen, with zero decks left taken as
+  one card left
+  '''
+  n_cards = CARDS_PER_DECK * n_decks
+  decks_left = numpy.maximum(n_cards - numpy.arange(n_cards + 1), 1) / float(CARDS_PER_DECK)
+  return counts[None, :] / decks_left[:, None]
+
+def true_count_table(n_decks=6, system='hi-lo', width=1.0, low=-10.0, high=10.0):
+  '''
+  (probabilities, edges) where probabilities[k, b] is the chance that
+  the true count after k cards is in the bin edges[b] <= true <
+  edges[b + 1], the end bins taking everything beyond them
+  '''
+  probabilities, counts = running_count_table(n_decks, system)
+  edges = numpy.arange(low, high + width / 2.0, width)
+  trues = true_counts(n_decks, counts)
+  bins = numpy.clip(numpy.searchsorted(edges, trues, side='right') - 1, 0, len(edges) - 2)
+  answer = numpy.zeros((probabilities.shape[0], len(edges) - 1))
+  rows = numpy.broadcast_to(numpy.arange(probabilities.shape[0])[:, None], bins.shape)
+  numpy.add.at(answer, (rows, bins), probabilities)
+  return answer, edges
+
+def test(n_shoes=20000):
+  'time the six-deck tables and check them against shuffled shoes'
+  import time
+  for system in ('hi-lo', 'omega-ii'):
+    tags = COUNT_SYSTEMS[system]
+    start = time.perf_counter()
+    probabilities = compute_table(6, tags)
+    computed = time.perf_counter() - start
+    running_count_table(6, system)
+    _TABLES.clear()
+    start = time.perf_counter()
+    probabilities, counts = running_count_table(6, system)
+    loaded = time.perf_counter() - start
+    print('{0}: computed in {1:.2f} s, loaded in {2:.4f} s, rows sum to 1 within {3:.1e}'.format(
+        system, computed, loaded, numpy.abs(probabilities.sum(axis=1) - 1.0).max()))
+
+    rng = numpy.random.default_rng(2)
+    values = numpy.repeat(numpy.array(tags), numpy.array(RANKS_PER_DECK) * 6)
+    shoes = rng.permuted(numpy.broadcast_to(values, (n_shoes, len(values))), axis=1)
+    for k in (52, 156, 234):
+      running = shoes[:, :k].sum(axis=1)
+      simulated = numpy.bincount(running - counts[0], minlength=len(counts)) / float(n_shoes)
+      print('  after {0} cards: largest difference from {1} shoes {2:.4f}, mean {3:+.4f}'.format(
+          k, n_shoes, numpy.abs(simulated - probabilities[k]).max(),
+          float((probabilities[k] * counts).sum())))
+
+if __name__ == '__main__':
+  test()
@@ -2,12 +2,32 @@
 counter.py
 
 Defines the Counter class for a blackjack counter
+
+Besides the Hi-Lo count a Counter can keep the number of cards of
+each rank still unseen, which costs one dict update per card. With
+it the exact decks remaining and the densities of tens and aces are
+known, and any decision can be overridden by a rule that looks at
+them, such as insure_by_ten_density or stand_by_dealer_table.
+
+With compiled=True the decisions are made by functions that
+strategy_compiler.py generates from the tables instead.
+
+rounding names the true_count.ROUNDINGS convention for the true
+count, 'exact' by default. With integer=True the count is kept in
+whole numbers, the running count scaled and the cards unseen, and
+the compiled decisions compare them with thresholds scaled once, so
+nothing is divided per card or per decision. The true count is only
+worked out when true_count() or the bet asks for it, and is the
+float path's to the last bit.
 '''
 
 import json
 import shoe
+import strategy_compiler
 from math import floor
 from player import Player
+import dealer
+from true_count import ROUNDINGS, units_left, float_true
 from rules import CARDS_PER_DECK, \
                   CARD_VALUES,    \
                   hand_value,     \
@@ -18,7 +38,8 @@ class Counter(Player):
   The Player is a card counter
   '''
 
-  def __init__(self, json_file_path: str):
+  def __init__(self, json_file_path: str, track_composition: bool = True,
+               compiled: bool = False, rounding: str = 'exact', integer: bool = False):
     with open(json_file_path, 'r') as fobj:
       self._tables = json.load(fobj)
     self._true_count = 0.0
@@ -40,6 +61,74 @@ class Counter(Player):
     self._insurance = self._tables['insurance']
     self._upcard_index = self._tables['upcard_index']
 
+    self._track_composition = track_composition
+    self._remaining = None    # face -> unseen cards of the face
+    self._overrides = {}      # decision -> rule
+
+    self._rounding = ROUNDINGS[rounding]
+    self._integer = integer
+    self._units = None        # true_count.units_left of the shoe, when needed
+    self._num = 0             # integer: running count * deck_units * scale
+    self._unseen = 0          # integer: cards unseen
+    if integer:
+      self._scale = strategy_compiler.table_scale(self._tables)
+      step = self._rounding.deck_units * self._scale
+      self._scaled_counts = {face : int(round(tag * step)) for face, tag in self._counts.items()}
+      strategy_compiler.bind(self, self._rounding)
+      self.show_card = self._show_card_integer
+    elif compiled:
+      strategy_compiler.bind(self)
+    if not integer and rounding != 'exact':
+      self._set_true_count = self._set_rounded_true_count
+
+  def set_override(self, decision: str, rule) -> None:
+    '''
+    Decide 'insurance', 'surrender', 'split', 'double' or 'stand'
+    with rule(counter, cards, upcard), which returns True or False,
+    or None to leave it to the strategy tables. Most rules need the
+    composition to be tracked.
+    '''
+    assert decision in ('insurance', 'surrender', 'split', 'double', 'stand')
+    if self._integer:
+      raise ValueError('an integer counter has no float true count for the tables to fall back on')
+    self._overrides[decision] = rule
+    # a compiled decision knows nothing of overrides
+    self.__dict__.pop('accepts_' + decision, None)
+
+  def true_count(self) -> float:
+    'the true count of the cards seen so far'
+    if self._true_count is None:
+      self._true_count = self._rounding.whole(self._num / (self._scale * self._units[self._unseen]))
+    return self._true_count
+
+  def composition(self) -> tuple:
+    'the number of unseen cards of each rank of dealer.FACES'
+    if self._remaining is None:
+      raise ValueError('the composition is not being tracked')
+    return tuple(self._remaining[face] for face in dealer.FACES)
+
+  def cards_remaining(self) -> int:
+    'the number of cards unseen'
+    if self._integer:
+      return self._unseen
+    return int(CARDS_PER_DECK * self._decks_in_shoe - self._number_cards_seen)
+
+  def decks_remaining(self) -> float:
+    'the exact number of decks unseen'
+    return self.cards_remaining() / float(CARDS_PER_DECK)
+
+  def ten_density(self) -> float:
+    'the fraction of the unseen cards that are tens'
+    if self._remaining is None:
+      raise ValueError('the composition is not being tracked')
+    return self._remaining['X'] / float(self.cards_remaining())
+
+  def ace_density(self) -> float:
+    'the fraction of the unseen cards that are aces'
+    if self._remaining is None:
+      raise ValueError('the composition is not being tracked')
+    return self._remaining['A'] / float(self.cards_remaining())
+
   def place_insurance_bet(self, bet:float) -> None:
     'remove the insurance bet from the player bankrole'
     self._bankrole -= bet
@@ -68,7 +157,7 @@ class Counter(Player):
     any money from the bankrole, that is
     done with make_bet
     '''
-    scale = self._true_count + self._true_adjust
+    scale = self.true_count() + self._true_adjust
     wager = self._unit * floor(scale + 0.5)
     if wager < self._minimum_bet:
       wager = self._minimum_bet
@@ -105,26 +194,53 @@ class Counter(Player):
     '''
     assert upcard == 'A'
     assert len(cards) == 2
+    if self._overrides:
+      decision = self._override('insurance', cards, upcard)
+      if decision is not None:
+        return decision
     try:
       hand = self._handsort(cards)
       return self._true_count >= self._insurance[hand]
     except KeyError:
       return False
     
+  def _override(self, decision:str, cards:str, upcard:str):
+    'the decision of an override rule, or None'
+    rule = self._overrides.get(decision)
+    if rule is None:
+      return None
+    return rule(self, cards, upcard)
+
   def accepts_surrender(self, cards:str, upcard:str) -> bool:
     'Required by the Player interface'
+    if self._overrides:
+      decision = self._override('surrender', cards, upcard)
+      if decision is not None:
+        return decision
     return self._accepts(cards, upcard, self._surrender)
 
   def accepts_split(self, cards:str, upcard:str) -> bool:
     'Required by the Player interface'
+    if self._overrides:
+      decision = self._override('split', cards, upcard)
+      if decision is not None:
+        return decision
     return self._accepts(cards, upcard, self._split)
 
   def accepts_double(self, cards:str, upcard:str) -> bool:
     'Required by the Player interface'
+    if self._overrides:
+      decision = self._override('double', cards, upcard)
+      if decision is not None:
+        return decision
     return self._accepts(cards, upcard, self._double)
 
   def accepts_stand(self, cards:str, upcard:str) -> bool:
     'Required by the Player interface'
+    if self._overrides:
+      decision = self._override('stand', cards, upcard)
+      if decision is not None:
+        return decision
     value, soft = hand_value(cards)
     if soft:
       table = self._soft_stand
@@ -139,25 +255,84 @@ class Counter(Player):
 
   def show_card(self, card : str) -> None:
     'The player sees a card that has been dealt to the table'
-    print('counter sees', card)
     assert len(card) == 1
     self._number_cards_seen += 1.0
     self._count += self._counts[card]
     self._set_true_count()
+    if self._remaining is not None:
+      self._remaining[card] -= 1
 
   def show_decks_in_shoe(self, decks_in_shoe:int) -> None:
     '''
     Tells the counter the number of decks in the shoe.
     This is needed for calculating the true count.
+    It happens at the start of each shoe so the count
+    starts over.
     '''
     self._decks_in_shoe = float(decks_in_shoe)
+    self._count = 0.0
+    self._number_cards_seen = 0.0
+    self._true_count = 0.0
+    self._num = 0
+    self._unseen = int(CARDS_PER_DECK * decks_in_shoe)
+    self._make_units()
+    if self._track_composition:
+      self._remaining = {face : n * decks_in_shoe
+                         for face, n in zip(dealer.FACES, dealer.RANKS_PER_DECK)}
+
+  def _show_card_integer(self, card : str) -> None:
+    'show_card in whole numbers, leaving the true count until it is asked for'
+    self._num += self._scaled_counts[card]
+    self._unseen -= 1
+    self._true_count = None
+    if self._remaining is not None:
+      self._remaining[card] -= 1
+
+  def _make_units(self) -> None:
+    if self._integer or self._rounding.name != 'exact':
+      self._units = units_left(int(CARDS_PER_DECK * self._decks_in_shoe), self._rounding)
 
   def _set_true_count(self) -> None:
-    'set self.value to the current value'
-    number_cards = CARDS_PER_DECK * self._decks_in_shoe
-    number_cards_unseen = number_cards - self._number_cards_seen
-    number_decks_unseen = number_cards_unseen / CARDS_PER_DECK
-    self._true_count = self._count / number_decks_unseen
+    '''
+    set self.value to the current value, with one division so that
+    it is the exact true count correctly rounded
+    '''
+    number_cards_unseen = CARDS_PER_DECK * self._decks_in_shoe - self._number_cards_seen
+    self._true_count = self._count * CARDS_PER_DECK / number_cards_unseen
+
+  def _set_rounded_true_count(self) -> None:
+    '_set_true_count by a rounding other than exact'
+    unseen = int(CARDS_PER_DECK * self._decks_in_shoe - self._number_cards_seen)
+    self._true_count = float_true(self._count, unseen, self._rounding, self._units)
+
+  def get_state(self) -> dict:
+    'the count and the money, everything that changes during a run'
+    return {
+        'true_count' : self.true_count(),
+        'count' : self._count,
+        'decks_in_shoe' : self._decks_in_shoe,
+        'number_cards_seen' : self._number_cards_seen,
+        'minimum_bet' : self._minimum_bet,
+        'maximum_bet' : self._maximum_bet,
+        'bankrole' : self._bankrole,
+        'remaining' : None if self._remaining is None else dict(self._remaining),
+        'num' : self._num,
+        'unseen' : self._unseen,
+    }
+
+  def set_state(self, state:dict) -> None:
+    self._true_count = state['true_count']
+    self._count = state['count']
+    self._decks_in_shoe = state['decks_in_shoe']
+    self._number_cards_seen = state['number_cards_seen']
+    self._num = state.get('num', 0)
+    self._unseen = state.get('unseen', 0)
+    self._make_units()
+    self._minimum_bet = state['minimum_bet']
+    self._maximum_bet = state['maximum_bet']
+    self._bankrole = state['bankrole']
+    remaining = state.get('remaining')
+    self._remaining = None if remaining is None else dict(remaining)
 
   def _handsort(self, cards:str) -> str:
     '''
@@ -170,6 +345,51 @@ class Counter(Player):
     hand.sort(key=keyfun)
     return ''.join(hand)
 
+def insure_by_ten_density(counter, cards, upcard):
+  '''
+  Insure whenever the bet is favourable: the hole card is one of the
+  unseen cards, so it is a ten with chance the ten density, and the
+  bet pays 2 to 1.
+  '''
+  return counter.ten_density() > 1.0 / 3.0
+
+def stand_by_dealer_table(counter, cards, upcard):
+  '''
+  Stand or hit a hard 12 to 16 by comparing standing with taking one
+  card and standing, using the dealer outcomes of dealer.get_table
+  adjusted for the cards already seen. Other hands are left to the
+  strategy tables.
+  '''
+  value, soft = hand_value(cards)
+  if soft or not 12 <= value <= 16:
+    return None
+  n_decks = int(counter._decks_in_shoe + 0.5)
+  table = dealer.get_table(n_decks)
+  removed = [n * n_decks - left for n, left in zip(dealer.RANKS_PER_DECK, counter.composition())]
+  removed[dealer.FACES.index(upcard)] -= 1   # the table has the upcard out already
+  outcomes = table.adjust_removed(upcard, removed)
+  def stand_ev(total):
+    if total > 21:
+      return -1.0
+    answer = outcomes[dealer.BUST]
+    for final in range(17, 22):
+      chance = outcomes[final - 17]
+      if total > final:
+        answer += chance
+      elif total < final:
+        answer -= chance
+    return answer
+  remaining = counter.composition()
+  n_left = float(counter.cards_remaining())
+  hit_ev = sum(left / n_left * stand_ev(value + dealer.RANK_VALUES[rank])
+               for rank, left in enumerate(remaining) if left)
+  return stand_ev(value) >= hit_ev
+
+OVERRIDES = {
+    'insurance' : insure_by_ten_density,
+    'stand' : stand_by_dealer_table,
+}
+
 def test0() -> None:
   'Just at test'
   # Set everything done
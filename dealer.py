@@ -0,0 +1,274 @@
+'''
+dealer.py
+
+Exact probabilities of the dealer's final hand for each upcard.
+
+The outcomes are a final total of 17, 18, 19, 20 or 21, a bust,
+or a blackjack. With peek the dealer has already checked under
+an ace or a ten and the hand is known not to be a blackjack, so
+the distribution is conditioned on that and the blackjack
+probability is zero.
+
+The distributions are exact for an infinite deck (n_decks=0) and
+for any finite number of decks, the upcard having been removed
+from a full shoe. Each table is computed once, written to a small
+binary file in the cache directory and after that loaded on first
+use. Loaded tables are shared and made of tuples so nobody can
+change them.
+
+Each table also holds the effect of removal of every rank: the
+change in the distribution when one card of that rank leaves the
+shoe (leaves a single deck for the infinite deck). A linear sum of
+these gives a fast approximation of the distribution for any shoe
+composition or true count without doing the recursion again.
+'''
+
+import struct
+import threading
+from array import array
+from cache import cache_path, write_atomic
+
+FACES = '23456789XA'
+RANK_VALUES = (2, 3, 4, 5, 6, 7, 8, 9, 10, 1)
+RANKS_PER_DECK = (4, 4, 4, 4, 4, 4, 4, 4, 16, 4)
+OUTCOMES = ('17', '18', '19', '20', '21', 'bust', 'blackjack')
+N_OUTCOMES = len(OUTCOMES)
+BUST = 5
+BLACKJACK = 6
+TEN = 8
+ACE = 9
+
+_HEADER = struct.Struct('<4sBB')
+_MAGIC = b'DLR1'
+_TABLES = {}
+_TABLES_LOCK = threading.Lock()
+
+def _final(counts, total, has_ace, hit_soft_17, infinite, memo):
+  '''
+  Distribution of the outcomes from a dealer hand with the given
+  hard total, drawing from counts.
+  '''
+  soft = has_ace and total <= 11
+  value = total + 10 if soft else total
+  if value > 21:
+    answer = [0.0] * N_OUTCOMES
+    answer[BUST] = 1.0
+    return answer
+  if value > 17 or (value == 17 and not (hit_soft_17 and soft)):
+    answer = [0.0] * N_OUTCOMES
+    answer[value - 17] = 1.0
+    return answer
+  key = (counts, total, has_ace)
+  answer = memo.get(key)
+  if answer is not None:
+    return answer
+  answer = [0.0] * N_OUTCOMES
+  n_cards = float(sum(counts))
+  for rank in range(10):
+    count = counts[rank]
+    if count <= 0:
+      continue
+    if infinite:
+      rest = counts
+    else:
+      rest = counts[:rank] + (count - 1,) + counts[rank + 1:]
+    sub = _final(rest, total + RANK_VALUES[rank], has_ace or rank == ACE,
+                 hit_soft_17, infinite, memo)
+    weight = count / n_cards
+    for i_outcome in range(N_OUTCOMES):
+      answer[i_outcome] += weight * sub[i_outcome]
+  memo[key] = answer
+  return answer
+
+def distribution(counts, upcard, hit_soft_17=False, peek=True, infinite=False, memo=None):
+  '''
+  The exact distribution of the dealer outcomes for an upcard
+  (a rank index 0..9) drawing from counts, a tuple of the number
+  of cards of each rank, or of the weights of each rank for an
+  infinite deck. For a finite shoe the upcard must still be in
+  counts; it is removed here.
+  '''
+  if memo is None:
+    memo = {}
+  counts = tuple(counts)
+  if not infinite:
+    counts = counts[:upcard] + (counts[upcard] - 1,) + counts[upcard + 1:]
+  answer = [0.0] * N_OUTCOMES
+  n_allowed = 0.0
+  for hole in range(10):
+    count = counts[hole]
+    if count <= 0:
+      continue
+    natural = (upcard == ACE and hole == TEN) or (upcard == TEN and hole == ACE)
+    if natural and peek:
+      continue
+    n_allowed += count
+    if natural:
+      answer[BLACKJACK] += count
+      continue
+    if infinite:
+      rest = counts
+    else:
+      rest = counts[:hole] + (count - 1,) + counts[hole + 1:]
+    sub = _final(rest, RANK_VALUES[upcard] + RANK_VALUES[hole],
+                 upcard == ACE or hole == ACE, hit_soft_17, infinite, memo)
+    for i_outcome in range(N_OUTCOMES):
+      answer[i_outcome] += count * sub[i_outcome]
+  return [x / n_allowed for x in answer]
+
+def shoe_counts(n_decks):
+  'the number of cards of each rank in a full shoe'
+  return tuple(n_decks * n for n in RANKS_PER_DECK)
+
+def true_count_removed(true_count):
+  '''
+  Cards removed per deck for a Hi-Lo true count, spread evenly:
+  each low rank loses true_count/10 and the ten and ace ranks
+  gain true_count/2 between them in proportion to their numbers.
+  Negative entries are cards added.
+  '''
+  low = true_count / 10.0
+  high = -true_count / 2.0
+  return (low, low, low, low, low, 0.0, 0.0, 0.0, high * 16.0 / 20.0, high * 4.0 / 20.0)
+
+class DealerTable:
+  '''
+  The dealer outcome distribution for every upcard under one set
+  of rules, with the effects of removal. Get one with get_table.
+  '''
+  def __init__(self, n_decks, hit_soft_17, peek, probabilities, eor):
+    self.n_decks = n_decks
+    self.hit_soft_17 = hit_soft_17
+    self.peek = peek
+    self.probabilities = probabilities   # [upcard][outcome]
+    self.eor = eor                       # [upcard][rank][outcome]
+
+  def get(self, upcard: str):
+    'the outcome probabilities for an upcard face from "23456789XA"'
+    return self.probabilities[FACES.index(upcard)]
+
+  def bust(self, upcard: str) -> float:
+    return self.get(upcard)[BUST]
+
+  def adjust_removed(self, upcard: str, removed):
+    '''
+    Approximate distribution after the cards in removed, the
+    number of each rank taken out of the shoe (out of each deck
+    for the infinite deck), have gone.
+    '''
+    i_upcard = FACES.index(upcard)
+    answer = list(self.probabilities[i_upcard])
+    for rank, n_removed in enumerate(removed):
+      if n_removed:
+        effects = self.eor[i_upcard][rank]
+        for i_outcome in range(N_OUTCOMES):
+          answer[i_outcome] += n_removed * effects[i_outcome]
+    return answer
+
+  def adjust_true(self, upcard: str, true_count: float):
+    'Approximate distribution at a Hi-Lo true count'
+    per_deck = true_count_removed(true_count)
+    scale = float(self.n_decks) if self.n_decks else 1.0
+    return self.adjust_removed(upcard, [scale * x for x in per_deck])
+
+  def to_bytes(self):
+    flags = (1 if self.hit_soft_17 else 0) | (2 if self.peek else 0)
+    values = array('d')
+    for row in self.probabilities:
+      values.extend(row)
+    for upcard_eor in self.eor:
+      for row in upcard_eor:
+        values.extend(row)
+    return _HEADER.pack(_MAGIC, self.n_decks, flags) + values.tobytes()
+
+  @classmethod
+  def from_bytes(cls, data):
+    magic, n_decks, flags = _HEADER.unpack_from(data)
+    if magic != _MAGIC:
+      raise ValueError('not a dealer table')
+    values = array('d')
+    values.frombytes(data[_HEADER.size:])
+    def rows(start, n_rows):
+      return tuple(tuple(values[start + i * N_OUTCOMES:start + (i + 1) * N_OUTCOMES])
+                   for i in range(n_rows))
+    probabilities = rows(0, 10)
+    eor = tuple(rows(10 * N_OUTCOMES + i_upcard * 10 * N_OUTCOMES, 10)
+                for i_upcard in range(10))
+    return cls(n_decks, bool(flags & 1), bool(flags & 2), probabilities, eor)
+
+def compute_table(n_decks, hit_soft_17=False, peek=True):
+  'compute a DealerTable from scratch, n_decks=0 for an infinite deck'
+  infinite = n_decks == 0
+  if infinite:
+    counts = tuple(float(n) for n in RANKS_PER_DECK)
+  else:
+    counts = shoe_counts(n_decks)
+  probabilities = []
+  eor = []
+  memo = {}
+  for upcard in range(10):
+    base = distribution(counts, upcard, hit_soft_17, peek, infinite, memo)
+    probabilities.append(tuple(base))
+    upcard_eor = []
+    for rank in range(10):
+      # one card fewer of the rank, from the shoe or from a single deck
+      fewer = counts[:rank] + (counts[rank] - 1,) + counts[rank + 1:]
+      removed = distribution(fewer, upcard, hit_soft_17, peek, infinite,
+                             memo if not infinite else {})
+      upcard_eor.append(tuple(b - a for a, b in zip(base, removed)))
+    eor.append(tuple(upcard_eor))
+  return DealerTable(n_decks, hit_soft_17, peek, tuple(probabilities), tuple(eor))
+
+def _file_name(n_decks, hit_soft_17, peek):
+  return 'dealer-{0}-{1}-{2}.bin'.format(
+      '{0}d'.format(n_decks) if n_decks else 'inf',
+      'h17' if hit_soft_17 else 's17',
+      'peek' if peek else 'nopeek')
+
+def get_table(n_decks=6, hit_soft_17=False, peek=True) -> DealerTable:
+  '''
+  The shared DealerTable for the rules, loaded from the cache
+  directory or computed and saved on first use, by whichever thread
+  asks first.
+  '''
+  key = (n_decks, hit_soft_17, peek)
+  table = _TABLES.get(key)
+  if table is not None:
+    return table
+  with _TABLES_LOCK:
+    table = _TABLES.get(key)
+    if table is None:
+      path = cache_path(_file_name(n_decks, hit_soft_17, peek))
+      try:
+        with open(path, 'rb') as fobj:
+          table = DealerTable.from_bytes(fobj.read())
+      except (FileNotFoundError, ValueError, struct.error):
+        table = DealerTable.from_bytes(compute_table(n_decks, hit_soft_17, peek).to_bytes())
+        write_atomic(path, table.to_bytes())
+      _TABLES[key] = table
+  return table
+
+def test():
+  'print the tables for six decks and check them against a simulation'
+  import random
+  from rules import dealer_must_hit, hand_value
+  table = get_table(6, hit_soft_17=False, peek=True)
+  print('{0:>6}'.format('up') + ''.join('{0:>10}'.format(x) for x in OUTCOMES))
+  for face in FACES:
+    print('{0:>6}'.format(face) + ''.join('{0:>10.5f}'.format(p) for p in table.get(face)))
+  print('6 up at true +5 bust (approx): {0:.5f}'.format(table.adjust_true('6', 5.0)[BUST]))
+
+  rng = random.Random(1)
+  rest = list('23456789XXXXA' * 24)
+  rest.remove('6')
+  busts = 0
+  for _ in range(100000):
+    cards = rng.sample(rest, 12)   # the hole card then the draws
+    hand = '6' + cards.pop(0)
+    while dealer_must_hit(hand):
+      hand += cards.pop(0)
+    busts += hand_value(hand)[0] > 21
+  print('6 up bust simulated: {0:.5f}'.format(busts / 100000.0))
+
+if __name__ == '__main__':
+  test()
@@ -0,0 +1,162 @@
+'''
+dealer_kernel.py
+
+Plays many dealer hands at once with NumPy.
+
+Cards are rank codes 0..9 for the faces '23456789XA'. Each hand
+starts from its downcard and upcard, as dealt by table.Table, and
+draws from its own row of a 2-D array of the cards that follow in
+the shoe. All of the hands take their next card together; a hand
+that has finished simply ignores the rest of its row.
+
+The results are the same as playing each hand card by card with
+rules.dealer_must_hit.
+'''
+
+import time
+import numpy                      # pylint: disable=import-error
+from rules import dealer_must_hit, hand_value
+
+FACES = '23456789XA'
+ACE = 9
+RANK_VALUES = numpy.array([2, 3, 4, 5, 6, 7, 8, 9, 10, 1], dtype=numpy.int8)
+MAX_DRAWS = 12    # no dealer hand from a real shoe draws more than this
+
+_FACE_CODES = numpy.full(256, 255, dtype=numpy.uint8)
+for _code, _face in enumerate(FACES):
+  _FACE_CODES[ord(_face)] = _code
+_FACES_ARRAY = numpy.frombuffer(FACES.encode('ascii'), dtype=numpy.uint8)
+
+def encode(cards) -> numpy.ndarray:
+  'rank codes for a string (or list) of faces from "23456789XA"'
+  if not isinstance(cards, str):
+    cards = ''.join(cards)
+  codes = _FACE_CODES[numpy.frombuffer(cards.encode('ascii'), dtype=numpy.uint8)]
+  if (codes == 255).any():
+    raise ValueError('unknown face in ' + cards)
+  return codes
+
+def decode(codes) -> str:
+  'the faces of an array of rank codes, the inverse of encode'
+  return _FACES_ARRAY[numpy.asarray(codes)].tobytes().decode('ascii')
+
+def _must_hit(total, has_ace, hit_soft_17):
+  'vectorised rules.dealer_must_hit on hard totals'
+  soft = has_ace & (total <= 11)
+  value = numpy.where(soft, total + 10, total)
+  hit = value < 17
+  if hit_soft_17:
+    hit |= soft & (value == 17)
+  return hit
+
+def play(downcards, upcards, draws, hit_soft_17=False, valid=None):
+  '''
+  downcards and upcards are arrays of n rank codes and draws is an
+  n by m array whose row i holds the cards that follow the dealer's
+  two cards for hand i. valid, as from windows, marks the cards of
+  draws that are in the shoe. Returns the final totals (22 or more
+  is a bust) and the number of cards drawn from each row.
+  '''
+  downcards = numpy.asarray(downcards)
+  upcards = numpy.asarray(upcards)
+  draws = numpy.asarray(draws)
+  total = RANK_VALUES[downcards].astype(numpy.int16) + RANK_VALUES[upcards]
+  has_ace = (downcards == ACE) | (upcards == ACE)
+  n_drawn = numpy.zeros(len(total), dtype=numpy.int16)
+  active = _must_hit(total, has_ace, hit_soft_17)
+  for column in range(draws.shape[1]):
+    if not active.any():
+      break
+    card = draws[:, column]
+    if valid is not None and (active & ~valid[:, column]).any():
+      raise ValueError('a hand runs past the end of its shoe')
+    total += numpy.where(active, RANK_VALUES[card], 0)
+    has_ace |= active & (card == ACE)
+    n_drawn += active
+    active &= _must_hit(total, has_ace, hit_soft_17)
+  if active.any():
+    raise ValueError('not enough cards in draws to finish every hand')
+  final = numpy.where(has_ace & (total <= 11), total + 10, total)
+  return final, n_drawn
+
+def windows(shoes, positions, width=MAX_DRAWS):
+  '''
+  Aligned slices of a shoe buffer. shoes is a 2-D array with one
+  shoe of rank codes per row (or a single 1-D shoe) and positions
+  gives, for each hand, the row and the index of its first draw
+  as (rows, starts), or just starts for a single shoe. Only the
+  cards of the windows are gathered, so shoes may be a view of a
+  whole pool. Returns the windows and a mask of which of their cards
+  are in the shoe; those past the end repeat its last card.
+  '''
+  shoes = numpy.atleast_2d(numpy.asarray(shoes))
+  if isinstance(positions, tuple):
+    rows, starts = positions
+  else:
+    rows, starts = numpy.zeros(len(positions), dtype=numpy.intp), positions
+  columns = numpy.asarray(starts)[:, None] + numpy.arange(width)
+  valid = columns < shoes.shape[1]
+  return shoes[numpy.asarray(rows)[:, None], numpy.minimum(columns, shoes.shape[1] - 1)], valid
+
+def play_scalar(downcard, upcard, draws, hit_soft_17=False):
+  'one hand card by card, as table.Table plays the dealer'
+  hand = downcard + upcard
+  n_drawn = 0
+  while dealer_must_hit(hand, hit_soft_17):
+    hand += draws[n_drawn]
+    n_drawn += 1
+  return hand_value(hand)[0], n_drawn
+
+def test(n_shoes=2000, n_decks=6):
+  '''
+  Deal shoes with shoe.Shoe, start dealer hands at random
+  positions in them, play them all with the kernel and one at a time with
+  the scalar engine, and compare. Also reports hands per second.
+  '''
+  from shoe import Shoe
+  shoe = Shoe(n_decks=n_decks, seed=11)
+  faces = []
+  for _ in range(n_shoes):
+    shoe.shuffle()
+    faces.append(''.join(shoe.shoe))
+  n_cards = len(faces[0])
+  codes = numpy.stack([encode(cards) for cards in faces])
+  rng = numpy.random.default_rng(3)
+  n_hands = n_shoes * 20
+  rows = rng.integers(0, n_shoes, n_hands)
+  starts = rng.integers(0, n_cards - 2 - MAX_DRAWS, n_hands)
+  downcards = codes[rows, starts]
+  upcards = codes[rows, starts + 1]
+  draws, valid = windows(codes, (rows, starts + 2))
+  assert valid.all()
+  ends, ends_valid = windows(codes, (rows[:3], numpy.full(3, n_cards - 4)))
+  assert ends_valid.sum(axis=1).tolist() == [4, 4, 4] and (ends[:, 4:] == ends[:, 3:4]).all()
+  try:
+    play(numpy.zeros(3, dtype=numpy.uint8), numpy.zeros(3, dtype=numpy.uint8),
+         numpy.zeros((3, MAX_DRAWS), dtype=numpy.uint8), valid=ends_valid)
+    assert False, 'a hand past the end of the shoe was played'
+  except ValueError:
+    pass
+
+  for hit_soft_17 in (False, True):
+    start = time.perf_counter()
+    final, n_drawn = play(downcards, upcards, draws, hit_soft_17, valid)
+    vector_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    mismatches = 0
+    for i_hand in range(n_hands):
+      cards = faces[rows[i_hand]]
+      begin = starts[i_hand]
+      total, used = play_scalar(cards[begin], cards[begin + 1],
+                                cards[begin + 2:], hit_soft_17)
+      if total != final[i_hand] or used != n_drawn[i_hand]:
+        mismatches += 1
+    scalar_seconds = time.perf_counter() - start
+    print('{0}: {1} hands, {2} mismatches, vector {3:.0f} hands/s, scalar {4:.0f} hands/s'.format(
+        'H17' if hit_soft_17 else 'S17', n_hands, mismatches,
+        n_hands / vector_seconds, n_hands / scalar_seconds))
+    assert mismatches == 0
+
+if __name__ == '__main__':
+  test()
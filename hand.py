@@ -2,6 +2,8 @@
 hand.py
 '''
 
+from rules import is_blackjack
+
 class Hand:
   '''
 Each hand contains a set of cards and a wager.
@@ -13,6 +15,8 @@ Each hand contains a set of cards and a wager.
     self.__cards = ''
     self.__bet = 0.0
     self.__insurance_bet = 0.0
+    self.__from_split = False
+    self.__settled = False
 
   @property
   def cards(self):
@@ -38,3 +42,24 @@ Each hand contains a set of cards and a wager.
   def insurance_bet(self, x):
     self.__insurance_bet = x
 
+  @property
+  def from_split(self):
+    'True if the hand was made by splitting a pair'
+    return self.__from_split
+
+  @from_split.setter
+  def from_split(self, x):
+    self.__from_split = x
+
+  @property
+  def settled(self):
+    'True once the bet on the hand has been won, lost or pushed'
+    return self.__settled
+
+  @settled.setter
+  def settled(self, x):
+    self.__settled = x
+
+  def is_blackjack(self):
+    'A two card 21 is only a blackjack if it was not made by a split'
+    return not self.__from_split and is_blackjack(self.__cards)
@@ -0,0 +1,57 @@
+'''
+house_edge.py
+
+The effect of each rule on the house edge, from one batched run.
+
+The base rules and every one of rules.RULE_VARIANTS are played by
+the same strategy in one Lockstep, so every variant is dealt the
+same shoes and the luck of the shoes cancels from its difference
+with the base. The bet is flat, the table minimum and maximum
+being the same, so the house edge is minus the EV per round over
+the bet.
+
+  > python house_edge.py [strategy.json] [n_shoes]
+'''
+
+import sys
+import time
+from lockstep import Lockstep
+from rules import DEFAULT_RULES, RULE_VARIANTS
+
+def house_edges(strategy='strategy1.json', n_shoes=2000, bet=100.0, seed=1,
+                base=DEFAULT_RULES, variants=None):
+  '''
+  [(name, house edge, change from the base, its standard error)]
+  with the base first, all as fractions of the bet
+  '''
+  variants = RULE_VARIANTS if variants is None else variants
+  names = ['base'] + list(variants)
+  rule_sets = [base] + [base._replace(**variant) for variant in variants.values()]
+  lockstep = Lockstep([strategy] * len(rule_sets), seed=seed,
+                      minimum_bet=bet, maximum_bet=bet,
+                      rule_sets=rule_sets, names=names)
+  lockstep.run(n_shoes)
+  answer = [('base', -lockstep.ev(0) / bet, 0.0, 0.0)]
+  for i_rules in range(1, len(rule_sets)):
+    difference, se_paired, _ = lockstep.compare(i_rules)
+    answer.append((names[i_rules], -lockstep.ev(i_rules) / bet, -difference / bet, se_paired / bet))
+  return answer
+
+def main():
+  'main entry point: args = [strategy.json] [n_shoes]'
+  args = sys.argv[1:]
+  n_shoes = 2000
+  if args and args[-1].isdigit():
+    n_shoes = int(args.pop())
+  strategy = args[0] if args else 'strategy1.json'
+  start = time.perf_counter()
+  edges = house_edges(strategy, n_shoes)
+  elapsed = time.perf_counter() - start
+  print('{0} shoes of {1} rule sets in {2:.1f} s'.format(n_shoes, len(edges), elapsed))
+  print('{0:<18} {1:>10} {2:>18}'.format('rules', 'edge %', 'change %'))
+  for name, edge, change, se in edges:
+    print('{0:<18} {1:>+10.3f} {2:>+10.3f} +/- {3:.3f}'.format(
+        name, 100.0 * edge, 100.0 * change, 100.0 * se))
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,156 @@
+'''
+lockstep.py
+
+Compares strategies by playing them on the same shoes.
+
+Each strategy plays at its own Table, which keeps its own copy of
+the table state, but every Table deals the very same shuffled shoe.
+Whatever luck a shoe brings is shared by all of the strategies, so
+it cancels from the difference of their results and far fewer
+shoes are needed to tell them apart.
+
+The shoes are the units of pairing. For every shoe the net result
+and the number of rounds of each strategy go into one Covariance.
+The EV per round of a strategy is its total net over its total
+rounds, and the standard error of the difference of two of them
+comes from the delta method, with and without the covariance
+between them. The ratio of the two variances is the number of
+times more shoes that independent runs would need to reach the
+same precision.
+
+  > python lockstep.py strategy1.json strategy2.json [n_shoes]
+
+The Tables can also play different rules, one RuleSet per
+strategy, to compare the rules on common shoes (see house_edge.py).
+'''
+
+import sys
+import math
+from shoe import Shoe
+from table import Table
+from rules import DEFAULT_RULES
+from counter import Counter
+from stats import Covariance
+
+class Lockstep:
+  '''
+  One Table per strategy, all dealt from one shoe
+  '''
+  def __init__(self, strategies, n_decks=6, decks_cut=1.5, seed=1,
+               minimum_bet=100.0, maximum_bet=3000.0, rule_sets=None, names=None):
+    '''
+    rule_sets is a RuleSet for each strategy, all DEFAULT_RULES if
+    None, and names label the strategies in the report
+    '''
+    self.strategies = strategies
+    self.names = names or strategies
+    rule_sets = rule_sets or [DEFAULT_RULES] * len(strategies)
+    self.shoe = Shoe(n_decks=n_decks, seed=seed)
+    self.tables = []
+    self.nets = [0.0] * len(strategies)
+    self.rounds = [0] * len(strategies)
+    for i_strategy, strategy in enumerate(strategies):
+      table = Table(n_places=1, n_decks=n_decks, seed=seed, decks_cut=decks_cut,
+                    minimum_bet=minimum_bet, maximum_bet=maximum_bet,
+                    rules=rule_sets[i_strategy])
+      table.sit_down(0, Counter(json_file_path=strategy))
+      table.set_recorder(self._recorder(i_strategy))
+      self.tables.append(table)
+    # per shoe: net of strategy 0, rounds of strategy 0, net of 1, ...
+    self.covariance = Covariance(2 * len(strategies))
+
+  def _recorder(self, i_strategy):
+    def recorder(record):
+      self.nets[i_strategy] += record[3]
+      self.rounds[i_strategy] += 1
+    return recorder
+
+  def play_shoe(self):
+    'shuffle once and play the shoe at every table'
+    self.shoe.shuffle()
+    for i_strategy, table in enumerate(self.tables):
+      self.nets[i_strategy] = 0.0
+      self.rounds[i_strategy] = 0
+      table.play_shoe(self.shoe.shoe)
+    values = []
+    for net, rounds in zip(self.nets, self.rounds):
+      values.append(net)
+      values.append(rounds)
+    self.covariance.add(values)
+
+  def run(self, n_shoes):
+    for _ in range(n_shoes):
+      self.play_shoe()
+
+  def ev(self, i_strategy):
+    'EV per round of a strategy'
+    mean = self.covariance.mean
+    return mean[2 * i_strategy] / mean[2 * i_strategy + 1]
+
+  def _gradient(self, i_strategy):
+    'gradient of ev(i_strategy) with respect to its mean net and mean rounds'
+    mean = self.covariance.mean
+    net, rounds = mean[2 * i_strategy], mean[2 * i_strategy + 1]
+    return (1.0 / rounds, -net / (rounds * rounds))
+
+  def _variance(self, terms):
+    '''
+    Variance of the mean of sum(weight * x[index]) over the
+    (index, weight) terms.
+    '''
+    total = 0.0
+    for i, wi in terms:
+      for j, wj in terms:
+        total += wi * wj * self.covariance.covariance(i, j)
+    return total / self.covariance.n
+
+  def compare(self, i_strategy, j_strategy=0):
+    '''
+    Returns (difference in EV per round, its standard error on
+    common shoes, its standard error from independent runs).
+    '''
+    gi = self._gradient(i_strategy)
+    gj = self._gradient(j_strategy)
+    terms_i = [(2 * i_strategy, gi[0]), (2 * i_strategy + 1, gi[1])]
+    terms_j = [(2 * j_strategy, -gj[0]), (2 * j_strategy + 1, -gj[1])]
+    paired = self._variance(terms_i + terms_j)
+    independent = self._variance(terms_i) + self._variance(terms_j)
+    difference = self.ev(i_strategy) - self.ev(j_strategy)
+    return difference, math.sqrt(max(paired, 0.0)), math.sqrt(max(independent, 0.0))
+
+  def report(self):
+    'each strategy against the first'
+    print('shoes: {0}'.format(self.covariance.n))
+    for i_strategy, name in enumerate(self.names):
+      print('{0}: EV {1:+.3f} per round'.format(name, self.ev(i_strategy)))
+    for i_strategy in range(1, len(self.strategies)):
+      difference, se_paired, se_independent = self.compare(i_strategy)
+      print('{0} - {1}: {2:+.3f} +/- {3:.3f} per round'.format(
+          self.names[i_strategy], self.names[0], difference, se_paired))
+      if se_paired > 1e-6 * se_independent:
+        print('  independent runs: +/- {0:.3f}, {1:.1f} times as many shoes'.format(
+            se_independent, (se_independent / se_paired) ** 2))
+      else:
+        print('  the same result on every shoe')
+
+def main():
+  'main entry point: args = strategy_a strategy_b ... [n_shoes]'
+  args = sys.argv[1:]
+  n_shoes = 2000
+  if args and args[-1].isdigit():
+    n_shoes = int(args.pop())
+  if len(args) < 2:
+    print()
+    print("Compare strategies on common shoes")
+    print()
+    print("  Syntax:")
+    print()
+    print("    > python lockstep.py strategy_a.json strategy_b.json ... [n_shoes]")
+    print()
+    sys.exit(1)
+  lockstep = Lockstep(args)
+  lockstep.run(n_shoes)
+  lockstep.report()
+
+if __name__ == '__main__':
+  main()
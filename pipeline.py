@@ -0,0 +1,370 @@
+'''
+pipeline.py
+
+Analyses as a chain of stages over batches: a source of shoes, the
+stages that turn them into rounds, counts or dealer hands, the
+observers that watch them go by, and the sinks that add them up.
+
+A source is an iterator of batches. A stage is a function from an
+iterator of batches to an iterator of batches, usually a generator,
+so a chain of them holds one batch at a time whatever the number of
+shoes. A sink has add(batch) and merge(other). A shoe batch is
+either a list of strings of faces, from the scalar sources, or a 2-D
+array of rank codes 0..9 with a shoe in each row, from the vector
+ones; every stage takes either and as_faces and as_codes convert.
+Rounds are RECORD_DTYPE arrays of round_records.
+
+Stages that compute the same thing come in scalar and vector pairs,
+true_counts_scalar and true_counts_vector, dealer_totals_scalar and
+dealer_totals_vector, which give the same batches for the same
+shoes, so one can stand in for the other. The Table has no vector
+counterpart, so table_rounds is scalar only. shoe_summaries gives
+shoes made on the way the summaries shoe_index keeps for a pool.
+time_stage runs any stage over batches made beforehand, on its own.
+
+The EV by true count of a strategy:
+
+  ev = EVByTrue()
+  run(shuffled_shoes(1000), table_rounds(['strategy1.json']), sinks=[ev])
+  ev.report()
+
+and the distribution of the true count through the shoe:
+
+  histogram = TrueCountByPosition()
+  run(permuted_shoes(100000), true_counts_vector(), sinks=[histogram])
+
+  > python pipeline.py [n_shoes]
+'''
+
+import sys
+import time
+import numpy                      # pylint: disable=import-error
+import dealer_kernel
+from shoe import Shoe
+from table import Table
+from counter import Counter
+from round_records import RoundBuffer
+from shoe_index import summarize, running_counts, true_counts
+from stats import BucketStats, Moments
+from rules import CARDS_PER_DECK, CARD_FACES, SUITS_PER_DECK, DEFAULT_RULES
+
+HI_LO_CODES = numpy.array([+1, +1, +1, +1, +1, 0, 0, 0, -1, -1], dtype=numpy.int8)
+HI_LO_FACES = {face : int(HI_LO_CODES[code]) for code, face in enumerate(dealer_kernel.FACES)}
+
+def as_faces(batch):
+  'a shoe batch as a list of strings of faces'
+  if isinstance(batch, numpy.ndarray):
+    return [dealer_kernel.decode(row) for row in batch]
+  return batch
+
+def as_codes(batch):
+  'a shoe batch as a 2-D array of rank codes'
+  if isinstance(batch, numpy.ndarray):
+    return batch
+  return numpy.stack([dealer_kernel.encode(cards) for cards in batch])
+
+def compose(source, *stages):
+  'the batches that come out of the last of the stages'
+  batches = source
+  for stage in stages:
+    batches = stage(batches)
+  return batches
+
+def run(source, *stages, sinks=()):
+  'pass every batch out of the stages to each of the sinks and return the sinks'
+  for batch in compose(source, *stages):
+    for sink in sinks:
+      sink.add(batch)
+  return sinks
+
+# sources
+
+def shuffled_shoes(n_shoes, n_decks=6, seed=0, batch_shoes=100):
+  '''
+  shoes shuffled by shoe.Shoe, as lists of strings, starting with the
+  shuffle it makes first as a shoe pool does
+  '''
+  shoe = Shoe(n_decks, seed=seed)
+  first = True
+  while n_shoes > 0:
+    batch = []
+    for _ in range(min(batch_shoes, n_shoes)):
+      if not first:
+        shoe.shuffle()
+      first = False
+      batch.append(''.join(shoe.shoe))
+    n_shoes -= len(batch)
+    yield batch
+
+def permuted_shoes(n_shoes, n_decks=6, seed=0, batch_shoes=10000):
+  'shoes shuffled by NumPy, as arrays of rank codes'
+  rng = numpy.random.default_rng(seed)
+  deck = dealer_kernel.encode(CARD_FACES * (n_decks * SUITS_PER_DECK))
+  while n_shoes > 0:
+    n_batch = min(batch_shoes, n_shoes)
+    yield rng.permuted(numpy.broadcast_to(deck, (n_batch, len(deck))), axis=1)
+    n_shoes -= n_batch
+
+def pool_shoes(path, n_shoes=None, first_row=0, batch_shoes=10000):
+  'rows of a shoe_pool file, as arrays of rank codes that are views of the mapping'
+  from shoe_pool import open_pool
+  pool = open_pool(path)
+  end = len(pool) if n_shoes is None else first_row + n_shoes
+  pool.check(end - first_row, first_row)
+  shoes = pool.array()
+  for begin in range(first_row, end, batch_shoes):
+    yield shoes[begin:min(begin + batch_shoes, end)]
+
+# stages
+
+def rebatch(size):
+  'regroup batches, lists or arrays, into batches of size'
+  def stage(batches):
+    held = []
+    n_held = 0
+    for batch in batches:
+      held.append(batch)
+      n_held += len(batch)
+      while n_held >= size:
+        joined = _join(held)
+        yield joined[:size]
+        held = [joined[size:]]
+        n_held -= size
+    if n_held:
+      yield _join(held)
+  return stage
+
+def _join(batches):
+  if isinstance(batches[0], numpy.ndarray):
+    return numpy.concatenate(batches)
+  return [item for batch in batches for item in batch]
+
+def table_rounds(strategies, n_decks=6, decks_cut=1.5, rules=DEFAULT_RULES,
+                 minimum_bet=100.0, maximum_bet=3000.0):
+  '''
+  Play each shoe at a Table with a Counter for each strategy, None
+  for an empty place, and pass on the rounds of each batch
+  '''
+  def stage(batches):
+    table = Table(n_places=len(strategies), n_decks=n_decks, seed=0, decks_cut=decks_cut,
+                  minimum_bet=minimum_bet, maximum_bet=maximum_bet, rules=rules)
+    for i_place, strategy in enumerate(strategies):
+      if strategy is not None:
+        table.sit_down(i_place, Counter(json_file_path=strategy))
+    buffer = RoundBuffer()
+    table.set_recorder(buffer.recorder(table))
+    for batch in batches:
+      for cards in as_faces(batch):
+        table.play_shoe(cards)
+      yield buffer.take()
+  return stage
+
+def true_counts_scalar(decks_cut=1.5):
+  '''
+  [shoe, card] the Hi-Lo true count after each card up to the cut,
+  card by card, as a Counter holds it: the burn card, the first, is
+  never shown and stays among the cards unseen
+  '''
+  def stage(batches):
+    for batch in batches:
+      shoes = as_faces(batch)
+      n_cards = len(shoes[0])
+      n_positions = n_cards - int(CARDS_PER_DECK * decks_cut + 0.5)
+      answer = numpy.empty((len(shoes), n_positions))
+      for i_shoe, cards in enumerate(shoes):
+        count = 0
+        answer[i_shoe, 0] = 0.0
+        for position in range(1, n_positions):
+          count += HI_LO_FACES[cards[position]]
+          answer[i_shoe, position] = count * CARDS_PER_DECK / (n_cards - position)
+      yield answer
+  return stage
+
+def true_counts_vector(decks_cut=1.5):
+  'true_counts_scalar as a cumulative sum over the batch'
+  def stage(batches):
+    for batch in batches:
+      codes = as_codes(batch)
+      n_cards = codes.shape[1]
+      n_positions = n_cards - int(CARDS_PER_DECK * decks_cut + 0.5)
+      yield true_counts(running_counts(codes, n_positions), n_cards)
+  return stage
+
+def dealer_totals_scalar(hit_soft_17=False):
+  '''
+  The final total of a dealer hand dealt from the top of each shoe,
+  22 or more for a bust, hand by hand
+  '''
+  def stage(batches):
+    for batch in batches:
+      yield numpy.array([dealer_kernel.play_scalar(cards[0], cards[1], cards[2:], hit_soft_17)[0]
+                         for cards in as_faces(batch)])
+  return stage
+
+def dealer_totals_vector(hit_soft_17=False):
+  'dealer_totals_scalar with dealer_kernel.play'
+  def stage(batches):
+    for batch in batches:
+      codes = as_codes(batch)
+      yield dealer_kernel.play(codes[:, 0], codes[:, 1], codes[:, 2:2 + dealer_kernel.MAX_DRAWS],
+                               hit_soft_17)[0]
+  return stage
+
+def shoe_summaries(decks_cut=1.5):
+  'the shoe_index records of each batch of shoes'
+  def stage(batches):
+    for batch in batches:
+      yield summarize(as_codes(batch), decks_cut)
+  return stage
+
+# observers
+
+def observe(function):
+  'call function with each batch and pass the batch on'
+  def stage(batches):
+    for batch in batches:
+      function(batch)
+      yield batch
+  return stage
+
+def trace_shoes(fobj):
+  'write each shoe as a line of faces to the open file fobj'
+  def write(batch):
+    for cards in as_faces(batch):
+      fobj.write(cards + '\n')
+  return observe(write)
+
+# sinks
+
+class EVByTrue:
+  '''
+  The rounds of each batch in a stats.BucketStats, bucketed by the
+  true count at the bet, place and actions. Each batch is reduced to
+  the exact moments of its groups with NumPy, which merge into the
+  buckets by Chan's formulas.
+  '''
+  def __init__(self, bucket_width=1.0):
+    self.stats = BucketStats(bucket_width)
+
+  def add(self, records):
+    if len(records) == 0:
+      return
+    buckets = numpy.floor(records['true'].astype(numpy.float64) / self.stats.bucket_width)
+    keys = numpy.stack([buckets.astype(numpy.int64), records['seat'].astype(numpy.int64),
+                        records['actions'].astype(numpy.int64)], axis=1)
+    groups, inverse = numpy.unique(keys, axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    net = records['net'].astype(numpy.float64)
+    counts = numpy.bincount(inverse)
+    means = numpy.bincount(inverse, weights=net) / counts
+    deviations = net - means[inverse]
+    m2s = numpy.bincount(inverse, weights=deviations * deviations)
+    batch = BucketStats(self.stats.bucket_width)
+    for key, n, mean, m2 in zip(groups.tolist(), counts.tolist(), means.tolist(), m2s.tolist()):
+      moments = Moments()
+      moments.n, moments.mean, moments.m2 = n, mean, m2
+      batch.buckets[tuple(key)] = (moments, None)
+    self.stats.merge(batch)
+
+  def merge(self, other):
+    self.stats.merge(other.stats)
+
+  def report(self, i_place=None):
+    self.stats.report(i_place)
+
+class TrueCountByPosition:
+  '''
+  [position, bucket] counts of the true counts of each position in
+  the shoe, the end buckets taking everything beyond them
+  '''
+  def __init__(self, width=0.5, low=-10.0, high=10.0):
+    self.width = width
+    self.low = low
+    self.n_buckets = int(round((high - low) / width))
+    self.counts = None
+
+  def add(self, trues):
+    n_shoes, n_positions = trues.shape
+    if self.counts is None:
+      self.counts = numpy.zeros((n_positions, self.n_buckets), dtype=numpy.int64)
+    buckets = numpy.clip(numpy.floor((trues - self.low) / self.width).astype(numpy.int64),
+                         0, self.n_buckets - 1)
+    flat = buckets + numpy.arange(n_positions) * self.n_buckets
+    self.counts += numpy.bincount(flat.ravel(), minlength=self.counts.size).reshape(self.counts.shape)
+
+  def merge(self, other):
+    if self.counts is None:
+      self.counts = other.counts
+    elif other.counts is not None:
+      self.counts += other.counts
+
+class Tally:
+  'how many times each value came out, for small whole numbers'
+  def __init__(self, size=32):
+    self.counts = numpy.zeros(size, dtype=numpy.int64)
+
+  def add(self, values):
+    self.counts += numpy.bincount(values, minlength=len(self.counts))[:len(self.counts)]
+
+  def merge(self, other):
+    self.counts += other.counts
+
+def time_stage(stage, batches):
+  'shoes (or rows) per second of a stage over a list of batches made beforehand'
+  start = time.perf_counter()
+  n_items = 0
+  for batch in stage(iter(batches)):
+    n_items += len(batch)
+  return n_items / (time.perf_counter() - start)
+
+def test(n_shoes=2000):
+  '''
+  Check the scalar and vector stages agree, time each stage on its
+  own and run a small analysis of each kind
+  '''
+  batches = list(compose(shuffled_shoes(n_shoes, seed=4), rebatch(500)))
+  for name, scalar, vector in (
+      ('true counts', true_counts_scalar(), true_counts_vector()),
+      ('dealer totals', dealer_totals_scalar(), dealer_totals_vector())):
+    for one, other in zip(scalar(iter(batches)), vector(iter(batches))):
+      assert numpy.array_equal(one, other), name
+    print('{0}: scalar {1:.0f} shoes/s, vector {2:.0f} shoes/s'.format(
+        name, time_stage(scalar, batches), time_stage(vector, batches)))
+  counter = Counter(json_file_path='strategy1.json')
+  trues = next(true_counts_vector()(iter(batches[:1])))
+  for i_shoe, cards in enumerate(as_faces(batches[0])[:20]):
+    counter.show_decks_in_shoe(len(cards) // CARDS_PER_DECK)
+    for position, face in enumerate(cards[1:trues.shape[1]], 1):
+      counter.show_card(face)
+      assert trues[i_shoe, position] == counter.true_count()
+  print('table rounds: {0:.0f} records/s'.format(
+      time_stage(table_rounds(['strategy1.json']), batches[:1])))
+
+  ev = EVByTrue(bucket_width=2.0)
+  halves = [EVByTrue(bucket_width=2.0) for _ in range(2)]
+  direct = BucketStats(bucket_width=2.0)
+  for i_batch, records in enumerate(compose(shuffled_shoes(200, seed=1), rebatch(20),
+                                            table_rounds(['strategy1.json']))):
+    ev.add(records)
+    halves[i_batch % 2].add(records)
+    for record in records:
+      direct.add(float(record['true']), int(record['seat']), int(record['actions']),
+                 float(record['net']))
+  halves[0].merge(halves[1])
+  for stats in (ev.stats, halves[0].stats):
+    assert stats.buckets.keys() == direct.buckets.keys()
+    for key, (moments, _) in direct.buckets.items():
+      assert stats.buckets[key][0].n == moments.n
+      assert numpy.isclose(stats.buckets[key][0].mean, moments.mean)
+      assert numpy.isclose(stats.buckets[key][0].m2, moments.m2)
+  ev.report()
+  histogram = TrueCountByPosition()
+  run(permuted_shoes(20000, seed=1), true_counts_vector(), sinks=[histogram])
+  print('true count within +/-1 at the cut: {0:.3f}'.format(
+      histogram.counts[-1, 18:22].sum() / float(histogram.counts[-1].sum())))
+  dealer = Tally()
+  run(permuted_shoes(20000, seed=2), dealer_totals_vector(), sinks=[dealer])
+  print('dealer busts: {0:.4f}'.format(dealer.counts[22:].sum() / float(dealer.counts.sum())))
+
+if __name__ == '__main__':
+  test(*[int(arg) for arg in sys.argv[1:2]])
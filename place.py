@@ -15,6 +15,13 @@ must start with a Hand with an associated bet.
     self.hand = None
   def occupy(self, player):
     self.player = player
+    self.reset()
+  def reset(self):
+    'ready for the next round'
     self.hands = [Hand()]
+    self.bet = 0.0          # the wager made before the cards were dealt
+    self.true_count = 0.0   # true count when the bet was made
+    self.actions = 0        # mask of the actions taken in the round
+    self.net = 0.0          # amount won (+) or lost (-) in the round
 
 
@@ -0,0 +1,215 @@
+'''
+result_cache.py
+
+Keeps the results of the units of simulate.py runs on disk, so that
+running a config again, or with more shoes, only plays the units
+that have not been played before.
+
+A unit is a number of shoes from one seed and its result is the
+mergeable BucketStats and ShoeSample it made, so any set of cached
+units merges into the same statistics as playing them. The key of a
+unit is the hash of
+
+  the config, normalised to what changes a unit's result: the rules,
+  with those left out filled in from rules.DEFAULT_RULES,
+  the decks, the cut, the variance reduction and for each seat the
+  hash of its strategy file rather than its path, its overrides and
+  its true count rounding
+  the unit's seed and number of shoes, and the seed of its first
+  shoe when it comes from a shoe pool
+  ENGINE_VERSION
+
+Entries live in a directory v<ENGINE_VERSION> under the root, with a
+MARKER file saying the cache made it, and opening the cache deletes
+the marked directories of other versions and nothing else, so bumping
+ENGINE_VERSION whenever a change to the engine changes results
+invalidates everything at once. Each hit touches its entry and the
+least recently used entries are deleted once the cache is over
+max_bytes, BJ_RESULT_CACHE_BYTES or 1 GB by default.
+
+  > python result_cache.py [clear | test]
+
+prints the size of the cache, empties it or tests it.
+'''
+
+import os
+import re
+import sys
+import json
+import pickle
+import shutil
+import hashlib
+from cache import cache_path, write_atomic
+from rules import DEFAULT_RULES
+
+ENGINE_VERSION = 2
+DEFAULT_MAX_BYTES = int(os.environ.get('BJ_RESULT_CACHE_BYTES', 1 << 30))
+MARKER = '.result_cache'      # in every version directory the cache makes
+_VERSION_NAME = re.compile(r'^v\d+$')
+
+_FILE_DIGESTS = {}
+
+def file_digest(path):
+  'the hash of the contents of a file, once per process'
+  digest = _FILE_DIGESTS.get(path)
+  if digest is None:
+    with open(path, 'rb') as fobj:
+      digest = _FILE_DIGESTS[path] = hashlib.sha256(fobj.read()).hexdigest()
+  return digest
+
+def normalize(config):
+  'the part of a run config that the result of a unit depends on'
+  seats = []
+  for seat in config['seats']:
+    if seat is None:
+      seats.append(None)
+    else:
+      seats.append({'strategy' : file_digest(seat['strategy']),
+                    'overrides' : sorted(seat.get('overrides', [])),
+                    'rounding' : seat.get('rounding', 'exact')})
+  rules = DEFAULT_RULES._asdict()
+  rules.update(config['rules'])
+  return {
+      'rules' : rules,
+      'n_decks' : config['n_decks'],
+      'decks_cut' : config['decks_cut'],
+      'seats' : seats,
+      'variance_reduction' : config.get('variance_reduction'),
+  }
+
+def unit_key(config, seed, n_shoes, first_shoe_seed=None):
+  '''
+  The key of the unit of n_shoes shoes from seed, first_shoe_seed
+  being the seed of its first shoe when a shoe pool deals them
+  '''
+  text = json.dumps([ENGINE_VERSION, normalize(config), seed, n_shoes, first_shoe_seed],
+                    sort_keys=True)
+  return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+class ResultCache:
+  '''
+  Unit results stored as pickles named by their keys
+  '''
+  def __init__(self, directory=None, max_bytes=DEFAULT_MAX_BYTES):
+    root = directory if directory is not None else cache_path('results')
+    self.root = root
+    self.directory = os.path.join(root, 'v{0}'.format(ENGINE_VERSION))
+    self.max_bytes = max_bytes
+    self.hits = 0
+    self.misses = 0
+    self._make_directory()
+    self.invalidate_other_versions()
+    self.size = sum(size for _, _, size in self._entries())
+
+  def _make_directory(self):
+    os.makedirs(self.directory, exist_ok=True)
+    marker = os.path.join(self.directory, MARKER)
+    if not os.path.exists(marker):
+      with open(marker, 'w') as fobj:
+        fobj.write('{0}\n'.format(ENGINE_VERSION))
+
+  def invalidate_other_versions(self):
+    '''
+    delete the entries of every other ENGINE_VERSION, only from the
+    directories the cache made, which the root may share with others
+    '''
+    for name in os.listdir(self.root):
+      path = os.path.join(self.root, name)
+      if _VERSION_NAME.match(name) and path != self.directory and \
+         os.path.isfile(os.path.join(path, MARKER)):
+        shutil.rmtree(path, ignore_errors=True)
+
+  def _entries(self):
+    '(last used, path, size) of every entry'
+    answer = []
+    with os.scandir(self.directory) as entries:
+      for entry in entries:
+        if entry.name.endswith('.pkl'):
+          info = entry.stat()
+          answer.append((info.st_mtime, entry.path, info.st_size))
+    return answer
+
+  def _path(self, key):
+    return os.path.join(self.directory, key + '.pkl')
+
+  def get(self, key):
+    'the cached result of the unit, or None'
+    path = self._path(key)
+    try:
+      with open(path, 'rb') as fobj:
+        result = pickle.load(fobj)
+    except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+      self.misses += 1
+      return None
+    os.utime(path)
+    self.hits += 1
+    return result
+
+  def put(self, key, result):
+    data = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+    write_atomic(self._path(key), data)
+    self.size += len(data)
+    if self.size > self.max_bytes:
+      self.evict()
+
+  def evict(self):
+    'delete the least recently used entries until the cache fits'
+    entries = sorted(self._entries())
+    self.size = sum(size for _, _, size in entries)
+    for _, path, size in entries:
+      if self.size <= self.max_bytes:
+        break
+      try:
+        os.remove(path)
+      except FileNotFoundError:
+        pass
+      self.size -= size
+
+  def clear(self):
+    shutil.rmtree(self.directory, ignore_errors=True)
+    self._make_directory()
+    self.size = 0
+
+def test():
+  '''
+  Put and get an entry, then open the cache as a later version and
+  check that only the old version's directory goes, not others in
+  the root that look like it
+  '''
+  import tempfile
+  global ENGINE_VERSION
+  root = tempfile.mkdtemp()
+  for name in ('version-1', 'vendor', 'v7'):
+    os.makedirs(os.path.join(root, name))
+    with open(os.path.join(root, name, 'keep.txt'), 'w') as fobj:
+      fobj.write('not the cache\n')
+  cache = ResultCache(root)
+  cache.put('key', (b'stats', None, 10))
+  assert cache.get('key') == (b'stats', None, 10) and cache.get('other') is None
+  old_directory = cache.directory
+  version = ENGINE_VERSION
+  ENGINE_VERSION = version + 1
+  try:
+    newer = ResultCache(root)
+  finally:
+    ENGINE_VERSION = version
+  assert not os.path.exists(old_directory)
+  assert newer.get('key') is None
+  for name in ('version-1', 'vendor', 'v7'):
+    assert os.path.exists(os.path.join(root, name, 'keep.txt')), name
+  shutil.rmtree(root)
+  print('result cache: other versions invalidated, unrelated directories kept')
+
+def main():
+  'main entry point: args = [clear | test]'
+  if sys.argv[1:] == ['test']:
+    test()
+    return
+  cache = ResultCache()
+  if sys.argv[1:] == ['clear']:
+    cache.clear()
+  print('{0}: {1} entries, {2:.1f} MB of {3:.0f} MB'.format(
+      cache.directory, len(cache._entries()), cache.size / 1e6, cache.max_bytes / 1e6))
+
+if __name__ == '__main__':
+  main()
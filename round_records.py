@@ -0,0 +1,191 @@
+'''
+round_records.py
+
+One fixed width record per place per round, kept in a NumPy
+structured array rather than as tuples.
+
+A tuple of eight numbers costs a couple of hundred bytes as Python
+objects; a RECORD_DTYPE row costs 24. A RoundBuffer starts small
+and doubles when full, so appending is amortised O(1), until it
+reaches chunk_rounds rows. A full chunk is then written to its
+directory as chunk-NNNNNN.npy and the buffer starts again, so
+memory stays at one chunk however long the run. 100M rounds take
+2.4 GB on disk, and load_records maps the chunks back in and joins
+them into one array whose columns analysis code works on directly:
+
+  records = load_records('records')
+  records['net'][records['true'] >= 2].mean()
+
+Table.set_recorder(buffer.recorder(table)) fills a buffer from a
+table, working out the shoe, the bet and the cards each round used
+from the table itself.
+
+  > python round_records.py [n_shoes]
+'''
+
+import os
+import sys
+import glob
+import time
+import numpy                      # pylint: disable=import-error
+
+RECORD_DTYPE = numpy.dtype([
+    ('shoe', numpy.int32),        # shoes played at the table before this one
+    ('round', numpy.int32),       # rounds played at the table before this one
+    ('seat', numpy.int8),         # the place
+    ('true', numpy.float32),      # true count when the bet was made
+    ('bet', numpy.float32),       # the initial wager
+    ('actions', numpy.uint8),     # mask of table.ACTION_ bits
+    ('cards', numpy.int16),       # cards dealt in the round, for all places
+    ('net', numpy.float32),       # won (+) or lost (-) in the round
+])
+
+class RoundBuffer:
+  '''
+  Records appended to a growing structured array and, with a path,
+  flushed a chunk at a time to the directory path
+  '''
+  def __init__(self, path=None, chunk_rounds=1 << 20, initial_rounds=1024):
+    self.path = path
+    self.chunk_rounds = chunk_rounds
+    self.array = numpy.empty(min(initial_rounds, chunk_rounds), dtype=RECORD_DTYPE)
+    self.n = 0            # rows of array in use
+    self.n_flushed = 0    # rows written to chunks
+    self.n_chunks = 0
+    if path is not None:
+      os.makedirs(path, exist_ok=True)
+
+  def __len__(self):
+    return self.n_flushed + self.n
+
+  def append(self, shoe, round_index, seat, true, bet, actions, cards, net):
+    if self.n == len(self.array):
+      self._make_room()
+    self.array[self.n] = (shoe, round_index, seat, true, bet, actions, cards, net)
+    self.n += 1
+
+  def _make_room(self):
+    'double the array, or flush it once it is a whole chunk'
+    if self.path is not None and len(self.array) >= self.chunk_rounds:
+      self.flush()
+      return
+    bigger = numpy.empty(2 * len(self.array), dtype=RECORD_DTYPE)
+    bigger[:self.n] = self.array[:self.n]
+    self.array = bigger
+
+  def flush(self):
+    'write the rows held so far as the next chunk'
+    if self.path is None or self.n == 0:
+      return
+    chunk_path = os.path.join(self.path, 'chunk-{0:06d}.npy'.format(self.n_chunks))
+    tmp_path = chunk_path + '.tmp.npy'
+    numpy.save(tmp_path, self.array[:self.n])
+    os.replace(tmp_path, chunk_path)
+    self.n_chunks += 1
+    self.n_flushed += self.n
+    self.n = 0
+
+  def close(self):
+    'flush the last, partial chunk'
+    self.flush()
+
+  def records(self):
+    'the rows still in memory, a view and not a copy'
+    return self.array[:self.n]
+
+  def take(self):
+    'a copy of the rows in memory, which are then dropped'
+    answer = self.array[:self.n].copy()
+    self.n = 0
+    return answer
+
+  def recorder(self, table):
+    '''
+    A recorder for table.set_recorder that appends each place's
+    result. The cards of a round are those dealt since the end of
+    the last round, or since the burn card for the first of a shoe.
+    '''
+    state = {'round' : None, 'start' : 0, 'end' : 0, 'shoe' : None}
+    append = self.append
+    def recorder(record):
+      i_place, true_count, actions, net = record
+      if state['round'] != table.n_rounds:
+        state['round'] = table.n_rounds
+        state['start'] = state['end'] if state['shoe'] == table.n_shoes else 1
+        state['shoe'] = table.n_shoes
+        state['end'] = table.n_cards_dealt
+      append(table.n_shoes - 1, table.n_rounds, i_place, true_count,
+             table.places[i_place].bet, actions, state['end'] - state['start'], net)
+    return recorder
+
+def load_records(path, mmap=True):
+  '''
+  Every record under the directory path, the chunks of one or more
+  RoundBuffers, as one array. With mmap the chunks are mapped, not
+  read, and only the joined array takes memory.
+  '''
+  chunk_paths = sorted(glob.glob(os.path.join(path, '**', 'chunk-*[0-9].npy'), recursive=True))
+  chunks = [numpy.load(chunk_path, mmap_mode='r' if mmap else None) for chunk_path in chunk_paths]
+  if not chunks:
+    return numpy.empty(0, dtype=RECORD_DTYPE)
+  return numpy.concatenate(chunks)
+
+def ev_by_true(records, width=1.0):
+  '''
+  (true count of each bucket, rounds, mean net) for the buckets of
+  width the true count at the bet falls into, from the columns
+  '''
+  buckets = numpy.floor(records['true'] / width).astype(numpy.int64)
+  low = buckets.min() if len(buckets) else 0
+  rounds = numpy.bincount(buckets - low)
+  nets = numpy.bincount(buckets - low, weights=records['net'])
+  used = rounds > 0
+  trues = (numpy.arange(len(rounds)) + low) * width
+  return trues[used], rounds[used], nets[used] / rounds[used]
+
+def test(n_shoes=200):
+  '''
+  Fill a buffer from a table, check it against the recorder tuples,
+  and compare the memory of a million records with tuples
+  '''
+  import tempfile
+  import tracemalloc
+  from table import Table
+  from counter import Counter
+  table = Table(n_places=3, n_decks=6, seed=3, decks_cut=1.5)
+  for i_place in (0, 2):
+    table.sit_down(i_place, Counter('strategy1.json'))
+  path = tempfile.mkdtemp()
+  buffer = RoundBuffer(path, chunk_rounds=4096)
+  tuples = []
+  fill = buffer.recorder(table)
+  def recorder(record):
+    fill(record)
+    tuples.append(record)
+  table.set_recorder(recorder)
+  table.run(n_shoes)
+  buffer.close()
+  records = load_records(path)
+  assert len(records) == len(tuples) == len(buffer)
+  assert numpy.array_equal(records['seat'], [record[0] for record in tuples])
+  assert numpy.allclose(records['net'], [record[3] for record in tuples])
+  per_shoe = numpy.bincount(records['shoe'], weights=records['cards'] * (records['seat'] == 0))
+  print('{0} records in {1} chunks, {2:.1f} cards a shoe before the cut'.format(
+      len(records), buffer.n_chunks, per_shoe.mean()))
+
+  n_rounds = 1000000
+  tracemalloc.start()
+  many = [(i, i, 0, 1.5, 100.0, 0, 12, -100.0) for i in range(n_rounds)]
+  tuple_bytes = tracemalloc.get_traced_memory()[0]
+  del many
+  tracemalloc.stop()
+  buffer = RoundBuffer()
+  start = time.perf_counter()
+  for i in range(n_rounds):
+    buffer.append(i, i, 0, 1.5, 100.0, 0, 12, -100.0)
+  elapsed = time.perf_counter() - start
+  print('a million records: {0:.0f} MB as tuples, {1:.0f} MB as records, {2:.2f} us an append'.format(
+      tuple_bytes / 1e6, buffer.n * RECORD_DTYPE.itemsize / 1e6, 1e6 * elapsed / n_rounds))
+
+if __name__ == '__main__':
+  test(*[int(arg) for arg in sys.argv[1:2]])
@@ -4,7 +4,7 @@ rules.py
 A compendium of blackjack rules and numbers
 '''
 
-from typing import Tuple
+from typing import Tuple, NamedTuple
 
 CARDS_PER_SUIT = 13
 SUITS_PER_DECK = 4
@@ -22,6 +22,17 @@ CARD_INDEXES = {
 
 CARD_FACES = "23456789XXXXA"
 
+HI_LO_COUNTS = {
+  "2" : 1, "3" : 1, "4" : 1, "5" : 1, "6" : 1,
+  "7" : 0, "8" : 0, "9" : 0,
+  "X" : -1, "A" : -1
+}
+
+BLACKJACK_PAYS = 1.5        # a natural is paid 3 to 2
+INSURANCE_PAYS = 2.0        # insurance is paid 2 to 1
+DEALER_HITS_SOFT_17 = False
+MAX_SPLIT_HANDS = 4
+
 HAND_VALUE = Tuple[int, bool]
 
 def hand_value(cards:str) -> HAND_VALUE:
@@ -53,3 +64,65 @@ def is_blackjack(cards) -> bool:
     elif cards[0] == 'X' and cards[1] == 'A':
       return True
   return False
+
+def dealer_must_hit(cards:str, hit_soft_17:bool=DEALER_HITS_SOFT_17) -> bool:
+  '''
+  Returns True if the dealer must draw another card to the
+  hand. The dealer draws to 17 and, when hit_soft_17 is set,
+  also draws to a soft 17.
+  '''
+  value, soft = hand_value(cards)
+  if value < 17:
+    return True
+  return hit_soft_17 and soft and value == 17
+
+def dealer_must_hit_s17(cards:str) -> bool:
+  'dealer_must_hit when the dealer stands on soft 17'
+  return hand_value(cards)[0] < 17
+
+def dealer_must_hit_h17(cards:str) -> bool:
+  'dealer_must_hit when the dealer hits soft 17'
+  value, soft = hand_value(cards)
+  return value < 17 or (soft and value == 17)
+
+class RuleSet(NamedTuple):
+  '''
+  The house rules of a table. The defaults are the rules that
+  table.Table has always played.
+
+  hit_soft_17         the dealer hits soft 17
+  double_after_split  a split hand may be doubled
+  max_split_hands     the most hands a place can split into
+  resplit_aces        split aces that draw an ace may be split again
+  hit_split_aces      split aces are played like any other hand
+                      rather than getting one card each
+  surrender           'none', 'late' (after the dealer checks for a
+                      blackjack) or 'early' (before)
+  blackjack_pays      a natural is paid this times the bet
+  peek                the dealer checks for a blackjack under an ace
+                      or ten; without it the hands are played out and
+                      all lose to a dealer blackjack
+  '''
+  hit_soft_17: bool = DEALER_HITS_SOFT_17
+  double_after_split: bool = True
+  max_split_hands: int = MAX_SPLIT_HANDS
+  resplit_aces: bool = False
+  hit_split_aces: bool = False
+  surrender: str = 'late'
+  blackjack_pays: float = BLACKJACK_PAYS
+  peek: bool = True
+
+DEFAULT_RULES = RuleSet()
+
+# one rule changed from the defaults
+RULE_VARIANTS = {
+    'H17' : {'hit_soft_17' : True},
+    'no DAS' : {'double_after_split' : False},
+    'split to 2 hands' : {'max_split_hands' : 2},
+    'resplit aces' : {'resplit_aces' : True},
+    'hit split aces' : {'hit_split_aces' : True},
+    'no surrender' : {'surrender' : 'none'},
+    'early surrender' : {'surrender' : 'early'},
+    '6:5 blackjack' : {'blackjack_pays' : 1.2},
+    'no peek' : {'peek' : False},
+}
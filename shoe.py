@@ -1,5 +1,5 @@
 '''
-table.py
+shoe.py
 
 This file implements the rules of the casino and runs
 the blackjack game
@@ -9,12 +9,41 @@ import rules
 
 class Shoe:
   def __init__(self, n_decks, seed=0):
-    random.seed(seed)
-    self.shoe = list(rules.CARD_FACES * (n_decks * rules.SUITS_PER_DECK))
-    random.shuffle(self.shoe)
+    self.n_decks = n_decks
+    self.rng = random.Random(seed)
+    self.shuffle()
+
+  def shuffle(self):
+    'gather up all of the cards and shuffle them'
+    self.shoe = list(rules.CARD_FACES * (self.n_decks * rules.SUITS_PER_DECK))
+    self.rng.shuffle(self.shoe)
+    self.position = 0
+
+  def set_cards(self, cards):
+    '''
+    Deal the given cards, already shuffled elsewhere, instead of
+    shuffling. The list is only read so it may be shared.
+    '''
+    self.shoe = cards
+    self.position = 0
 
   def get_card(self):
-    return self.shoe.pop(0)
+    card = self.shoe[self.position]
+    self.position += 1
+    return card
+
+  def get_state(self):
+    'everything needed to carry on dealing from this point'
+    return {
+        'rng' : self.rng.getstate(),
+        'cards' : ''.join(self.shoe),
+        'position' : self.position,
+    }
+
+  def set_state(self, state):
+    self.rng.setstate(state['rng'])
+    self.shoe = list(state['cards'])
+    self.position = state['position']
 
 if __name__ == '__main__':
   n_decks = 6
@@ -0,0 +1,200 @@
+'''
+shoe_index.py
+
+A summary of every shoe of a pool, worked out once with NumPy and
+kept next to it, so questions about the shoes are answered by
+looking at columns rather than by playing them through a Counter.
+
+The index is one fixed width record per shoe, row i summarising
+row i of the pool:
+
+  running       [card] the Hi-Lo running count once the first k + 1
+                cards are out, which a Counter holds: the burn card
+                is never shown, so it is left out
+  max_true      the highest and lowest true count, running count
+  min_true      over decks unseen, the burn card among them as it is
+                for a Counter, before the cut card comes out
+  aces          [i] the position in the shoe of each ace
+  tens          [i] the position of each ten
+  count_at_cut  the running and true counts when the cut card
+  true_at_cut   comes out
+
+It is saved as a .npy file beside the pool, one per depth of cut
+and INDEX_VERSION, and mapped read only, so that
+
+  index = open_index('shoes.pool')
+  (index['max_true'] > 3).mean()
+  numpy.nonzero(index['running'][:, 103] >= 6)[0]
+
+take milliseconds over a million shoes, and the rows they pick are
+the shoes to hand a targeted run through pool.cards(i). summarize
+does the same for any batch of shoes in rank codes, and
+pipeline.shoe_summaries passes one on for each batch of shoes.
+
+  > python shoe_index.py pool_path [decks_cut]
+'''
+
+import os
+import sys
+import time
+import numpy                      # pylint: disable=import-error
+from numpy.lib.format import open_memmap  # pylint: disable=import-error
+from rules import CARDS_PER_DECK, SUITS_PER_DECK
+from shoe_pool import CHUNK_SHOES, open_pool
+
+HI_LO_CODES = numpy.array([+1, +1, +1, +1, +1, 0, 0, 0, -1, -1], dtype=numpy.int8)
+INDEX_VERSION = 2       # bumped whenever the records change
+TEN = 8
+ACE = 9
+
+def index_dtype(n_decks):
+  'the record of one shoe of n_decks decks'
+  n_cards = n_decks * CARDS_PER_DECK
+  return numpy.dtype([
+      ('running', numpy.int16, (n_cards,)),
+      ('max_true', numpy.float32),
+      ('min_true', numpy.float32),
+      ('aces', numpy.int16, (n_decks * SUITS_PER_DECK,)),
+      ('tens', numpy.int16, (4 * n_decks * SUITS_PER_DECK,)),
+      ('count_at_cut', numpy.int16),
+      ('true_at_cut', numpy.float32),
+  ])
+
+def cut_number(n_cards, decks_cut):
+  'cards out of the shoe when the cut card comes out, as Table works it out'
+  return n_cards - int(CARDS_PER_DECK * decks_cut + 0.5)
+
+def running_counts(codes, n_positions=None):
+  '''
+  [shoe, k] the Hi-Lo count a Counter holds once the first k + 1
+  cards of each row of rank codes are out, the first being the burn
+  card it never sees
+  '''
+  tags = HI_LO_CODES[codes[:, :n_positions]]
+  tags[:, 0] = 0
+  return numpy.cumsum(tags, axis=1, dtype=numpy.int16)
+
+def true_counts(running, n_cards):
+  '''
+  [shoe, k] the true counts of running_counts, worked out as
+  Counter does with the burn card among the cards unseen
+  '''
+  return running * float(CARDS_PER_DECK) / (n_cards - numpy.arange(running.shape[1]))
+
+def _positions(codes, code, per_shoe):
+  'the positions of code in each row, which holds per_shoe of them'
+  return numpy.nonzero(codes == code)[1].reshape(len(codes), per_shoe).astype(numpy.int16)
+
+def summarize(codes, decks_cut=1.5, out=None):
+  '''
+  The index records of a [shoe, card] array of rank codes, written
+  into out when it is given
+  '''
+  n_shoes, n_cards = codes.shape
+  n_decks = n_cards // CARDS_PER_DECK
+  if out is None:
+    out = numpy.empty(n_shoes, dtype=index_dtype(n_decks))
+  cut = cut_number(n_cards, decks_cut)
+  running = running_counts(codes)
+  trues = true_counts(running[:, :cut], n_cards)
+  out['running'] = running
+  out['max_true'] = trues.max(axis=1)
+  out['min_true'] = trues.min(axis=1)
+  out['aces'] = _positions(codes, ACE, n_decks * SUITS_PER_DECK)
+  out['tens'] = _positions(codes, TEN, 4 * n_decks * SUITS_PER_DECK)
+  out['count_at_cut'] = running[:, cut - 1]
+  out['true_at_cut'] = trues[:, cut - 1]
+  return out
+
+def index_path(pool_path, decks_cut=1.5):
+  return '{0}.cut{1:g}.v{2}.index.npy'.format(pool_path, decks_cut, INDEX_VERSION)
+
+def build_index(pool_path, decks_cut=1.5):
+  '''
+  Summarise the pool at pool_path a chunk of shoes at a time into
+  its index file, which only appears once it is whole
+  '''
+  pool = open_pool(pool_path)
+  shoes = pool.array()
+  path = index_path(pool_path, decks_cut)
+  tmp_path = '{0}.{1}.tmp.npy'.format(path, os.getpid())
+  index = open_memmap(tmp_path, mode='w+', dtype=index_dtype(pool.n_decks), shape=(len(pool),))
+  for begin in range(0, len(pool), CHUNK_SHOES):
+    end = min(begin + CHUNK_SHOES, len(pool))
+    summarize(shoes[begin:end], decks_cut, index[begin:end])
+  index.flush()
+  del index, shoes
+  os.replace(tmp_path, path)
+  return path
+
+def open_index(pool_path, decks_cut=1.5):
+  '''
+  The index of the pool at pool_path mapped read only, built first
+  if there is none or it is older than the pool
+  '''
+  path = index_path(pool_path, decks_cut)
+  if not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(pool_path):
+    build_index(pool_path, decks_cut)
+  index = numpy.load(path, mmap_mode='r')
+  if len(index) != len(open_pool(pool_path)):
+    raise ValueError('{0} does not index {1}'.format(path, pool_path))
+  return index
+
+def test(n_shoes=20000):
+  '''
+  Index a pool, check some shoes against a Counter dealt them as a
+  Table does, burn card first, and time a few queries
+  '''
+  import tempfile
+  from counter import Counter
+  from shoe_pool import write_pool
+  pool_path = os.path.join(tempfile.mkdtemp(), 'test.pool')
+  write_pool(pool_path, n_shoes, first_seed=3)
+  start = time.perf_counter()
+  index = open_index(pool_path)
+  print('indexed {0} shoes in {1:.2f} s, {2:.0f} bytes a shoe'.format(
+      n_shoes, time.perf_counter() - start, index.dtype.itemsize))
+  pool = open_pool(pool_path)
+  cut = cut_number(pool.n_cards, 1.5)
+  counter = Counter(json_file_path='strategy1.json')
+  for i_shoe in range(0, n_shoes, 997):
+    cards = pool.cards(i_shoe)
+    counter.show_decks_in_shoe(pool.n_decks)
+    trues = [counter.true_count()]
+    assert index['running'][i_shoe, 0] == 0
+    for position, face in enumerate(cards[1:], 1):
+      counter.show_card(face)
+      assert index['running'][i_shoe, position] == counter.get_state()['count']
+      if position < cut:
+        trues.append(counter.true_count())
+    assert index['max_true'][i_shoe] == numpy.float32(max(trues))
+    assert index['min_true'][i_shoe] == numpy.float32(min(trues))
+    assert index['true_at_cut'][i_shoe] == numpy.float32(trues[-1])
+    assert index['count_at_cut'][i_shoe] == index['running'][i_shoe, cut - 1]
+    assert [i for i, face in enumerate(cards) if face == 'A'] == index['aces'][i_shoe].tolist()
+    assert [i for i, face in enumerate(cards) if face == 'X'] == index['tens'][i_shoe].tolist()
+
+  start = time.perf_counter()
+  over = (index['max_true'] > 3).mean()
+  early = numpy.nonzero(index['running'][:, 2 * CARDS_PER_DECK - 1] >= 6)[0]
+  aces = index['aces'][early]
+  ace_before_cut = (aces < cut).sum(axis=1).mean()
+  elapsed = time.perf_counter() - start
+  print('true count over +3 before the cut in {0:.1%} of shoes'.format(over))
+  print('{0} shoes at +6 or more after two decks, {1:.2f} of their aces before the cut '
+        '({2:.2f} expected)'.format(len(early), ace_before_cut, 24.0 * cut / pool.n_cards))
+  print('queries in {0:.1f} ms'.format(1e3 * elapsed))
+
+def main():
+  'main entry point: args = pool_path [decks_cut], or none to test'
+  args = sys.argv[1:]
+  if not args:
+    test()
+    return
+  decks_cut = float(args[1]) if len(args) > 1 else 1.5
+  start = time.perf_counter()
+  path = build_index(args[0], decks_cut)
+  print('{0} in {1:.1f} s'.format(path, time.perf_counter() - start))
+
+if __name__ == '__main__':
+  main()
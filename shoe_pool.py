@@ -0,0 +1,243 @@
+'''
+shoe_pool.py
+
+A pool of shoes shuffled once and dealt by any number of runs.
+
+The pool is a file: a HEADER_SIZE byte header giving the number of
+decks, the cards per shoe, the first seed and the number of shoes,
+then one fixed width row per shoe of rank codes 0..9 for the faces
+'23456789XA', as in dealer_kernel. Row i equals the shoe
+shoe.Shoe(n_decks, seed=first_seed + i) deals first. A run that
+deals from a pool plays different shoes from one that shuffles its
+own, so its results are not the same, only as good.
+
+Readers map the file read only. Every process that opens the same
+pool shares its pages through the page cache. pool.row(i), a
+memoryview of the mapping, and pool.array(), one NumPy array over
+all of it for the vectorised kernels, copy nothing. Table.play_shoe
+takes pool.cards(i), which builds the row as a string of faces, a
+few hundred bytes per shoe against a shuffle.
+
+  > python shoe_pool.py pool_path n_shoes [n_decks] [first_seed] [workers]
+'''
+
+import os
+import sys
+import mmap
+import time
+import random
+import struct
+import threading
+import multiprocessing
+from rules import CARD_FACES, SUITS_PER_DECK
+
+FACES = '23456789XA'
+MAGIC = b'BJSHOES1'
+HEADER = struct.Struct('<8sIIqq')    # magic, n_decks, n_cards, first_seed, n_shoes
+HEADER_SIZE = 64
+CHUNK_SHOES = 10000
+
+_TO_FACES = bytes.maketrans(bytes(range(len(FACES))), FACES.encode('ascii'))
+_POOLS = {}
+_POOLS_LOCK = threading.Lock()
+
+def shoe_codes(n_decks, seed):
+  '''
+  The rank codes of the shoe shoe.Shoe(n_decks, seed) deals first.
+  random.shuffle only looks at the length of the list, so shuffling
+  the codes moves them just as it moves the faces.
+  '''
+  codes = [FACES.index(face) for face in CARD_FACES * (n_decks * SUITS_PER_DECK)]
+  random.Random(seed).shuffle(codes)
+  return codes
+
+def _fill(job):
+  'write the shoes of rows [begin, end) of the pool at path'
+  path, begin, end = job
+  with open(path, 'r+b') as fobj:
+    n_decks, n_cards, first_seed, _ = _read_header(fobj)
+    with mmap.mmap(fobj.fileno(), 0) as mapped:
+      for row in range(begin, end):
+        offset = HEADER_SIZE + row * n_cards
+        mapped[offset:offset + n_cards] = bytes(shoe_codes(n_decks, first_seed + row))
+  return end - begin
+
+def _read_header(fobj):
+  magic, n_decks, n_cards, first_seed, n_shoes = HEADER.unpack(fobj.read(HEADER.size))
+  if magic != MAGIC:
+    raise ValueError('{0} is not a shoe pool'.format(fobj.name))
+  return n_decks, n_cards, first_seed, n_shoes
+
+def write_pool(path, n_shoes, n_decks=6, first_seed=0, workers=1):
+  '''
+  Shuffle n_shoes shoes with seeds first_seed, first_seed + 1, ...
+  into a pool file at path, on workers processes that each fill
+  their own rows. The file only appears at path once it is whole.
+  '''
+  n_cards = n_decks * SUITS_PER_DECK * len(CARD_FACES)
+  tmp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+  with open(tmp_path, 'wb') as fobj:
+    fobj.write(HEADER.pack(MAGIC, n_decks, n_cards, first_seed, n_shoes).ljust(HEADER_SIZE, b'\0'))
+    fobj.truncate(HEADER_SIZE + n_shoes * n_cards)
+  jobs = [(tmp_path, begin, min(begin + CHUNK_SHOES, n_shoes))
+          for begin in range(0, n_shoes, CHUNK_SHOES)]
+  if workers > 1:
+    with multiprocessing.Pool(workers) as pool:
+      for _ in pool.imap_unordered(_fill, jobs):
+        pass
+  else:
+    for job in jobs:
+      _fill(job)
+  os.replace(tmp_path, path)
+
+class ShoePool:
+  '''
+  A pool file mapped read only. Rows are memoryviews of the mapping
+  and array() is a NumPy view of all of them, which must be dropped
+  before close().
+  '''
+  def __init__(self, path):
+    self.path = path
+    with open(path, 'rb') as fobj:
+      self.n_decks, self.n_cards, self.first_seed, self.n_shoes = _read_header(fobj)
+      size = HEADER_SIZE + self.n_shoes * self.n_cards
+      if os.fstat(fobj.fileno()).st_size != size:
+        raise ValueError('{0} should be {1} bytes'.format(path, size))
+      self.mapped = mmap.mmap(fobj.fileno(), 0, access=mmap.ACCESS_READ)
+    self.view = memoryview(self.mapped)[HEADER_SIZE:]
+
+  def __len__(self):
+    return self.n_shoes
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    self.close()
+
+  def close(self):
+    self.view.release()
+    self.mapped.close()
+
+  def row(self, i_shoe):
+    'the rank codes of shoe i_shoe, a memoryview of the mapping'
+    if not 0 <= i_shoe < self.n_shoes:
+      raise IndexError('shoe {0} is not in the pool of {1}'.format(i_shoe, self.n_shoes))
+    offset = i_shoe * self.n_cards
+    return self.view[offset:offset + self.n_cards]
+
+  def cards(self, i_shoe):
+    'the faces of shoe i_shoe as a string, for Table.play_shoe'
+    return bytes(self.row(i_shoe)).translate(_TO_FACES).decode('ascii')
+
+  def check(self, n_shoes, first_row=0, n_decks=None):
+    '''
+    raise ValueError unless the pool has rows first_row, ... for
+    n_shoes shoes, and shoes of n_decks decks if it is given
+    '''
+    if n_decks is not None and n_decks != self.n_decks:
+      raise ValueError('{0} has shoes of {1} decks, not {2}'.format(
+          self.path, self.n_decks, n_decks))
+    if first_row + n_shoes > self.n_shoes:
+      raise ValueError('{0} has {1} shoes, {2} are needed'.format(
+          self.path, self.n_shoes, first_row + n_shoes))
+
+  def seed(self, i_shoe):
+    'the seed of shoe.Shoe that shuffles shoe i_shoe'
+    return self.first_seed + i_shoe
+
+  def array(self):
+    '[shoe, card] rank codes of the whole pool, read only, not copied'
+    import numpy                      # pylint: disable=import-error
+    return numpy.frombuffer(self.mapped, dtype=numpy.uint8, count=self.n_shoes * self.n_cards,
+                            offset=HEADER_SIZE).reshape(self.n_shoes, self.n_cards)
+
+def open_pool(path):
+  'the ShoePool at path, opened once per process and shared by its threads'
+  pool = _POOLS.get(path)
+  if pool is None:
+    with _POOLS_LOCK:
+      pool = _POOLS.get(path)
+      if pool is None:
+        pool = _POOLS[path] = ShoePool(path)
+  return pool
+
+def test(n_shoes=2000):
+  '''
+  Write a pool, check its rows against shoe.Shoe and the kernels
+  on a view of it, and time dealing shoes from it against
+  shuffling them
+  '''
+  import tempfile
+  from shoe import Shoe
+  from table import Table
+  from counter import Counter
+  import dealer_kernel
+  path = os.path.join(tempfile.mkdtemp(), 'test.pool')
+  start = time.perf_counter()
+  write_pool(path, n_shoes, first_seed=5)
+  print('wrote {0} shoes in {1:.2f} s'.format(n_shoes, time.perf_counter() - start))
+  with ShoePool(path) as pool:
+    for i_shoe in (0, 1, n_shoes - 1):
+      assert pool.cards(i_shoe) == ''.join(Shoe(6, seed=pool.seed(i_shoe)).shoe)
+    shoes = pool.array()
+    assert not shoes.flags.writeable
+    # a dealer hand from the top of every shoe, straight off the mapping
+    final, _ = dealer_kernel.play(shoes[:, 0], shoes[:, 1],
+                                  shoes[:, 2:2 + dealer_kernel.MAX_DRAWS])
+    for i_shoe in range(0, n_shoes, 97):
+      cards = pool.cards(i_shoe)
+      assert final[i_shoe] == dealer_kernel.play_scalar(cards[0], cards[1], cards[2:])[0]
+    del shoes
+
+    shoe = Shoe(6, seed=0)
+    start = time.perf_counter()
+    for _ in range(n_shoes):
+      shoe.shuffle()
+    shuffled = time.perf_counter() - start
+    start = time.perf_counter()
+    for i_shoe in range(n_shoes):
+      pool.cards(i_shoe)
+    read = time.perf_counter() - start
+    print('a shoe: shuffled in {0:.1f} us, read from the pool in {1:.1f} us'.format(
+        1e6 * shuffled / n_shoes, 1e6 * read / n_shoes))
+
+    table = Table(n_places=1, n_decks=6, seed=5, decks_cut=1.5)
+    table.sit_down(0, Counter(json_file_path='strategy1.json'))
+    results = {}
+    for source in ('shuffled', 'pool'):
+      nets = []
+      table.set_recorder(lambda record: nets.append(record[3]))
+      table.shoe = Shoe(6, seed=0)
+      start = time.perf_counter()
+      for i_shoe in range(200):
+        if source == 'pool':
+          table.play_shoe(pool.cards(i_shoe))
+        else:
+          table.shoe.rng.seed(pool.seed(i_shoe))
+          table.play_shoe()
+      elapsed = time.perf_counter() - start
+      results[source] = nets
+      print('{0}: 200 shoes in {1:.2f} s'.format(source, elapsed))
+    assert results['pool'] == results['shuffled']
+  os.remove(path)
+  print('pool shoes match shoe.Shoe')
+
+def main():
+  'main entry point: args = pool_path n_shoes [n_decks] [first_seed] [workers]'
+  args = sys.argv[1:]
+  if len(args) < 2:
+    test()
+    return
+  path, n_shoes = args[0], int(args[1])
+  n_decks = int(args[2]) if len(args) > 2 else 6
+  first_seed = int(args[3]) if len(args) > 3 else 0
+  workers = int(args[4]) if len(args) > 4 else 1
+  start = time.perf_counter()
+  write_pool(path, n_shoes, n_decks, first_seed, workers)
+  elapsed = time.perf_counter() - start
+  print('{0} shoes in {1:.1f} s, {2:.0f} shoes/s, {3:.1f} MB'.format(
+      n_shoes, elapsed, n_shoes / elapsed, os.path.getsize(path) / 1e6))
+
+if __name__ == '__main__':
+  main()
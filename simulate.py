@@ -0,0 +1,490 @@
+'''
+simulate.py
+
+Runs table.Table simulations described by a JSON run config
+
+  > python simulate.py run.json
+
+The config holds
+
+  rules        table rules, {"minimum_bet": 100, "maximum_bet": 3000}
+               and any of the rules.RuleSet fields: hit_soft_17,
+               double_after_split, max_split_hands, resplit_aces,
+               hit_split_aces, surrender ("none", "late" or
+               "early"), blackjack_pays and peek. Those not given
+               are the DEFAULT_RULES; unknown keys are an error
+  n_decks      decks in the shoe
+  decks_cut    decks behind the cut card
+  seats        one entry per place, {"strategy": "strategy1.json"}
+               or null for an empty place. A seat can add
+               "overrides": ["insurance", "stand"], the
+               counter.OVERRIDES rules to play by, and
+               "compiled": true to decide with the functions
+               strategy_compiler.py makes from the strategy,
+               "rounding": "half_deck_truncate", one of the
+               true_count.ROUNDINGS, and "integer": true to count
+               and decide in whole numbers
+  n_shoes      shoes to play, or the most to play with target_se
+  target_se    stop once the standard error of the win rate per
+               round is this small (optional)
+  max_seconds  stop after this long whatever the precision (optional)
+  unit_shoes   shoes in each unit of work
+  workers      number of workers
+  backend      "processes", "threads" or "auto", the default: threads
+               on a free-threaded (no GIL) Python and processes on
+               any other
+  seed         the units use seeds seed, seed + 1, ...
+  shoe_pool    the path of a pool made by shoe_pool.py to deal the
+               shoes from instead of shuffling (optional). The unit
+               with seed seed + k plays rows k * unit_shoes, ...
+               It must have n_decks decks and n_shoes rows.
+  output       {"stats": path, "report": path, "records": dir}, all
+               optional, their directories made as needed; run.json
+               writes to output/, which git ignores. With records every round of every place is
+               kept by round_records.RoundBuffer, each unit in its
+               own directory under dir
+  result_cache true, or the directory of a result_cache.ResultCache,
+               to take the units played before from the cache and
+               keep the new ones (optional, not with records)
+  variance_reduction
+               {"controls": true} to also estimate the EV per round
+               with the control variates of variance.py and report
+               how much they reduce the variance, about 1.13 times
+               on 10000 shoes of strategy1.json (optional).
+               "antithetic": true and "stratify_decks": 2 add the
+               other techniques, which are experimental and need
+               "experimental": true as well: on the same shoes they
+               reduce it 1.02 and 0.99 times, that is not at all
+
+Each unit of work is a fresh Table played for unit_shoes shoes from
+its own seed, so the results do not depend on the number of
+workers. Workers send their progress to the parent at most every
+PROGRESS_INTERVAL seconds, checked once per shoe and never per
+round, and the parent shows rounds/sec and cards/sec per worker and
+the ETA of the run.
+
+A thread plays a unit just as a process does, with its own Table,
+Counters, shoe RNG and statistics, so the threads share nothing that
+changes. What they do share is built once and only read: the shoe
+pool mapping and the compiled strategy functions. Threads start
+quicker than processes and their results are not pickled, which
+matters for short runs, but they only play in parallel without the
+GIL.
+
+With a target_se the units are batches: the merged statistics are
+checked after each one and the run stops as soon as the target is
+met, or when n_shoes or max_seconds runs out. The report says which,
+with the precision reached and the number of batches.
+'''
+
+import os
+import sys
+import json
+import time
+import queue
+import random
+import itertools
+import threading
+import multiprocessing
+import multiprocessing.pool
+from table import Table
+from counter import Counter, OVERRIDES
+from stats import BucketStats
+from rules import CARDS_PER_DECK, RuleSet
+from variance import ShoeSample, n_controls, play_shoes
+from shoe_pool import open_pool
+from result_cache import ResultCache, unit_key
+
+PROGRESS_INTERVAL = 1.0   # seconds
+EXPERIMENTAL_TECHNIQUES = ('antithetic', 'stratify_decks')
+
+DEFAULT_CONFIG = {
+    'rules' : {'minimum_bet' : 100.0, 'maximum_bet' : 3000.0},
+    'n_decks' : 6,
+    'decks_cut' : 1.5,
+    'seats' : [{'strategy' : 'strategy1.json'}],
+    'n_shoes' : 1000,
+    'target_se' : None,
+    'max_seconds' : None,
+    'unit_shoes' : 100,
+    'workers' : 1,
+    'backend' : 'auto',
+    'seed' : 1,
+    'output' : {},
+    'variance_reduction' : None,
+    'shoe_pool' : None,
+    'result_cache' : None,
+}
+
+_progress_queue = None
+
+def load_config(path):
+  'read a run config, filling in the defaults'
+  with open(path, 'r') as fobj:
+    config = json.load(fobj)
+  answer = dict(DEFAULT_CONFIG)
+  answer.update(config)
+  rules = dict(DEFAULT_CONFIG['rules'])
+  rules.update(config.get('rules', {}))
+  answer['rules'] = rules
+  make_rules(answer)
+  make_sample(answer)
+  if answer.get('shoe_pool'):
+    open_pool(answer['shoe_pool']).check(answer['n_shoes'], n_decks=answer['n_decks'])
+  return answer
+
+def make_rules(config):
+  'the rules.RuleSet of config, from the keys of its rules other than the bets'
+  choices = {key : value for key, value in config['rules'].items()
+             if key not in ('minimum_bet', 'maximum_bet')}
+  unknown = sorted(set(choices) - set(RuleSet._fields))
+  if unknown:
+    raise ValueError('unknown rules: ' + ', '.join(unknown))
+  return RuleSet(**choices)
+
+def make_table(config, seed):
+  'a Table with a Counter seated in each occupied place'
+  rules = config['rules']
+  table = Table(n_places=len(config['seats']), n_decks=config['n_decks'],
+                seed=seed, decks_cut=config['decks_cut'],
+                minimum_bet=rules['minimum_bet'], maximum_bet=rules['maximum_bet'],
+                rules=make_rules(config))
+  for i_place, seat in enumerate(config['seats']):
+    if seat is not None:
+      counter = Counter(json_file_path=seat['strategy'], compiled=seat.get('compiled', False),
+                        rounding=seat.get('rounding', 'exact'), integer=seat.get('integer', False))
+      for decision in seat.get('overrides', []):
+        counter.set_override(decision, OVERRIDES[decision])
+      table.sit_down(i_place, counter)
+  return table
+
+def make_sample(config):
+  'an empty ShoeSample for the variance reduction of config, or None'
+  options = config.get('variance_reduction')
+  if not options:
+    return None
+  experimental = [key for key in EXPERIMENTAL_TECHNIQUES if options.get(key)]
+  if experimental and not options.get('experimental'):
+    raise ValueError('experimental variance reduction {0} needs "experimental": true'.format(
+        ', '.join(experimental)))
+  depth = None
+  if options.get('stratify_decks'):
+    depth = int(options['stratify_decks'] * CARDS_PER_DECK)
+  return ShoeSample(n_controls(config['n_decks'], config['decks_cut']),
+                    config['n_decks'], depth)
+
+def free_threaded():
+  'whether this Python runs without the GIL'
+  is_gil_enabled = getattr(sys, '_is_gil_enabled', None)
+  return is_gil_enabled is not None and not is_gil_enabled()
+
+def choose_backend(config):
+  "'threads' or 'processes' for the workers of config"
+  backend = config.get('backend', 'auto')
+  if backend == 'auto':
+    return 'threads' if free_threaded() else 'processes'
+  if backend not in ('threads', 'processes'):
+    raise ValueError('unknown backend ' + repr(backend))
+  return backend
+
+def _init_worker(progress_queue):
+  global _progress_queue
+  _progress_queue = progress_queue
+
+class _WorkerTotals(threading.local):
+  'rounds, cards and shoes played by this worker, process or thread, since it started'
+  start = None
+  rounds = 0
+  cards = 0
+  shoes = 0
+  last_report = 0.0
+
+_totals = _WorkerTotals()
+
+def run_unit(unit):
+  '''
+  Play one unit of work and return its statistics as bytes, its
+  ShoeSample, or None without variance reduction, and the number of
+  shoes played. unit is (config, seed, n_shoes).
+  '''
+  config, seed, n_shoes = unit
+  totals = _totals
+  if totals.start is None:
+    totals.start = time.perf_counter()
+  table = make_table(config, seed)
+  stats = BucketStats()
+  table.set_recorder(stats.record)
+  records_dir = config.get('output', {}).get('records')
+  buffer = None
+  if records_dir:
+    from round_records import RoundBuffer
+    buffer = RoundBuffer(os.path.join(records_dir, 'unit-{0:06d}'.format(seed)))
+    keep = buffer.recorder(table)
+    def recorder(record):
+      stats.record(record)
+      keep(record)
+    table.set_recorder(recorder)
+  sample = make_sample(config)
+  swap_rng = None
+  if sample is not None and config['variance_reduction'].get('antithetic'):
+    swap_rng = random.Random(seed)
+  step = 2 if swap_rng is not None else 1
+  next_cards = None
+  if config.get('shoe_pool'):
+    pool = open_pool(config['shoe_pool'])
+    rows = itertools.count((seed - config['seed']) * config['unit_shoes'])
+    next_cards = lambda: pool.cards(next(rows))
+  for i_shoe in range(0, n_shoes, step):
+    rounds_before = table.n_rounds
+    if sample is None:
+      table.play_shoe(next_cards() if next_cards is not None else None)
+      totals.cards += table.n_cards_dealt
+    else:
+      totals.cards += play_shoes(table, min(step, n_shoes - i_shoe), sample, swap_rng,
+                                 next_cards)
+    totals.rounds += table.n_rounds - rounds_before
+    totals.shoes += min(step, n_shoes - i_shoe)
+    now = time.perf_counter()
+    if _progress_queue is not None and now - totals.last_report >= PROGRESS_INTERVAL:
+      totals.last_report = now
+      _progress_queue.put(((os.getpid(), threading.get_ident()), totals.rounds, totals.cards,
+                           totals.shoes, now - totals.start))
+  if buffer is not None:
+    buffer.close()
+  return stats.to_bytes(), sample, n_shoes
+
+class Progress:
+  '''
+  The latest report from each worker and a one line display of
+  the rates and the ETA.
+  '''
+  def __init__(self, n_shoes, fout=sys.stderr):
+    self.n_shoes = n_shoes
+    self.fout = fout
+    self.workers = {}
+    self.last_show = 0.0
+
+  def update(self, report):
+    worker, rounds, cards, shoes, elapsed = report
+    self.workers[worker] = (rounds, cards, shoes, elapsed)
+
+  def show(self, force=False):
+    now = time.perf_counter()
+    if not force and now - self.last_show < PROGRESS_INTERVAL:
+      return
+    self.last_show = now
+    parts = []
+    shoes_done = 0
+    shoe_rate = 0.0
+    for i_worker, (rounds, cards, shoes, elapsed) in enumerate(sorted(self.workers.values())):
+      if elapsed <= 0.0:
+        continue
+      parts.append('w{0} {1:.0f} r/s {2:.0f} c/s'.format(
+          i_worker, rounds / elapsed, cards / elapsed))
+      shoes_done += shoes
+      shoe_rate += shoes / elapsed
+    if shoe_rate > 0.0:
+      eta = max(0.0, (self.n_shoes - shoes_done) / shoe_rate)
+      parts.append('ETA {0}:{1:02d}'.format(int(eta // 60), int(eta % 60)))
+    self.fout.write('\r' + ' | '.join(parts))
+    self.fout.flush()
+
+def _units(config):
+  'the units of work, numbered by their seeds'
+  n_shoes = config['n_shoes']
+  unit_shoes = config['unit_shoes']
+  seed = config['seed']
+  while n_shoes > 0:
+    this_unit = min(unit_shoes, n_shoes)
+    yield (config, seed, this_unit)
+    seed += 1
+    n_shoes -= this_unit
+
+def make_cache(config):
+  'the ResultCache of config, or None'
+  option = config.get('result_cache')
+  if not option or config.get('output', {}).get('records'):
+    return None
+  return ResultCache(option if isinstance(option, str) else None)
+
+def _keyed_units(config, cache):
+  '(key, unit) for each unit of work, the key None without a cache'
+  pool = open_pool(config['shoe_pool']) if cache is not None and config.get('shoe_pool') else None
+  for unit in _units(config):
+    key = None
+    if cache is not None:
+      _, seed, n_shoes = unit
+      first_shoe_seed = None
+      if pool is not None:
+        first_shoe_seed = pool.seed((seed - config['seed']) * config['unit_shoes'])
+      key = unit_key(config, seed, n_shoes, first_shoe_seed)
+    yield key, unit
+
+def _run_keyed(item):
+  key, unit = item
+  return key, run_unit(unit)
+
+def _stop_reason(config, stats, start):
+  'why the run should stop now, or None to go on'
+  target_se = config.get('target_se')
+  if target_se is not None and stats.n_rounds() > 1 and \
+     stats.total().se() <= target_se:
+    return 'target met'
+  max_seconds = config.get('max_seconds')
+  if max_seconds is not None and time.perf_counter() - start >= max_seconds:
+    return 'time budget spent'
+  return None
+
+def _merge(stats, sample, summary, result):
+  stats_bytes, unit_sample, n_shoes = result
+  stats.merge(BucketStats.from_bytes(stats_bytes))
+  if sample is not None:
+    sample.merge(unit_sample)
+  summary['batches'] += 1
+  summary['shoes'] += n_shoes
+
+def run(config, show_progress=True):
+  '''
+  run the simulation of config and return the merged BucketStats,
+  the ShoeSample, which is None without variance reduction, and a
+  summary of the batches played and why the run stopped
+  '''
+  start = time.perf_counter()
+  stats = BucketStats()
+  sample = make_sample(config)
+  summary = {'batches' : 0, 'shoes' : 0, 'cached' : 0, 'stopped' : 'shoe budget spent'}
+  cache = make_cache(config)
+  todo = []
+  for key, unit in _keyed_units(config, cache):
+    result = cache.get(key) if cache is not None else None
+    if result is None:
+      todo.append((key, unit))
+    else:
+      _merge(stats, sample, summary, result)
+      summary['cached'] += 1
+  reason = _stop_reason(config, stats, start) if summary['cached'] else None
+  if reason is not None:
+    summary['stopped'] = reason
+    todo = []
+  progress = Progress(config['n_shoes'] - summary['shoes']) if show_progress and todo else None
+  if config['workers'] <= 1:
+    progress_queue = queue.Queue()
+    _init_worker(progress_queue)
+    for item in todo:
+      key, result = _run_keyed(item)
+      if cache is not None:
+        cache.put(key, result)
+      _merge(stats, sample, summary, result)
+      while progress is not None and not progress_queue.empty():
+        progress.update(progress_queue.get())
+        progress.show()
+      reason = _stop_reason(config, stats, start)
+      if reason is not None:
+        summary['stopped'] = reason
+        break
+  else:
+    if choose_backend(config) == 'threads':
+      progress_queue = queue.Queue()
+      make_pool = multiprocessing.pool.ThreadPool
+    else:
+      progress_queue = multiprocessing.Queue()
+      make_pool = multiprocessing.Pool
+    with make_pool(config['workers'], initializer=_init_worker,
+                   initargs=(progress_queue,)) as pool:
+      results = pool.imap_unordered(_run_keyed, todo)
+      while True:
+        try:
+          key, result = results.next(timeout=0.1)
+          if cache is not None:
+            cache.put(key, result)
+          _merge(stats, sample, summary, result)
+        except multiprocessing.TimeoutError:
+          pass
+        except StopIteration:
+          break
+        while True:
+          try:
+            report = progress_queue.get_nowait()
+          except queue.Empty:
+            break
+          if progress is not None:
+            progress.update(report)
+        if progress is not None:
+          progress.show()
+        reason = _stop_reason(config, stats, start)
+        if reason is not None:
+          summary['stopped'] = reason
+          pool.terminate()
+          break
+  if progress is not None:
+    progress.show(force=True)
+    progress.fout.write('\n')
+  return stats, sample, summary
+
+def write_outputs(config, stats, sample=None, summary=None):
+  'save the statistics and the report where the config says'
+  output = config.get('output', {})
+  for key in ('stats', 'report'):
+    if output.get(key) and os.path.dirname(output[key]):
+      os.makedirs(os.path.dirname(output[key]), exist_ok=True)
+  if output.get('stats'):
+    with open(output['stats'], 'wb') as fobj:
+      fobj.write(stats.to_bytes())
+  if output.get('report'):
+    with open(output['report'], 'w') as fobj:
+      original = sys.stdout
+      sys.stdout = fobj
+      try:
+        report(config, stats, sample, summary)
+      finally:
+        sys.stdout = original
+
+def report(config, stats, sample=None, summary=None):
+  '''
+  print the results for each occupied seat, of the variance reduction
+  and the precision reached
+  '''
+  for i_place, seat in enumerate(config['seats']):
+    if seat is not None:
+      print('place {0}: {1}'.format(i_place, seat['strategy']))
+      stats.report(i_place)
+      print()
+  if sample is not None and sample.shoes.n > 1:
+    print('variance reduction, all places, {0} shoes:'.format(sample.shoes.n))
+    sample.report()
+    print()
+  if summary is not None and stats.n_rounds() > 1:
+    target_se = config.get('target_se')
+    print('standard error of the win rate per round {0:.4f}{1}'.format(
+        stats.total().se(),
+        '' if target_se is None else ', target {0:.4f}'.format(target_se)))
+    print('{0} batches, {1} from the result cache, {2} shoes, {3}'.format(
+        summary['batches'], summary['cached'], summary['shoes'], summary['stopped']))
+    print()
+
+def main():
+  'main entry point: args = config_path'
+  if len(sys.argv) != 2:
+    print()
+    print("Simulate blackjack from a run config")
+    print()
+    print("  Syntax:")
+    print()
+    print("    > python simulate.py run.json")
+    print()
+    sys.exit(1)
+  config = load_config(sys.argv[1])
+  start = time.perf_counter()
+  stats, sample, summary = run(config)
+  elapsed = time.perf_counter() - start
+  report(config, stats, sample, summary)
+  n_seated = max(1, sum(seat is not None for seat in config['seats']))
+  n_rounds = stats.n_rounds() // n_seated
+  workers = 'one worker' if config['workers'] <= 1 else \
+            '{0} worker {1}'.format(config['workers'], choose_backend(config))
+  print('{0} rounds in {1:.1f} s, {2:.0f} rounds/sec, {3}'.format(
+      n_rounds, elapsed, n_rounds / elapsed, workers))
+  write_outputs(config, stats, sample, summary)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,359 @@
+'''
+stats.py
+
+Streaming statistics for simulation results.
+
+Nothing here keeps the individual results. Moments keeps the
+count, the mean and the sum of squared deviations M2, updated
+one value at a time with Welford's method, and optionally the
+third and fourth central sums M3 and M4. Two Moments from
+different workers merge exactly with the pairwise formulas of
+Chan and Pebay.
+
+BucketStats keeps a Moments, and optionally a Histogram, for
+each (true count bucket, place, action mask) seen. Merging is
+O(number of buckets) and the whole thing packs into a few
+bytes per bucket; the histograms, being mostly zero, compress
+well. The usual figures of merit come from the
+buckets:
+
+  win rate   mean result per round
+  SD         standard deviation of the result per round
+  SCORE      1e6 * (win rate / SD)**2, 0 for a losing game
+  N0         (SD / win rate)**2, rounds needed for the win rate
+             to equal one standard deviation, inf for a losing game
+'''
+
+import math
+import zlib
+import struct
+
+class Moments:
+  '''
+  count, mean and central sums of a stream of values
+  '''
+  __slots__ = ('n', 'mean', 'm2', 'm3', 'm4', 'higher')
+
+  def __init__(self, higher=False):
+    self.n = 0
+    self.mean = 0.0
+    self.m2 = 0.0
+    self.m3 = 0.0
+    self.m4 = 0.0
+    self.higher = higher
+
+  def add(self, x):
+    'include one more value'
+    n1 = self.n
+    self.n += 1
+    n = self.n
+    delta = x - self.mean
+    delta_n = delta / n
+    term1 = delta * delta_n * n1
+    self.mean += delta_n
+    if self.higher:
+      delta_n2 = delta_n * delta_n
+      self.m4 += term1 * delta_n2 * (n * n - 3 * n + 3) \
+                 + 6.0 * delta_n2 * self.m2 - 4.0 * delta_n * self.m3
+      self.m3 += term1 * delta_n * (n - 2) - 3.0 * delta_n * self.m2
+    self.m2 += term1
+
+  def merge(self, other):
+    'include all of the values seen by other'
+    if other.n == 0:
+      return
+    if self.n == 0:
+      self.n, self.mean, self.m2 = other.n, other.mean, other.m2
+      self.m3, self.m4 = other.m3, other.m4
+      return
+    na, nb = float(self.n), float(other.n)
+    n = na + nb
+    delta = other.mean - self.mean
+    delta2 = delta * delta
+    if self.higher:
+      self.m4 += other.m4 \
+                 + delta2 * delta2 * na * nb * (na * na - na * nb + nb * nb) / (n * n * n) \
+                 + 6.0 * delta2 * (na * na * other.m2 + nb * nb * self.m2) / (n * n) \
+                 + 4.0 * delta * (na * other.m3 - nb * self.m3) / n
+      self.m3 += other.m3 \
+                 + delta2 * delta * na * nb * (na - nb) / (n * n) \
+                 + 3.0 * delta * (na * other.m2 - nb * self.m2) / n
+    self.m2 += other.m2 + delta2 * na * nb / n
+    self.mean += delta * nb / n
+    self.n += other.n
+
+  def variance(self):
+    'the sample variance'
+    return self.m2 / (self.n - 1) if self.n > 1 else 0.0
+
+  def sd(self):
+    return math.sqrt(self.variance())
+
+  def se(self):
+    'standard error of the mean'
+    return math.sqrt(self.variance() / self.n) if self.n > 1 else 0.0
+
+  def skewness(self):
+    return math.sqrt(self.n) * self.m3 / self.m2 ** 1.5 if self.m2 > 0.0 else 0.0
+
+  def kurtosis(self):
+    'excess kurtosis'
+    return self.n * self.m4 / (self.m2 * self.m2) - 3.0 if self.m2 > 0.0 else 0.0
+
+class Histogram:
+  '''
+  Counts of values in equal width bins from lo to hi with one
+  more bin at each end for the values outside.
+  '''
+  __slots__ = ('lo', 'width', 'counts')
+
+  def __init__(self, lo, hi, width):
+    self.lo = lo
+    self.width = width
+    self.counts = [0] * (int(round((hi - lo) / width)) + 2)
+
+  def add(self, x):
+    i_bin = int(math.floor((x - self.lo) / self.width)) + 1
+    if i_bin < 0:
+      i_bin = 0
+    elif i_bin >= len(self.counts):
+      i_bin = len(self.counts) - 1
+    self.counts[i_bin] += 1
+
+  def merge(self, other):
+    assert len(self.counts) == len(other.counts)
+    self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+
+class Covariance:
+  '''
+  Mean vector and co-moment matrix of a stream of vectors, the
+  multivariate form of Welford's method. Mergeable like Moments.
+  '''
+  def __init__(self, size):
+    self.n = 0
+    self.mean = [0.0] * size
+    self.comoment = [[0.0] * size for _ in range(size)]
+
+  def add(self, x):
+    self.n += 1
+    delta = [xi - mi for xi, mi in zip(x, self.mean)]
+    self.mean = [mi + di / self.n for mi, di in zip(self.mean, delta)]
+    for i, row in enumerate(self.comoment):
+      after = x[i] - self.mean[i]
+      for j in range(len(row)):
+        row[j] += after * delta[j]
+
+  def merge(self, other):
+    if other.n == 0:
+      return
+    n = self.n + other.n
+    delta = [b - a for a, b in zip(self.mean, other.mean)]
+    factor = float(self.n) * other.n / n
+    for i, row in enumerate(self.comoment):
+      for j in range(len(row)):
+        row[j] += other.comoment[i][j] + factor * delta[i] * delta[j]
+    self.mean = [a + d * other.n / n for a, d in zip(self.mean, delta)]
+    self.n = n
+
+  def covariance(self, i, j):
+    'the sample covariance of elements i and j'
+    return self.comoment[i][j] / (self.n - 1) if self.n > 1 else 0.0
+
+_HEADER = struct.Struct('<4sBddddI')
+_KEY = struct.Struct('<ihH')
+_MAGIC = b'BST1'
+_HIGHER = 0x01
+_HISTOGRAM = 0x02
+
+class BucketStats:
+  '''
+  Moments of the round results for each (true count bucket,
+  place, action mask). The bucket of a true count tc is
+  floor(tc / bucket_width).
+  '''
+  def __init__(self, bucket_width=1.0, higher=False, histogram=None):
+    '''
+    histogram is None or (lo, hi, width) for a histogram of the
+    results in every bucket.
+    '''
+    self.bucket_width = bucket_width
+    self.higher = higher
+    self.histogram = histogram
+    self.buckets = {}
+
+  def _new_bucket(self):
+    hist = Histogram(*self.histogram) if self.histogram is not None else None
+    return (Moments(self.higher), hist)
+
+  def add(self, true_count, i_place, actions, result):
+    'include the result of one round'
+    key = (int(math.floor(true_count / self.bucket_width)), i_place, actions)
+    bucket = self.buckets.get(key)
+    if bucket is None:
+      bucket = self.buckets[key] = self._new_bucket()
+    bucket[0].add(result)
+    if bucket[1] is not None:
+      bucket[1].add(result)
+
+  def record(self, record):
+    'a recorder for table.Table.set_recorder'
+    self.add(record[1], record[0], record[2], record[3])
+
+  def merge(self, other):
+    'include the buckets of another BucketStats with the same settings'
+    assert self.bucket_width == other.bucket_width
+    for key, (moments, hist) in other.buckets.items():
+      bucket = self.buckets.get(key)
+      if bucket is None:
+        bucket = self.buckets[key] = self._new_bucket()
+      bucket[0].merge(moments)
+      if hist is not None:
+        bucket[1].merge(hist)
+
+  def total(self, i_place=None, actions=None, bucket=None):
+    'Moments over all buckets matching the given place, actions and bucket'
+    answer = Moments(self.higher)
+    for (key_bucket, key_place, key_actions), (moments, _) in self.buckets.items():
+      if i_place is not None and key_place != i_place:
+        continue
+      if actions is not None and key_actions != actions:
+        continue
+      if bucket is not None and key_bucket != bucket:
+        continue
+      answer.merge(moments)
+    return answer
+
+  def n_rounds(self, i_place=None):
+    return self.total(i_place).n
+
+  def win_rate(self, i_place=None):
+    return self.total(i_place).mean
+
+  def sd(self, i_place=None):
+    return self.total(i_place).sd()
+
+  def score(self, i_place=None):
+    'SCORE = 1e6 * (win rate / SD)**2, or 0 for a win rate of 0 or less'
+    moments = self.total(i_place)
+    var = moments.variance()
+    if moments.mean <= 0.0 or var <= 0.0:
+      return 0.0
+    return 1e6 * moments.mean * moments.mean / var
+
+  def n0(self, i_place=None):
+    'N0 = (SD / win rate)**2, or inf for a win rate of 0 or less'
+    moments = self.total(i_place)
+    if moments.mean <= 0.0:
+      return math.inf
+    return moments.variance() / (moments.mean * moments.mean)
+
+  def ev_table(self, i_place=None):
+    '''
+    Returns a list of (true count, rounds, mean, standard error)
+    with one row for each true count bucket, the true count
+    being the lower edge of the bucket.
+    '''
+    keys = sorted({key[0] for key in self.buckets})
+    answer = []
+    for key in keys:
+      moments = self.total(i_place, bucket=key)
+      if moments.n > 0:
+        answer.append((key * self.bucket_width, moments.n, moments.mean, moments.se()))
+    return answer
+
+  def to_bytes(self):
+    'a compact binary form, zlib compressed'
+    flags = (_HIGHER if self.higher else 0) | \
+            (_HISTOGRAM if self.histogram is not None else 0)
+    lo, hi, width = self.histogram if self.histogram is not None else (0.0, 0.0, 0.0)
+    parts = [_HEADER.pack(_MAGIC, flags, self.bucket_width, lo, hi, width,
+                          len(self.buckets))]
+    n_moments = 4 if self.higher else 2
+    for key, (moments, hist) in sorted(self.buckets.items()):
+      parts.append(_KEY.pack(*key))
+      values = (moments.mean, moments.m2, moments.m3, moments.m4)[:n_moments]
+      parts.append(struct.pack('<q%dd' % n_moments, moments.n, *values))
+      if hist is not None:
+        parts.append(struct.pack('<%dq' % len(hist.counts), *hist.counts))
+    return zlib.compress(b''.join(parts))
+
+  @classmethod
+  def from_bytes(cls, data):
+    data = zlib.decompress(data)
+    magic, flags, bucket_width, lo, hi, width, n_buckets = _HEADER.unpack_from(data)
+    if magic != _MAGIC:
+      raise ValueError('not a BucketStats')
+    histogram = (lo, hi, width) if flags & _HISTOGRAM else None
+    answer = cls(bucket_width, bool(flags & _HIGHER), histogram)
+    n_moments = 4 if answer.higher else 2
+    moments_struct = struct.Struct('<q%dd' % n_moments)
+    offset = _HEADER.size
+    for _ in range(n_buckets):
+      key = _KEY.unpack_from(data, offset)
+      offset += _KEY.size
+      moments, hist = answer._new_bucket()
+      values = moments_struct.unpack_from(data, offset)
+      offset += moments_struct.size
+      moments.n = values[0]
+      moments.mean, moments.m2 = values[1], values[2]
+      if answer.higher:
+        moments.m3, moments.m4 = values[3], values[4]
+      if hist is not None:
+        hist.counts = list(struct.unpack_from('<%dq' % len(hist.counts), data, offset))
+        offset += 8 * len(hist.counts)
+      answer.buckets[key] = (moments, hist)
+    return answer
+
+  def get_state(self):
+    'for checkpoint.run'
+    return self.to_bytes()
+
+  def set_state(self, state):
+    other = BucketStats.from_bytes(state)
+    self.bucket_width = other.bucket_width
+    self.higher = other.higher
+    self.histogram = other.histogram
+    self.buckets = other.buckets
+
+  def report(self, i_place=None):
+    'print the figures of merit and the EV table'
+    print('rounds: {0}  win rate: {1:.3f}  SD: {2:.1f}  SCORE: {3:.2f}  N0: {4:.0f}'.format(
+        self.n_rounds(i_place), self.win_rate(i_place), self.sd(i_place),
+        self.score(i_place), self.n0(i_place)))
+    print('{0:>6} {1:>9} {2:>10} {3:>9}'.format('true', 'rounds', 'mean', 'se'))
+    for true_count, n_rounds, mean, se in self.ev_table(i_place):
+      print('{0:>+6.1f} {1:>9} {2:>10.3f} {3:>9.3f}'.format(true_count, n_rounds, mean, se))
+
+def test():
+  '''
+  Two tables played separately and merged must agree with the
+  same results gathered by one accumulator.
+  '''
+  from table import Table
+  from counter import Counter
+
+  def play(seed, stats_list):
+    table = Table(n_places=2, n_decks=6, seed=seed, decks_cut=1.5)
+    for i_place in range(2):
+      table.sit_down(i_place, Counter(json_file_path='strategy1.json'))
+    def recorder(record):
+      for stats in stats_list:
+        stats.record(record)
+    table.set_recorder(recorder)
+    table.run(200)
+
+  together = BucketStats(higher=True, histogram=(-3000.0, 3000.0, 100.0))
+  part1 = BucketStats(higher=True, histogram=(-3000.0, 3000.0, 100.0))
+  part2 = BucketStats(higher=True, histogram=(-3000.0, 3000.0, 100.0))
+  play(1, [together, part1])
+  play(2, [together, part2])
+  part1.merge(BucketStats.from_bytes(part2.to_bytes()))
+  a, b = together.total(), part1.total()
+  assert a.n == b.n
+  for x, y in ((a.mean, b.mean), (a.m2, b.m2), (a.m3, b.m3), (a.m4, b.m4)):
+    assert abs(x - y) <= 1e-9 * max(1.0, abs(x)), (x, y)
+  print('merged buckets:', len(part1.buckets), 'bytes:', len(part1.to_bytes()))
+  together.report()
+
+if __name__ == '__main__':
+  test()
@@ -0,0 +1,355 @@
+'''
+strategy_compiler.py
+
+Turns the decision tables of a strategy JSON file into Python
+functions that make the same decisions as counter.Counter without
+looking anything up.
+
+For each decision and upcard the hands fall into groups: those that
+always take the action, those that never do, and those that take it
+at or above each threshold. A threshold of FOLD_AT or more (the
+99.0 of the strategy files) is never and one of -FOLD_AT or less is
+always, which holds for any true count a shoe can reach. The largest
+group becomes the fall through and each other group one membership
+test, so a decision is a few comparisons against constants:
+
+  def _double_5(true, cards):
+    if cards in {'45', '54', ...}:
+      return true >= -3.0
+    ...
+    return False
+
+Both orders of each two-card hand are listed, so nothing is sorted.
+The accepts_* functions pick the upcard's function from a dict.
+
+The source is kept in the cache directory under the hash of the
+tables and compiled once per process. Counter(path, compiled=True)
+binds the functions in place of its own methods.
+
+With a true_count.Rounding the decisions compare whole numbers
+instead, num >= T * den for num the running count scaled by
+table_scale and deck_units, den the units of decks unseen and T the
+threshold scaled, and rounded as the convention says, here:
+
+  def _double_5(num, den, cards):
+    if cards in {'45', '54', ...}:
+      return num >= -6 * den
+
+Counter(path, rounding=..., integer=True) keeps num and the cards
+unseen as it counts and never divides to decide. Nothing they use
+can change, the sets being frozen constants and the dicts read-only
+views, so threads can share them.
+
+  > python strategy_compiler.py [strategy.json]
+
+checks every cell against the tables and times both.
+'''
+
+import sys
+import json
+import time
+import types
+import hashlib
+import threading
+from types import MappingProxyType
+from cache import cache_path, write_atomic
+from rules import hand_value
+from true_count import count_scale, scaled_threshold
+
+COMPILER_VERSION = 2
+FOLD_AT = 99.0
+FACES = '23456789XA'
+PAIR_DECISIONS = ('surrender', 'split', 'double')
+TABLE_KEYS = ('hard_stand', 'soft_stand', 'double', 'split', 'surrender',
+              'insurance', 'upcard_index')
+TWO_CARD_HANDS = [first + second for first in FACES for second in FACES]
+HARD_VALUES = list(range(2, 31))
+SOFT_VALUES = list(range(12, 22))
+
+_COMPILED = {}   # digest -> {name: function}
+_COMPILE_LOCK = threading.Lock()
+
+def _sort_key(cards):
+  return ''.join(sorted(cards, key=FACES.index))
+
+def _category(threshold):
+  if threshold is None or threshold >= FOLD_AT:
+    return 'never'
+  if threshold <= -FOLD_AT:
+    return 'always'
+  return float(threshold)
+
+def _integer_expression(rounding, scale):
+  'the _expression of the whole number comparisons of rounding'
+  def expression(category):
+    if category in ('never', 'always'):
+      return _expression(category)
+    big, strict = scaled_threshold(category, rounding, scale)
+    right = '0' if big == 0 else '{0} * den'.format(big)
+    return 'num {0} {1}'.format('>' if strict else '>=', right)
+  return expression
+
+def _expression(category):
+  if category == 'never':
+    return 'False'
+  if category == 'always':
+    return 'True'
+  return 'true >= {0!r}'.format(category)
+
+def _cases(name, argument, thresholds, parameters='true', expression=_expression):
+  '''
+  The source of function name(true, argument) returning whether
+  true >= thresholds[argument], for thresholds a dict of every
+  possible argument, or with parameters 'num, den' and an
+  _integer_expression the same in whole numbers
+  '''
+  groups = {}
+  for key, threshold in thresholds.items():
+    groups.setdefault(_category(threshold), []).append(key)
+  fall_through = max(groups, key=lambda category: len(groups[category]))
+  lines = ['def {0}({1}, {2}):'.format(name, parameters, argument)]
+  for category, keys in sorted(groups.items(), key=lambda item: -len(item[1])):
+    if category != fall_through:
+      lines.append('  if {0} in {{{1}}}:'.format(argument, ', '.join(repr(key) for key in keys)))
+      lines.append('    return {0}'.format(expression(category)))
+  lines.append('  return {0}'.format(expression(fall_through)))
+  return lines
+
+def _pair_thresholds(table, updex):
+  'the threshold of every ordered two-card hand for one upcard, None if not in the table'
+  answer = {}
+  for cards in TWO_CARD_HANDS:
+    row = table.get(_sort_key(cards))
+    answer[cards] = None if row is None or updex is None else row[updex]
+  return answer
+
+def _value_thresholds(table, updex, values):
+  answer = {}
+  for value in values:
+    row = table.get(str(value))
+    answer[value] = None if row is None else row[updex]
+  return answer
+
+def table_scale(tables):
+  'the k of true_count.count_scale for the thresholds and count tags of a strategy'
+  thresholds = [threshold for key in ('hard_stand', 'soft_stand') + PAIR_DECISIONS
+                for row in tables[key].values() for threshold in row]
+  thresholds += list(tables['insurance'].values())
+  return count_scale([threshold for threshold in thresholds if abs(threshold) < FOLD_AT],
+                     tables['counts'].values())
+
+def strategy_source(tables, rounding=None):
+  '''
+  the Python source of the accepts_* functions for the decision
+  tables of a strategy, comparing whole numbers with a rounding
+  '''
+  upcards = sorted(tables['upcard_index'], key=FACES.index)
+  if rounding is None:
+    parameters, expression, true = 'true', _expression, 'self._true_count'
+  else:
+    parameters = 'num, den'
+    expression = _integer_expression(rounding, table_scale(tables))
+    true = 'self._num, self._units[self._unseen]'
+  lines = ["'''compiled by strategy_compiler.py, version {0}{1}'''".format(
+      COMPILER_VERSION, '' if rounding is None else ', ' + rounding.name), '']
+  for decision in PAIR_DECISIONS:
+    for upcard in upcards:
+      updex = tables['upcard_index'][upcard]
+      lines += _cases('_{0}_{1}'.format(decision, upcard), 'cards',
+                      _pair_thresholds(tables[decision], updex), parameters, expression)
+      lines.append('')
+    lines.append('_{0} = MappingProxyType({{{1}}})'.format(decision.upper(), ', '.join(
+        '{0!r}: _{1}_{2}'.format(upcard, decision, upcard) for upcard in upcards)))
+    lines.append('')
+    lines.append('def accepts_{0}(self, cards, upcard):'.format(decision))
+    lines.append('  return _{0}[upcard]({1}, cards)'.format(decision.upper(), true))
+    lines.append('')
+  for kind, values in (('hard', HARD_VALUES), ('soft', SOFT_VALUES)):
+    for upcard in upcards:
+      updex = tables['upcard_index'][upcard]
+      lines += _cases('_{0}_stand_{1}'.format(kind, upcard), 'value',
+                      _value_thresholds(tables[kind + '_stand'], updex, values),
+                      parameters, expression)
+      lines.append('')
+    lines.append('_{0}_STAND = MappingProxyType({{{1}}})'.format(kind.upper(), ', '.join(
+        '{0!r}: _{1}_stand_{2}'.format(upcard, kind, upcard) for upcard in upcards)))
+    lines.append('')
+  lines += ['def accepts_stand(self, cards, upcard):',
+            '  value, soft = hand_value(cards)',
+            '  if soft:',
+            '    return _SOFT_STAND[upcard]({0}, value)'.format(true),
+            '  return _HARD_STAND[upcard]({0}, value)'.format(true),
+            '']
+  insurance = {cards : tables['insurance'].get(_sort_key(cards)) for cards in TWO_CARD_HANDS}
+  lines += _cases('_insurance', 'cards', insurance, parameters, expression)
+  lines += ['',
+            'def accepts_insurance(self, cards, upcard):',
+            '  return _insurance({0}, cards)'.format(true),
+            '']
+  return '\n'.join(lines)
+
+def table_digest(tables, rounding=None):
+  'the hash of the decision tables, the rounding and the compiler version'
+  decisions = {key : tables[key] for key in TABLE_KEYS}
+  if rounding is not None:
+    decisions['counts'] = tables['counts']
+  text = json.dumps([COMPILER_VERSION, decisions, None if rounding is None else rounding.name],
+                    sort_keys=True)
+  return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def compile_tables(tables, rounding=None):
+  '''
+  {'accepts_stand': function, ...} for the decision tables of a
+  strategy, or their whole number comparisons with a rounding,
+  generated and compiled once per process, by whichever
+  thread asks first, and kept as source in the cache directory
+  '''
+  digest = table_digest(tables, rounding)
+  functions = _COMPILED.get(digest)
+  if functions is not None:
+    return functions
+  with _COMPILE_LOCK:
+    functions = _COMPILED.get(digest)
+    if functions is None:
+      path = cache_path('strategy-{0}.py'.format(digest[:16]))
+      try:
+        with open(path, 'r') as fobj:
+          source = fobj.read()
+      except FileNotFoundError:
+        source = strategy_source(tables, rounding)
+        write_atomic(path, source.encode('utf-8'))
+      namespace = {'hand_value' : hand_value, 'MappingProxyType' : MappingProxyType}
+      exec(compile(source, path, 'exec'), namespace)    # pylint: disable=exec-used
+      functions = _COMPILED[digest] = MappingProxyType({
+          name : namespace[name] for name in
+          ('accepts_insurance', 'accepts_surrender', 'accepts_split', 'accepts_double', 'accepts_stand')})
+  return functions
+
+def bind(counter, rounding=None):
+  'make the compiled decisions of the counter\'s tables its own'
+  for name, function in compile_tables(counter._tables, rounding).items():
+    setattr(counter, name, types.MethodType(function, counter))
+
+def check_equivalence(json_file_path):
+  '''
+  Compare the compiled decisions with the table-driven ones of
+  counter.Counter for every two-card hand, or every hand of two or
+  three cards for standing, every upcard and a true count on each
+  side of every threshold. Returns the number of cells compared.
+  '''
+  from counter import Counter
+  tables = Counter(json_file_path)
+  compiled = Counter(json_file_path, compiled=True)
+  thresholds = set()
+  for key in ('hard_stand', 'soft_stand') + PAIR_DECISIONS:
+    for row in tables._tables[key].values():
+      thresholds.update(row)
+  thresholds.update(tables._tables['insurance'].values())
+  trues = sorted({t + d for t in thresholds if abs(t) < FOLD_AT for d in (-0.01, 0.0, 0.01)} |
+                 {x / 4.0 for x in range(-120, 121)} | {-FOLD_AT + 0.5, FOLD_AT - 0.5})
+  three_card_hands = [cards + face for cards in TWO_CARD_HANDS for face in FACES]
+  n_cells = 0
+  for true in trues:
+    tables._true_count = compiled._true_count = true
+    for upcard in FACES:
+      for decision in PAIR_DECISIONS:
+        name = 'accepts_' + decision
+        for cards in TWO_CARD_HANDS:
+          assert getattr(tables, name)(cards, upcard) == getattr(compiled, name)(cards, upcard), \
+              (name, cards, upcard, true)
+      for cards in TWO_CARD_HANDS + three_card_hands:
+        assert tables.accepts_stand(cards, upcard) == compiled.accepts_stand(cards, upcard), \
+            ('accepts_stand', cards, upcard, true)
+      n_cells += 3 * len(TWO_CARD_HANDS) + len(TWO_CARD_HANDS) + len(three_card_hands)
+    for cards in TWO_CARD_HANDS:
+      assert tables.accepts_insurance(cards, 'A') == compiled.accepts_insurance(cards, 'A'), \
+          ('accepts_insurance', cards, true)
+    n_cells += len(TWO_CARD_HANDS)
+  return n_cells
+
+def check_integer_equivalence(json_file_path, rounding, n_shoes=2, seed=0):
+  '''
+  Deal whole shoes to a float Counter and an integer one with the
+  rounding and compare, after every card, the true counts and every
+  decision for every two-card hand and upcard. Returns the number of
+  decisions compared.
+  '''
+  import random
+  from counter import Counter
+  from rules import CARD_FACES, SUITS_PER_DECK
+  floats = Counter(json_file_path, rounding=rounding)
+  integers = Counter(json_file_path, rounding=rounding, integer=True)
+  rng = random.Random(seed)
+  names = ['accepts_' + decision for decision in PAIR_DECISIONS + ('stand',)]
+  n_decisions = 0
+  for _ in range(n_shoes):
+    cards = list(CARD_FACES * (6 * SUITS_PER_DECK))
+    rng.shuffle(cards)
+    for counter in (floats, integers):
+      counter.show_decks_in_shoe(6)
+    for card in cards[:-1]:
+      floats.show_card(card)
+      integers.show_card(card)
+      assert floats.true_count() == integers.true_count(), (rounding, floats.true_count())
+      for name in names:
+        decide, decide_integer = getattr(floats, name), getattr(integers, name)
+        for hand in TWO_CARD_HANDS:
+          for upcard in FACES:
+            assert decide(hand, upcard) == decide_integer(hand, upcard), \
+                (rounding, name, hand, upcard, floats.true_count())
+      for hand in TWO_CARD_HANDS:
+        assert floats.accepts_insurance(hand, 'A') == integers.accepts_insurance(hand, 'A')
+      n_decisions += (len(names) * len(FACES) + 1) * len(TWO_CARD_HANDS)
+  return n_decisions
+
+def test(json_file_path='strategy1.json', n_calls=200000):
+  '''
+  check the compiled decisions, float and whole number, and time
+  them against the tables
+  '''
+  from counter import Counter
+  from true_count import ROUNDINGS
+  start = time.perf_counter()
+  n_cells = check_equivalence(json_file_path)
+  print('{0} cells agree ({1:.1f} s)'.format(n_cells, time.perf_counter() - start))
+  start = time.perf_counter()
+  n_decisions = sum(check_integer_equivalence(json_file_path, rounding, n_shoes=1)
+                    for rounding in ROUNDINGS)
+  print('{0} whole number decisions agree over whole shoes, {1} roundings ({2:.1f} s)'.format(
+      n_decisions, len(ROUNDINGS), time.perf_counter() - start))
+  hands = [(cards, upcard) for cards in TWO_CARD_HANDS for upcard in FACES]
+  hands = (hands * (n_calls // len(hands) + 1))[:n_calls]
+  for compiled in (False, True):
+    counter = Counter(json_file_path, compiled=compiled)
+    counter._true_count = 1.5
+    line = []
+    for name in ('accepts_double', 'accepts_split', 'accepts_stand'):
+      decide = getattr(counter, name)
+      start = time.perf_counter()
+      for cards, upcard in hands:
+        decide(cards, upcard)
+      line.append('{0} {1:.2f} us'.format(name, 1e6 * (time.perf_counter() - start) / n_calls))
+    print('{0:>8}: {1}'.format('compiled' if compiled else 'tables', ', '.join(line)))
+  shoe = list('23456789XXXXA' * 24)
+  for integer in (False, True):
+    counter = Counter(json_file_path, compiled=True, integer=integer)
+    line = []
+    start = time.perf_counter()
+    for _ in range(n_calls // len(shoe)):
+      counter.show_decks_in_shoe(6)
+      for card in shoe[:-1]:
+        counter.show_card(card)
+    n_cards = (n_calls // len(shoe)) * (len(shoe) - 1)
+    line.append('show_card {0:.2f} us'.format(1e6 * (time.perf_counter() - start) / n_cards))
+    counter.show_decks_in_shoe(6)
+    for card in shoe[:100]:
+      counter.show_card(card)
+    decide = counter.accepts_double
+    start = time.perf_counter()
+    for cards, upcard in hands:
+      decide(cards, upcard)
+    line.append('accepts_double {0:.2f} us'.format(1e6 * (time.perf_counter() - start) / n_calls))
+    print('{0:>8}: {1}'.format('integer' if integer else 'float', ', '.join(line)))
+
+if __name__ == '__main__':
+  test(*sys.argv[1:2])
@@ -2,17 +2,42 @@
 table.py
 '''
 
-from rules import CARDS_PER_DECK
+from rules import CARDS_PER_DECK,      \
+                  INSURANCE_PAYS,      \
+                  HI_LO_COUNTS,        \
+                  DEFAULT_RULES,       \
+                  hand_value,          \
+                  is_blackjack,        \
+                  dealer_must_hit_s17, \
+                  dealer_must_hit_h17
 from shoe import Shoe
 from counter import Counter
 from place import Place
 from hand import Hand
 
+# bits of the action mask recorded for a place in each round
+ACTION_INSURANCE = 0x01
+ACTION_SURRENDER = 0x02
+ACTION_SPLIT     = 0x04
+ACTION_DOUBLE    = 0x08
+ACTION_HIT       = 0x10
+ACTION_BLACKJACK = 0x20
+
+def _always(hand):
+  return True
+
+def _never(hand):
+  return False
+
+def _not_from_split(hand):
+  return not hand.from_split
+
 class Table:
   '''
   Each table is a list of Places
   '''
-  def __init__(self, n_places, n_decks, seed, decks_cut):
+  def __init__(self, n_places, n_decks, seed, decks_cut,
+               minimum_bet=100.0, maximum_bet=3000.0, rules=DEFAULT_RULES):
     '''
     This initializes the table. The number of decks
     in the shoe, the numbe of places at the table and
@@ -25,23 +50,119 @@ class Table:
     self.cut_number = n_cards_per_shoe - cards_cut
     self.places = [Place() for i in range(n_places)]
     self.shoe = Shoe(n_decks=n_decks, seed=seed)
+    self.n_cards_per_shoe = n_cards_per_shoe
     self.n_cards_dealt = 0
+    self.n_cards_shown = 0
+    self.count = 0
+    self.n_rounds = 0
+    self.n_shoes = 0
+    self.minimum_bet = minimum_bet
+    self.maximum_bet = maximum_bet
     self.players = []
     self.downcard = None
     self.upcard = None
     self.hand = None
+    self.recorder = None
+    self.specialize(rules)
+
+  def specialize(self, rules):
+    '''
+    The rules are looked at once, here. Each rule that changes
+    how a round is played chooses which version of a method the
+    table uses, so the rounds themselves never test a rule.
+    '''
+    self.rules = rules
+    self.blackjack_pays = rules.blackjack_pays
+    self.max_split_hands = rules.max_split_hands
+    self.dealer_must_hit = dealer_must_hit_h17 if rules.hit_soft_17 else dealer_must_hit_s17
+    self.can_double = _always if rules.double_after_split else _not_from_split
+    self.can_surrender = _not_from_split if rules.surrender == 'late' else _never
+    self.early_surrender = self._early_surrender if rules.surrender == 'early' else self._no_early_surrender
+    if rules.hit_split_aces:
+      self.is_finished = self._is_finished_hit_split_aces
+      self.can_split = self._can_split if rules.resplit_aces else self._can_split_not_aces
+      self.after_split = self._after_split
+    else:
+      self.is_finished = self._is_finished
+      self.can_split = self._can_split
+      self.after_split = self._resplit_aces if rules.resplit_aces else self._after_split
+    if rules.peek:
+      self.dealer_peeks = self.dealer_has_blackjack
+      self.pay_blackjacks = self._pay_blackjacks
+      self.settle = self._settle
+    else:
+      self.dealer_peeks = self._no_peek
+      self.pay_blackjacks = self._pay_blackjacks_no_peek
+      self.settle = self._settle_no_peek
+
+  def deal_card(self):
+    'take the next card from the shoe'
+    self.n_cards_dealt += 1
+    return self.shoe.get_card()
 
   def burn_card(self):
     '''
     This is the first card that comes off a shuffled shoe.
     It is dicarded without showing it to the players
     '''
-    _ = self.shoe.get_card()
+    _ = self.deal_card()
+
+  def shuffle(self, cards=None):
+    '''
+    Start a new shoe. The players are told the number
+    of decks again so that they can start a new count.
+    If cards are given they are dealt in that order
+    rather than shuffling.
+    '''
+    if cards is None:
+      self.shoe.shuffle()
+    else:
+      self.shoe.set_cards(cards)
+    self.n_cards_dealt = 0
+    self.n_cards_shown = 0
+    self.count = 0
+    self.n_shoes += 1
+    self.show_decks()
+    self.burn_card()
+
+  def cut_card_seen(self):
+    'True once the cut card has come out of the shoe'
+    return self.n_cards_dealt >= self.cut_number
+
+  def true_count(self):
+    '''
+    The Hi-Lo true count of the cards shown so far. This is the
+    count seen by the table, whatever the players are counting.
+    '''
+    n_cards_unseen = self.n_cards_per_shoe - self.n_cards_shown
+    return self.count * CARDS_PER_DECK / n_cards_unseen
+
+  def set_recorder(self, recorder):
+    '''
+    recorder is called at the end of each round for each
+    occupied place with (i_place, true_count, actions, net)
+    where true_count is the true count when the bet was made,
+    actions is the mask of ACTION_ bits and net is the amount
+    won or lost in the round.
+    '''
+    self.recorder = recorder
+
+  def collect(self, place, amount):
+    'money goes from the player onto the table'
+    place.net -= amount
+    place.player.make_bet(amount)
+
+  def pay(self, place, amount):
+    'money goes from the table back to the player'
+    place.net += amount
+    place.player.receive_payoff(amount)
 
   def sit_down(self, i_place, player):
     'The player occupies a place at the table'
     self.players.append(player)
     self.places[i_place].occupy(player)
+    player.set_minimum_bet(self.minimum_bet)
+    player.set_maximum_bet(self.maximum_bet)
 
   def show_decks(self):
     for place in self.places:
@@ -53,31 +174,35 @@ class Table:
     each active place must have a bet
     It is up to the player how much to bet
     '''
-    for place in self.places:
-      player = place.player
-      if player is not None:
-        assert len(place.hands) == 1
-        hand = place.hands[0]
-        hand.bet = player.get_bet_amount()
-        player.make_bet(hand.bet)
+    for place in self.occupied_places():
+      self.place_bet(place, place.player.get_bet_amount())
+
+  def place_bet(self, place, wager):
+    'the wager is taken from the player and put on the hand'
+    assert len(place.hands) == 1
+    hand = place.hands[0]
+    hand.bet = wager
+    place.bet = wager
+    place.true_count = self.true_count()
+    self.collect(place, wager)
 
   def show_card_to_all_players(self, card):
     '''
     Each player is show the card that has been dealt
     '''
+    self.count += HI_LO_COUNTS[card]
+    self.n_cards_shown += 1
     for player in self.players:
       player.show_card(card)
 
   def deal_places(self):
     'deal one card to each active place'
-    for place in self.places:
-      player = place.player
-      if player is not None:
-        assert len(place.hands) == 1
-        card = self.shoe.get_card()
-        hand = place.hands[0]
-        hand.cards += card
-        self.show_card_to_all_players(card)
+    for place in self.occupied_places():
+      assert len(place.hands) == 1
+      card = self.deal_card()
+      hand = place.hands[0]
+      hand.cards += card
+      self.show_card_to_all_players(card)
 
   def deal_down_card(self):
     '''
@@ -85,7 +210,7 @@ class Table:
     dealer's hand. It is not shown to the players until the
     dealer hand is played.
     '''
-    self.downcard = self.shoe.get_card()
+    self.downcard = self.deal_card()
     self.hand = self.downcard
 
   def deal_up_card(self):
@@ -93,32 +218,65 @@ class Table:
     This is the second card dealt to the dealer hand, it
     is made visible to the players.
     '''
-    self.upcard = self.shoe.get_card()
+    self.upcard = self.deal_card()
     self.hand += self.upcard
     self.show_card_to_all_players(self.upcard)
 
+  def deal_hand_card(self, hand):
+    'deal one card face up to a player hand'
+    card = self.deal_card()
+    hand.cards += card
+    self.show_card_to_all_players(card)
+
+  def _can_split(self, place, hand):
+    'a pair may be split until the place has the maximum number of hands'
+    cards = hand.cards
+    return len(cards) == 2 and cards[0] == cards[1] and \
+           len(place.hands) < self.max_split_hands
+
+  def _can_split_not_aces(self, place, hand):
+    'split aces that are played on may not be split again'
+    if hand.from_split and hand.cards[0] == 'A':
+      return False
+    return self._can_split(place, hand)
+
+  def _is_finished(self, hand):
+    '''
+    Split aces get a single card each and cannot be played further.
+    A hand of 21 or more needs no decisions.
+    '''
+    if hand.from_split and hand.cards[0] == 'A':
+      return True
+    value, _ = hand_value(hand.cards)
+    return value >= 21
+
+  def _is_finished_hit_split_aces(self, hand):
+    'a hand of 21 or more needs no decisions'
+    value, _ = hand_value(hand.cards)
+    return value >= 21
+
   def play_hand(self, player, place, hand):
     '''
-    If the hand is a blackjack then it is
-    immediately payed off and taken from the
-    place
+    The player is asked about surrender, split and double
+    on the first two cards and then hits until standing.
     '''
-    print('hand.bet', hand.bet)
-    print('hand.cards', hand.cards)
-    if self.upcard == 'A':
-      if player.accepts_insurance(hand.cards, self.upcard):
-        self.process_insurance(player, place, hand)
-    if player.accepts_surrender(hand.cards, self.upcard):
-      self.process_surrrender(player, place, hand)
+    if hand.settled or self.is_finished(hand):
+      return
+    cards = hand.cards
+    if self.can_surrender(hand) and player.accepts_surrender(cards, self.upcard):
+      self.process_surrender(player, place, hand)
       return
-    if player.accepts_split(hand.cards, self.upcard):
+    if self.can_split(place, hand) and player.accepts_split(cards, self.upcard):
       self.process_split(player, place, hand)
-    if player.accepts_double(hand.cards, self.upcard):
+      self.play_hand(player, place, hand)
+      return
+    if self.can_double(hand) and player.accepts_double(cards, self.upcard):
       self.process_double(player, place, hand)
-    if player.accepts_stand(hand.cards, self.upcard):
-      self.process_stand(player, place, hand)
-    else:
+      return
+    while not self.is_finished(hand) and \
+          not player.accepts_stand(hand.cards, self.upcard):
       self.process_hit(player, place, hand)
+    self.process_stand(player, place, hand)
 
   def process_insurance(self, player, place, hand):
     '''
@@ -127,40 +285,80 @@ class Table:
     an insurance bet equal to half of the bet of
     the original hand.
     '''
-    print('insurance', self, player, place, hand)
+    hand.insurance_bet = 0.5 * hand.bet
+    place.actions |= ACTION_INSURANCE
+    self.collect(place, hand.insurance_bet)
 
-  def process_surrrender(self, player, place, hand):
+  def process_surrender(self, player, place, hand):
     '''
     The player has deemed that the his hand is too
     weak and is willing to give up half of the
     bet on the hand rather than risk lossing it all.
     '''
-    print('surrender', self, player, place, hand)
+    place.actions |= ACTION_SURRENDER
+    self.pay(place, 0.5 * hand.bet)
+    hand.settled = True
 
   def process_split(self, player, place, hand):
     '''
     The hand has two cards of of equal face and
     want the hand to be split in order to make
-    two hands. An additional bet equal to the 
+    two hands. An additional bet equal to the
     original bet of the hand must be made by the player.
     Two cards are dealt face up to create two new hands.
     '''
-    print('split', self, player, place, hand)
+    new_hand = Hand()
+    new_hand.cards = hand.cards[1]
+    new_hand.bet = hand.bet
+    new_hand.from_split = True
+    place.actions |= ACTION_SPLIT
+    self.collect(place, new_hand.bet)
+    hand.cards = hand.cards[0]
+    hand.from_split = True
+    place.hands.append(new_hand)
+    self.deal_hand_card(hand)
+    self.deal_hand_card(new_hand)
+    self.after_split(player, place, hand, new_hand)
+
+  def _after_split(self, player, place, hand, new_hand):
+    pass
+
+  def _resplit_aces(self, player, place, hand, new_hand):
+    '''
+    Split aces are not played, but one that draws another ace may
+    be split again while the place has room for more hands.
+    '''
+    for split_hand in (hand, new_hand):
+      if split_hand.cards == 'AA' and len(place.hands) < self.max_split_hands and \
+         player.accepts_split(split_hand.cards, self.upcard):
+        self.process_split(player, place, split_hand)
 
   def process_stand(self, player, place, hand):
-    print('stand', self, player, place, hand)
+    'a busted hand loses at once, otherwise it waits for the dealer'
+    value, _ = hand_value(hand.cards)
+    if value > 21:
+      hand.settled = True
 
   def process_hit(self, player, place, hand):
-    print('hit', self, player, place, hand)
+    place.actions |= ACTION_HIT
+    self.deal_hand_card(hand)
 
   def process_double(self, player, place, hand):
-    print('double', self, player, place, hand)
+    'the bet is doubled and the hand gets exactly one more card'
+    place.actions |= ACTION_DOUBLE
+    self.collect(place, hand.bet)
+    hand.bet *= 2.0
+    self.deal_hand_card(hand)
+    self.process_stand(player, place, hand)
 
   def play_place(self, place):
     player = place.player
     if player is not None:
-      for hand in place.hands:
-        self.play_hand(player, place, hand)
+      # a split appends to place.hands so index rather than iterate
+      i_hand = 0
+      while i_hand < len(place.hands):
+        self.play_hand(player, place, place.hands[i_hand])
+        i_hand += 1
 
   def play_each_place(self):
     for place in self.occupied_places():
@@ -176,61 +374,206 @@ class Table:
       assert len(place.hands) == 1
       player = place.player
       hand = place.hands[0]
-      cards = hand.cards
-      if player.accepts_insurance(cards, self.upcard):
-        hand.insurance_bet = 0.5 * hand.bet
-        player.make_bet(hand.insurance_bet)
+      if player.accepts_insurance(hand.cards, self.upcard):
+        self.process_insurance(player, place, hand)
+
+  def dealer_has_blackjack(self):
+    'the dealer peeks under an ace or a ten'
+    return is_blackjack(self.hand)
 
   def dealer_blackjack_ace_up(self):
     assert self.upcard == 'A'
-    print('dealer has a blackjack ace up')
     for place in self.occupied_places():
       assert len(place.hands) == 1
       hand = place.hands[0]
       player = place.player
       if hand.insurance_bet != 0.0:
-        player.receive_payoff(2 * hand.insurance_bet)
+        self.pay(place, (1.0 + INSURANCE_PAYS) * hand.insurance_bet)
       if hand.is_blackjack():
-        player.receive_payoff(hand.bet) # push
+        self.pay(place, hand.bet) # push
+      hand.settled = True
 
   def dealer_blackjack_ten_up(self):
     assert self.upcard == 'X'
-    print('dealer has a blackjack ten up')
     for place in self.occupied_places():
       assert len(place.hands) == 1
       player = place.player
       hand = place.hands[0]
       assert hand.insurance_bet == 0.0
       if hand.is_blackjack():
-        player.receive_payoff(hand.bet) # push
+        self.pay(place, hand.bet) # push
+      hand.settled = True
+
+  def _pay_blackjacks(self):
+    'a player blackjack is paid off at once when the dealer has none'
+    for place in self.occupied_places():
+      hand = place.hands[0]
+      if hand.is_blackjack():
+        place.actions |= ACTION_BLACKJACK
+        self.pay(place, (1.0 + self.blackjack_pays) * hand.bet)
+        hand.settled = True
+
+  def _pay_blackjacks_no_peek(self):
+    'without a peek a player blackjack may still meet a dealer blackjack'
+    if not self.dealer_has_blackjack():
+      self._pay_blackjacks()
+      return
+    for place in self.occupied_places():
+      hand = place.hands[0]
+      if hand.is_blackjack():
+        self.pay(place, hand.bet) # push
+        hand.settled = True
+
+  def _no_peek(self):
+    return False
+
+  def live_hands(self):
+    'hands that still wait on the dealer'
+    for place in self.occupied_places():
+      for hand in place.hands:
+        if not hand.settled:
+          yield hand
+
+  def play_dealer(self):
+    '''
+    The downcard is turned over and the dealer draws to 17.
+    The dealer does not draw if no hand is waiting.
+    '''
+    self.show_card_to_all_players(self.downcard)
+    if next(self.live_hands(), None) is None:
+      return
+    while self.dealer_must_hit(self.hand):
+      card = self.deal_card()
+      self.hand += card
+      self.show_card_to_all_players(card)
+
+  def _settle_no_peek(self):
+    '''
+    A dealer blackjack found only now beats every hand still in play,
+    doubles and splits included, and pays the insurance
+    '''
+    if not self.dealer_has_blackjack():
+      self._settle()
+      return
+    for place in self.occupied_places():
+      insurance_bet = place.hands[0].insurance_bet
+      if insurance_bet != 0.0:
+        self.pay(place, (1.0 + INSURANCE_PAYS) * insurance_bet)
+      for hand in place.hands:
+        hand.settled = True
+
+  def _settle(self):
+    'each hand still in play is compared with the dealer hand'
+    dealer_value, _ = hand_value(self.hand)
+    for place in self.occupied_places():
+      for hand in place.hands:
+        if hand.settled:
+          continue
+        value, _ = hand_value(hand.cards)
+        if dealer_value > 21 or value > dealer_value:
+          self.pay(place, 2.0 * hand.bet)
+        elif value == dealer_value:
+          self.pay(place, hand.bet) # push
+        hand.settled = True
 
   def reset_places(self):
     for place in self.occupied_places():
-      place.hands = [Hand()]
+      place.reset()
 
-  def play_round(self):
+  def start_round(self):
+    'the initial two cards are dealt to each place and the dealer'
     self.hand = ''
-    self.make_bets()
-    self.burn_card()
     self.deal_places()
     self.deal_down_card()
     self.deal_places()
     self.deal_up_card()
-    if self.upcard == 'A':
-      self.players_take_insurance()
-      if self.downcard == 'X':
+
+  def _early_surrender(self):
+    'each place may give up half its bet before the dealer checks for a blackjack'
+    for place in self.occupied_places():
+      hand = place.hands[0]
+      if not hand.is_blackjack() and \
+         place.player.accepts_surrender(hand.cards, self.upcard):
+        self.process_surrender(place.player, place, hand)
+
+  def _no_early_surrender(self):
+    pass
+
+  def finish_round(self):
+    '''
+    Either the dealer has a blackjack, which ends the round,
+    or each place is played followed by the dealer.
+    '''
+    if self.dealer_peeks():
+      self.show_card_to_all_players(self.downcard)
+      if self.upcard == 'A':
         self.dealer_blackjack_ace_up()
-        self.reset_places()
-        return
-    elif self.upcard == 'X':
-      if self.downcard == 'A':
+      else:
         self.dealer_blackjack_ten_up()
-        self.reset_places()
-        return
-    self.play_each_place()
+    else:
+      self.pay_blackjacks()
+      self.play_each_place()
+      self.play_dealer()
+      self.settle()
+    self.end_round()
+
+  def end_round(self):
+    'the results are recorded and the table is cleared'
+    if self.recorder is not None:
+      for i_place, place in enumerate(self.places):
+        if place.player is not None:
+          self.recorder((i_place, place.true_count, place.actions, place.net))
+    self.reset_places()
+    self.n_rounds += 1
+
+  def play_round(self):
+    self.make_bets()
+    self.start_round()
+    if self.upcard == 'A':
+      self.players_take_insurance()
+    self.early_surrender()
+    self.finish_round()
+
+  def play_shoe(self, cards=None):
+    'shuffle and play rounds until the cut card comes out'
+    self.shuffle(cards)
+    while not self.cut_card_seen():
+      self.play_round()
+
+  def get_state(self):
+    '''
+    The shoe, the counters and the state of each seated player.
+    Only meaningful between rounds when no hands are on the table.
+    '''
+    return {
+        'shoe' : self.shoe.get_state(),
+        'n_cards_dealt' : self.n_cards_dealt,
+        'n_cards_shown' : self.n_cards_shown,
+        'count' : self.count,
+        'n_rounds' : self.n_rounds,
+        'n_shoes' : self.n_shoes,
+        'players' : [place.player.get_state() if place.player is not None else None
+                     for place in self.places],
+    }
+
+  def set_state(self, state):
+    self.shoe.set_state(state['shoe'])
+    self.n_cards_dealt = state['n_cards_dealt']
+    self.n_cards_shown = state['n_cards_shown']
+    self.count = state['count']
+    self.n_rounds = state['n_rounds']
+    self.n_shoes = state['n_shoes']
+    for place, player_state in zip(self.places, state['players']):
+      if place.player is not None:
+        place.player.set_state(player_state)
+
+  def run(self, n_shoes):
+    'play a number of shoes'
+    for _ in range(n_shoes):
+      self.play_shoe()
 
 def test():
-  'simple of a single round'
+  'simple of a single shoe'
   n_places = 1
   seed = 1
   n_decks = 6
@@ -245,8 +588,9 @@ def test():
     )
   counter = Counter(json_file_path="strategy1.json")
   table.sit_down(i_place=0, player=counter)
-  table.show_decks()
-  table.play_round()
+  table.play_shoe()
+  print('rounds:', table.n_rounds)
+  print('counter-bankrole:', counter._bankrole)
 
 if __name__ == '__main__':
   test()
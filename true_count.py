@@ -0,0 +1,131 @@
+'''
+true_count.py
+
+Conventions for working out the true count, and how to compare it
+with a strategy's thresholds in whole numbers.
+
+A convention says how finely the decks unseen are judged, to the
+card or to the nearest half or whole deck as a player eyeing the
+discard tray does, and whether the true count is then cut to a
+whole number, truncated towards zero or floored. With the decks
+unseen d / deck_units, for d the units left,
+
+  true = count * deck_units / d
+
+and true >= t is count * deck_units * k >= t * k * d for any k, all
+whole numbers once k clears the fractions of the thresholds and the
+count tags. A floored true count is at least t when the true count
+is at least ceil(t), and a truncated one when it is at least ceil(t)
+for t > 0 and more than ceil(t) - 1 otherwise, so every convention
+is one comparison of whole numbers, with the threshold scaled once.
+
+The float path divides once, count * deck_units / d, and gets the
+correctly rounded true count, so it compares with thresholds such
+as 6.5 just as the whole numbers do.
+
+  > python true_count.py
+'''
+
+import math
+from fractions import Fraction
+from typing import NamedTuple, Callable
+from rules import CARDS_PER_DECK
+
+class Rounding(NamedTuple):
+  name: str
+  deck_units: int     # units the decks unseen are judged in per deck, CARDS_PER_DECK for exact
+  whole: Callable     # what becomes of the true count
+  cut: str            # 'none', 'truncate' or 'floor'
+
+def _keep(true):
+  return true
+
+ROUNDINGS = {rounding.name : rounding for rounding in (
+    Rounding('exact', CARDS_PER_DECK, _keep, 'none'),
+    Rounding('truncate', CARDS_PER_DECK, math.trunc, 'truncate'),
+    Rounding('floor', CARDS_PER_DECK, math.floor, 'floor'),
+    Rounding('half_deck', 2, _keep, 'none'),
+    Rounding('half_deck_truncate', 2, math.trunc, 'truncate'),
+    Rounding('half_deck_floor', 2, math.floor, 'floor'),
+)}
+
+_UNITS = {}
+
+def units_left(n_cards, rounding):
+  '''
+  (d for 0, 1, ... n_cards cards unseen), the decks unseen in units
+  of the rounding, to the nearest unit and never less than one but
+  for an empty shoe. Made once per shoe size and never changed.
+  '''
+  key = (n_cards, rounding.name)
+  units = _UNITS.get(key)
+  if units is None:
+    if rounding.deck_units == CARDS_PER_DECK:
+      units = tuple(range(n_cards + 1))
+    else:
+      half = CARDS_PER_DECK // 2
+      units = (0,) + tuple(max(1, (unseen * rounding.deck_units + half) // CARDS_PER_DECK)
+                           for unseen in range(1, n_cards + 1))
+    units = _UNITS.setdefault(key, units)
+  return units
+
+def count_scale(thresholds, tags):
+  'the least k making k times every threshold and tag a whole number'
+  scale = 1
+  for value in list(thresholds) + list(tags):
+    scale = math.lcm(scale, Fraction(value).limit_denominator(1000).denominator)
+  return scale
+
+def scaled_threshold(threshold, rounding, scale):
+  '''
+  (T, strict) such that the rounded true count is at least threshold
+  exactly when num >= T * d, or num > T * d if strict, for num the
+  running count times deck_units times scale
+  '''
+  exact = Fraction(threshold).limit_denominator(1000)
+  if rounding.cut == 'floor':
+    return math.ceil(exact) * scale, False
+  if rounding.cut == 'truncate':
+    if exact > 0:
+      return math.ceil(exact) * scale, False
+    return (math.ceil(exact) - 1) * scale, True
+  return int(exact * scale), False
+
+def float_true(count, unseen, rounding, units):
+  'the true count of the float path, units being units_left for the shoe'
+  return rounding.whole(count * rounding.deck_units / units[unseen])
+
+def test(n_decks=6):
+  '''
+  For every count and cards unseen of a shoe and every threshold
+  from -7 to +15 in halves, the whole number comparison, the float
+  path and exact fractions agree
+  '''
+  n_cards = n_decks * CARDS_PER_DECK
+  thresholds = [x / 2.0 for x in range(-14, 31)]
+  scale = count_scale(thresholds, (1, 0, -1))
+  n_compared = 0
+  for rounding in ROUNDINGS.values():
+    units = units_left(n_cards, rounding)
+    scaled = [(threshold,) + scaled_threshold(threshold, rounding, scale)
+              for threshold in thresholds]
+    for unseen in range(1, n_cards + 1):
+      seen = n_cards - unseen
+      d = units[unseen]
+      for count in range(-min(seen, 20 * n_decks), min(seen, 20 * n_decks) + 1):
+        num = count * rounding.deck_units * scale
+        true = float_true(count, unseen, rounding, units)
+        exact = Fraction(count * rounding.deck_units, d)
+        if rounding.cut == 'floor':
+          exact = Fraction(math.floor(exact))
+        elif rounding.cut == 'truncate':
+          exact = Fraction(math.trunc(exact))
+        for threshold, big, strict in scaled:
+          whole = num > big * d if strict else num >= big * d
+          assert whole == (true >= threshold) == (exact >= Fraction(threshold)), \
+              (rounding.name, count, unseen, threshold)
+          n_compared += 1
+  print('{0} comparisons agree across {1} roundings'.format(n_compared, len(ROUNDINGS)))
+
+if __name__ == '__main__':
+  test()
@@ -0,0 +1,324 @@
+'''
+variance.py
+
+Variance reduction for simulation runs.
+
+The unit of sampling is the shoe. For each shoe the runner keeps
+the net result y, the number of rounds r and a few quantities whose
+expectations are known exactly. The EV per round is sum(y) / sum(r)
+and its variance comes from the residuals z = y - EV * r.
+
+antithetic
+  Every shuffled shoe is played twice: as dealt and with the low and
+  high cards swapped, 2, 3, 4 and 5 with the tens and 6 with the
+  aces. The swap is a one to one map of the cards of the shoe so
+  the second shoe is just as random as the first, but its Hi-Lo
+  count is the negative of the first at every card. A good shoe for
+  the player is paired with a bad one and the pair varies less than
+  two independent shoes.
+
+control variates
+  Quantities with expectation zero whatever the strategy: the
+  running count after each whole deck before the cut card, the
+  excess of tens before the cut card over 16/52 of the cards, and
+  for the player's and the dealer's naturals the sum over the rounds
+  of bet * (natural - chance of a natural), the chance coming from
+  the aces and tens left in the shoe when the bet was made. The
+  part of y explained by them by linear regression is taken out.
+
+stratify
+  Post-stratification on the true count after a fixed number of
+  decks. The probability of each true count bucket there is known
+  exactly from count_tables, so each bucket's
+  mean is weighted by its exact probability rather than by how
+  often it happened to come up.
+
+Each technique's variance reduction factor is the variance of the
+plain estimate over the variance of the technique's estimate; a
+factor of 3 means a third as many shoes for the same precision.
+
+Measured on 10000 shoes of strategy1.json heads up, python -c
+"import variance; variance.test(10000)", the factors are 1.13 for the
+control variates, 1.02 for antithetic and 0.99 for stratify, so
+simulate.py only plays the last two when a config asks for them as
+experimental.
+'''
+
+import math
+import random
+from rules import CARDS_PER_DECK, HI_LO_COUNTS, is_blackjack
+from stats import Covariance
+
+ANTITHETIC_FACES = {
+    '2' : 'X', '3' : 'X', '4' : 'X', '5' : 'X', '6' : 'A',
+    '7' : '7', '8' : '8', '9' : '9', 'A' : '6',
+}
+
+def antithetic(cards, rng):
+  '''
+  The shoe with the low and high cards swapped. The tens of the
+  shoe become the 2s, 3s, 4s and 5s in a random order, which is
+  what a one to one map of the labelled cards, 10s to 2s, jacks to
+  3s and so on, looks like when the suits and faces are hidden.
+  '''
+  n_tens = cards.count('X')
+  lows = list('2345' * (n_tens // 4))
+  rng.shuffle(lows)
+  answer = []
+  for card in cards:
+    if card == 'X':
+      answer.append(lows.pop())
+    else:
+      answer.append(ANTITHETIC_FACES[card])
+  return answer
+
+def controls(cards, cut_number):
+  '''
+  The control variates of a shoe: the running count after each
+  whole deck before the cut card and the excess of tens before
+  the cut card. All have expectation zero.
+  '''
+  answer = []
+  count = 0
+  for i_card, card in enumerate(cards[:cut_number]):
+    count += HI_LO_COUNTS[card]
+    if (i_card + 1) % CARDS_PER_DECK == 0:
+      answer.append(count)
+  tens = cards[:cut_number].count('X')
+  answer.append(tens - cut_number * 16.0 / CARDS_PER_DECK)
+  return answer
+
+def true_count_bucket(cards, depth, bucket_width=1.0):
+  'the true count bucket after depth cards'
+  count = sum(HI_LO_COUNTS[card] for card in cards[:depth])
+  decks_left = (len(cards) - depth) / float(CARDS_PER_DECK)
+  return int(math.floor(count / decks_left / bucket_width))
+
+def bucket_weights(n_decks, depth, bucket_width=1.0):
+  '''
+  The exact probability of each true count bucket after depth cards
+  of a shuffled shoe, from the running count table of count_tables.
+  '''
+  from count_tables import running_count_table   # numpy only when stratifying
+  probabilities, counts = running_count_table(n_decks, 'hi-lo')
+  decks_left = (n_decks * CARDS_PER_DECK - depth) / float(CARDS_PER_DECK)
+  weights = {}
+  for count, chance in zip(counts, probabilities[depth]):
+    if chance > 0.0:
+      bucket = int(math.floor(count / decks_left / bucket_width))
+      weights[bucket] = weights.get(bucket, 0.0) + float(chance)
+  return weights
+
+def _solve(matrix, vector):
+  'solve a small linear system by Gaussian elimination with pivoting'
+  size = len(vector)
+  rows = [list(row) + [value] for row, value in zip(matrix, vector)]
+  for col in range(size):
+    pivot = max(range(col, size), key=lambda i: abs(rows[i][col]))
+    rows[col], rows[pivot] = rows[pivot], rows[col]
+    if abs(rows[col][col]) < 1e-300:
+      return [0.0] * size
+    for row in range(size):
+      if row != col:
+        factor = rows[row][col] / rows[col][col]
+        for k in range(col, size + 1):
+          rows[row][k] -= factor * rows[col][k]
+  return [rows[i][size] / rows[i][i] for i in range(size)]
+
+class ShoeSample:
+  '''
+  The per shoe accumulators that the techniques need. All of them
+  merge, so partial results from workers can be combined.
+  '''
+  def __init__(self, n_controls, n_decks, depth=None, bucket_width=1.0):
+    self.n_controls = n_controls
+    self.n_decks = n_decks
+    self.depth = depth
+    self.bucket_width = bucket_width
+    self.shoes = Covariance(2 + n_controls)     # y, r, controls
+    self.pairs = Covariance(2)                  # y1 + y2, r1 + r2
+    self.strata = {}                            # bucket -> Covariance(2)
+
+  def add_shoe(self, net, rounds, shoe_controls, bucket=None):
+    self.shoes.add([net, rounds] + list(shoe_controls))
+    if bucket is not None:
+      stratum = self.strata.get(bucket)
+      if stratum is None:
+        stratum = self.strata[bucket] = Covariance(2)
+      stratum.add([net, rounds])
+
+  def add_pair(self, net, rounds):
+    'the combined result of a shoe and its antithetic shoe'
+    self.pairs.add([net, rounds])
+
+  def merge(self, other):
+    self.shoes.merge(other.shoes)
+    self.pairs.merge(other.pairs)
+    for bucket, stratum in other.strata.items():
+      if bucket not in self.strata:
+        self.strata[bucket] = Covariance(2)
+      self.strata[bucket].merge(stratum)
+
+  @staticmethod
+  def _residual_variance(cov, ev):
+    'variance of y - ev * r from the covariance of (y, r, ...)'
+    return cov.covariance(0, 0) - 2.0 * ev * cov.covariance(0, 1) + \
+           ev * ev * cov.covariance(1, 1)
+
+  def plain(self):
+    'EV per round and its variance treating every shoe as independent'
+    cov = self.shoes
+    ev = cov.mean[0] / cov.mean[1]
+    var = self._residual_variance(cov, ev) / (cov.n * cov.mean[1] ** 2)
+    return ev, var
+
+  def with_antithetic(self):
+    cov = self.pairs
+    ev = cov.mean[0] / cov.mean[1]
+    var = self._residual_variance(cov, ev) / (cov.n * cov.mean[1] ** 2)
+    return ev, var
+
+  def with_controls(self):
+    'EV per round and its variance after regressing out the controls'
+    cov = self.shoes
+    ev, _ = self.plain()
+    n_controls = self.n_controls
+    cc = [[cov.covariance(2 + i, 2 + j) for j in range(n_controls)]
+          for i in range(n_controls)]
+    cz = [cov.covariance(0, 2 + i) - ev * cov.covariance(1, 2 + i)
+          for i in range(n_controls)]
+    beta = _solve(cc, cz)
+    explained = sum(b * c for b, c in zip(beta, cz))
+    var_z = self._residual_variance(cov, ev) - explained
+    adjusted = cov.mean[0] - sum(b * cov.mean[2 + i] for i, b in enumerate(beta))
+    return adjusted / cov.mean[1], var_z / (cov.n * cov.mean[1] ** 2)
+
+  def with_strata(self):
+    '''
+    The combined ratio estimate over the strata with their exact
+    weights. Strata never seen are left out and the weights of the
+    others scaled up to match.
+    '''
+    weights = bucket_weights(self.n_decks, self.depth, self.bucket_width)
+    seen = {b : s for b, s in self.strata.items() if s.n > 1}
+    total_weight = sum(weights.get(b, 0.0) for b in seen)
+    y_bar = sum(weights.get(b, 0.0) * s.mean[0] for b, s in seen.items()) / total_weight
+    r_bar = sum(weights.get(b, 0.0) * s.mean[1] for b, s in seen.items()) / total_weight
+    ev = y_bar / r_bar
+    var = 0.0
+    for bucket, stratum in seen.items():
+      weight = weights.get(bucket, 0.0) / total_weight
+      var += weight * weight * self._residual_variance(stratum, ev) / stratum.n
+    return ev, var / (r_bar * r_bar)
+
+  def report(self):
+    'the estimate of each technique and its variance reduction factor'
+    ev, var = self.plain()
+    print('{0:<18} EV {1:+.4f} +/- {2:.4f} per round'.format('plain', ev, math.sqrt(var)))
+    techniques = [('control variates', self.with_controls)]
+    if self.pairs.n > 1:
+      techniques.append(('antithetic', self.with_antithetic))
+    if self.depth is not None and self.strata:
+      techniques.append(('stratified', self.with_strata))
+    for name, technique in techniques:
+      ev_t, var_t = technique()
+      print('{0:<18} EV {1:+.4f} +/- {2:.4f} per round, reduction factor {3:.2f}'.format(
+          name, ev_t, math.sqrt(var_t), var / var_t if var_t > 0.0 else math.inf))
+
+N_ROUND_CONTROLS = 2    # player naturals, dealer naturals
+
+def _prefix_counts(cards, face):
+  'prefix[i] is the number of face in cards[:i]'
+  prefix = [0]
+  for card in cards:
+    prefix.append(prefix[-1] + (card == face))
+  return prefix
+
+def play_shoes(table, n_shoes, sample, swap_rng=None, next_cards=None):
+  '''
+  Play n_shoes shoes at the table, shuffling them here so that the
+  controls can be read off the cards, and add them to the sample.
+  next_cards, if given, returns the cards of each shoe instead, as
+  when they come from a shoe pool.
+  With a swap_rng each shoe is followed by its antithetic shoe,
+  which also counts as a shoe. The table's own recorder still sees
+  every round. Returns the cards dealt from all the shoes.
+  '''
+  recorder = table.recorder
+  shoe_state = {}
+
+  def summing_recorder(record):
+    i_place, _, _, net = record
+    state = shoe_state
+    if table.n_rounds != state['round']:
+      # the first record of a round: it began where the last one ended
+      state['round'] = table.n_rounds
+      state['start'] = state['end']
+      state['end'] = table.n_cards_dealt
+    start = state['start']
+    n_left = len(state['cards']) - start
+    aces = state['aces'][-1] - state['aces'][start]
+    tens = state['tens'][-1] - state['tens'][start]
+    chance = 2.0 * aces * tens / (n_left * (n_left - 1.0))
+    place = table.places[i_place]
+    state['net'] += net
+    state['rounds'] += 1
+    state['player'] += place.bet * (place.hands[0].is_blackjack() - chance)
+    state['dealer'] += place.bet * (is_blackjack(table.downcard + table.upcard) - chance)
+    if recorder is not None:
+      recorder(record)
+  table.set_recorder(summing_recorder)
+
+  def play(cards):
+    shoe_state.update(cards=cards, aces=_prefix_counts(cards, 'A'),
+                      tens=_prefix_counts(cards, 'X'), round=None, end=1,
+                      net=0.0, rounds=0, player=0.0, dealer=0.0)
+    table.play_shoe(cards)
+    shoe_state['dealt'] = table.n_cards_dealt
+    bucket = true_count_bucket(cards, sample.depth, sample.bucket_width) \
+             if sample.depth is not None else None
+    shoe_controls = controls(cards, table.cut_number) + \
+                    [shoe_state['player'], shoe_state['dealer']]
+    sample.add_shoe(shoe_state['net'], shoe_state['rounds'], shoe_controls, bucket)
+    return shoe_state['net'], shoe_state['rounds']
+
+  shoe = table.shoe
+  i_shoe = 0
+  n_cards = 0
+  while i_shoe < n_shoes:
+    if next_cards is None:
+      shoe.shuffle()
+      cards = shoe.shoe
+    else:
+      cards = next_cards()
+    net, rounds = play(cards)
+    n_cards += shoe_state['dealt']
+    i_shoe += 1
+    if swap_rng is not None and i_shoe < n_shoes:
+      other_net, other_rounds = play(antithetic(cards, swap_rng))
+      n_cards += shoe_state['dealt']
+      sample.add_pair(net + other_net, rounds + other_rounds)
+      i_shoe += 1
+  table.set_recorder(recorder)
+  return n_cards
+
+def n_controls(n_decks, decks_cut):
+  '''
+  The number of controls for a shoe: one per whole deck before the
+  cut, the tens and the round controls
+  '''
+  cut_number = n_decks * CARDS_PER_DECK - int(CARDS_PER_DECK * decks_cut + 0.5)
+  return cut_number // CARDS_PER_DECK + 1 + N_ROUND_CONTROLS
+
+def test(n_shoes=2000):
+  'run a heads up Counter with all three techniques and report'
+  from table import Table
+  from counter import Counter
+  table = Table(n_places=1, n_decks=6, seed=5, decks_cut=1.5)
+  table.sit_down(0, Counter(json_file_path='strategy1.json'))
+  sample = ShoeSample(n_controls(6, 1.5), n_decks=6, depth=2 * CARDS_PER_DECK)
+  play_shoes(table, n_shoes, sample, swap_rng=random.Random(5))
+  sample.report()
+
+if __name__ == '__main__':
+  test()
@@ -14,13 +14,45 @@ I shall play a large number of shoes consisting of 6 decks each
 with a one and a half deck cut. I have one player and one
 dealer. When the dealer has an ace I shall record the 'true'
 and whether the second dealer card is a 10.
+
+Rather than a fixed number of shoes, run_to_target plays batches of
+shoes until the break-even true count, where the insurance bet
+stops losing, is known to a target standard error. It comes from
+a straight line fitted to the win against the true, which the
+batches accumulate as a handful of sums that can be merged.
+
+None of this needs sampling. The hole card is a ten with chance
+tens left over cards left, so the EV of the bet is exactly a
+function of the cards dealt. exact_opportunities follows the
+probability of every composition of low, neutral, ten and ace cards
+dealt so far, card by card, through the same rounds as play_shoe and
+gives the exact chance and EV of every insurance opportunity with
+the true that insurance() would record for it. From those come the
+exact curve of analyze_results and the best minimum true.
+
+The analyses make data, which is printed, and written to CSV or NPZ
+files when asked. A figure is only drawn when a PNG or SVG file is
+asked for, and numpy and matplotlib are imported by the functions
+that use them, so the worker processes that play the shoes import
+nothing but the standard library.
+
+  > python insurance.py import-time
+
+times importing this module in a fresh interpreter.
+
+The shoes can also come from a pool made by shoe_pool.py at the top
+of the repository, named on the command line as a .pool file, so
+that no worker shuffles and every analysis sees the same shoes.
 '''
 
+import os
 import sys
+import csv
 import math
+import time
 import random
-import numpy                      # pylint: disable=import-error
-import matplotlib.pyplot as plt   # pylint: disable=import-error
+import subprocess
+import multiprocessing
 
 class Card:
   '''
@@ -47,11 +79,21 @@ class Shoe:
   cards randomly until the cut card comes out and calculating the true
   given a player's belief of the count.
   '''
-  def __init__(self, n_decks, fCut=1.5):
+  # the card index of each rank code 0..9 of a shoe pool, '2'..'X', 'A'
+  POOL_INDICES = [0, 1, 2, 3, 4, 5, 6, 7, 8, 12]
+  def __init__(self, n_decks, fCut=1.5, cards=None):
+    '''
+    cards are the rank codes of a shoe pool row, in the order they
+    are dealt, to deal instead of a random shuffle
+    '''
     assert n_decks > 0
     self.n_decks = n_decks
-    self.indices = list(range(0, 13)) * (4 * n_decks)
-    random.shuffle(self.indices)
+    if cards is None:
+      self.indices = list(range(0, 13)) * (4 * n_decks)
+      random.shuffle(self.indices)
+    else:
+      # deal pops from the end
+      self.indices = [Shoe.POOL_INDICES[code] for code in reversed(cards)]
     self.cut = int(52*fCut + .05)
   def more(self):
     '''
@@ -89,16 +131,87 @@ def insurance(shoe, count, recorder):
   count += down_card.count
   return count
 
-def play_shoe(recorder, n_decks=6):
+def play_shoe(recorder, n_decks=6, cards=None):
   '''
   Simulate a single shoe for the purpose of observing insurance opportunities.
   If such an opportunity is observed it is recored with a recorder function.
+  cards is a shoe pool row to play instead of a shuffled shoe.
   '''
-  shoe = Shoe(n_decks)
+  shoe = Shoe(n_decks, cards=cards)
   count = 0
   while shoe.more():
     count = insurance(shoe, count, recorder)
 
+def exact_opportunities(n_decks=6, fCut=1.5):
+  '''
+  The insurance opportunities of a shoe for each round and running
+  count as arrays (etrue, chance, ev): the true insurance() records,
+  the expected number of times per shoe it comes up and the expected
+  win of a unit bet. The state is the probability of each number of
+  low, ten and ace cards dealt, the neutral cards making up the
+  rest, advanced one card at a time.
+  '''
+  import numpy                      # pylint: disable=import-error
+  n_low, n_zero, n_ten, n_ace = 20 * n_decks, 12 * n_decks, 16 * n_decks, 4 * n_decks
+  n_cards = 52 * n_decks
+  cut = int(52*fCut + .05)
+  low = numpy.arange(n_low + 1)[:, None, None]
+  ten = numpy.arange(n_ten + 1)[None, :, None]
+  ace = numpy.arange(n_ace + 1)[None, None, :]
+  # the count once the ace upcard is seen, from 0 for bincount
+  count_index = (low - ten - ace - 1 + n_ten + n_ace + 1).ravel()
+  counts = numpy.arange(-(n_ten + n_ace + 1), n_low + 1)
+  state = numpy.zeros((n_low + 1, n_ten + 1, n_ace + 1))
+  state[0, 0, 0] = 1.0
+
+  def deal(state, n_dealt):
+    'the state after one more card'
+    left = float(n_cards - n_dealt)
+    zero = numpy.maximum(n_zero - (n_dealt - low - ten - ace), 0)
+    after = state * (zero / left)
+    after[1:, :, :] += (state * ((n_low - low) / left))[:-1, :, :]
+    after[:, 1:, :] += (state * ((n_ten - ten) / left))[:, :-1, :]
+    after[:, :, 1:] += (state * ((n_ace - ace) / left))[:, :, :-1]
+    return after
+
+  etrues, chances, evs = [], [], []
+  n_dealt = 0
+  while n_cards - n_dealt > cut:
+    # the upcard is an ace, the hole card a ten with chance tens left / cards left
+    chance = state * ((n_ace - ace) / float(n_cards - n_dealt))
+    ev = 3.0 * (n_ten - ten) / float(n_cards - n_dealt - 1) - 1.0
+    by_count = numpy.bincount(count_index, chance.ravel(), len(counts))
+    win_by_count = numpy.bincount(count_index, (chance * ev).ravel(), len(counts))
+    keep = by_count > 0.0
+    etrues.append((52.0 * counts[keep]) / (n_cards - n_dealt - 2))
+    chances.append(by_count[keep])
+    evs.append(win_by_count[keep] / by_count[keep])
+    state = deal(deal(state, n_dealt), n_dealt + 1)
+    n_dealt += 2
+  return numpy.concatenate(etrues), numpy.concatenate(chances), numpy.concatenate(evs)
+
+def exact_results(start, stop, step=+0.5, n_decks=6):
+  '''
+  The exact (tmin, mean) of analyze_true for each minimum true in
+  the range and the best minimum true, the one that maximises the
+  expected win of insuring every hand at or above it, as
+  (results, best_tmin, win per shoe at best_tmin)
+  '''
+  import numpy                      # pylint: disable=import-error
+  etrue, chance, ev = exact_opportunities(n_decks)
+  order = numpy.argsort(-etrue)
+  etrue, chance, ev = etrue[order], chance[order], ev[order]
+  # from the highest true down: chance and win of insuring at or above each
+  total_chance = numpy.cumsum(chance)
+  total_win = numpy.cumsum(chance * ev)
+  results = []
+  for tmin in numpy.arange(start, stop, step):
+    n_above = numpy.searchsorted(-etrue, -tmin, side='right')
+    if n_above > 0:
+      results.append((float(tmin), float(total_win[n_above - 1] / total_chance[n_above - 1])))
+  best = int(numpy.argmax(total_win))
+  return results, float(etrue[best]), float(total_win[best])
+
 def analyze_true(results, tmin, recorder):
   '''
   Iterate over the insurance results looking for insurance opportunities
@@ -107,80 +220,314 @@ def analyze_true(results, tmin, recorder):
   the average and standard deviation of the results per unit
   insurance bet and report it by calling recorder function.
   '''
+  # Welford's running mean and sum of squared deviations. Taking
+  # the difference of the mean square and the squared mean loses
+  # most of its digits when the mean is large compared to the spread.
   ntotal = 0
-  win1 = 0
-  win2 = 0
+  mean = 0.0
+  m2 = 0.0
   for (etrue, win) in results:
     if etrue >= tmin:
       ntotal += 1
-      win1 += win
-      win2 += win*win
+      delta = win - mean
+      mean += delta / ntotal
+      m2 += delta * (win - mean)
   if ntotal <= 0:
     return
-  e_win1 = win1 / ntotal
-  e_win2 = win2 / ntotal
-  var = e_win2 - e_win1 * e_win1    # variance
+  var = m2 / ntotal     # variance
   std = math.sqrt(var)  # standard deviation
-  recorder((tmin, e_win1, std))
+  recorder((tmin, mean, std))
 
 def analyze_results(results, start, stop):
   '''
   Analyze the results of the insurance data for set of minimum critical
-  values of true. Plot the results where the x-axis is the critical
-  true and the y-axis is the expected return on an accepted unit
-  insurance bet.
+  values of true. Returns the columns tmin, the simulated expected
+  return on an accepted unit insurance bet and the exact one, and
+  prints them with the best minimum true.
   '''
   step = +0.5
-  tmin_s = []
-  win_s = []
-  def my_recorder(result):
-    tmin, avg, _ = result
-    tmin_s.append(tmin)
-    win_s.append(avg)
-  tmins = numpy.arange(start, stop, step)
-  for tmin in tmins:
+  exact, best_tmin, _ = exact_results(start, stop, step)
+  columns = {'tmin' : [], 'simulated' : [], 'exact' : []}
+  for tmin, exact_win in exact:
+    def my_recorder(result):
+      _, avg, _ = result
+      columns['tmin'].append(tmin)
+      columns['simulated'].append(avg)
+      columns['exact'].append(exact_win)
     analyze_true(results, tmin, my_recorder)
+  print('{0:>8} {1:>10} {2:>10}'.format('min true', 'simulated', 'exact'))
+  for tmin, avg, exact_win in zip(columns['tmin'], columns['simulated'], columns['exact']):
+    print('{0:>+8.1f} {1:>+10.4f} {2:>+10.4f}'.format(tmin, avg, exact_win))
+  print('best minimum true (exact): {0:+.3f}'.format(best_tmin))
+  return columns
+
+def write_table(path, columns):
+  'write the columns, a dict of equal length lists, to a .csv or .npz file'
+  names = list(columns)
+  if path.endswith('.npz'):
+    import numpy                      # pylint: disable=import-error
+    numpy.savez(path, **{name : numpy.asarray(columns[name]) for name in names})
+    return
+  with open(path, 'w', newline='') as fobj:
+    writer = csv.writer(fobj)
+    writer.writerow(names)
+    writer.writerows(zip(*(columns[name] for name in names)))
+
+def render_curve(path, columns):
+  '''
+  Draw the simulated and exact expected win against the minimum
+  true to a .png or .svg file. matplotlib is imported here, with a
+  backend that needs no display.
+  '''
+  import matplotlib                 # pylint: disable=import-error
+  matplotlib.use('Agg')
+  import matplotlib.pyplot as plt   # pylint: disable=import-error
+  fig, axes = plt.subplots()
+  axes.scatter(columns['tmin'], columns['simulated'], label='simulated')
+  axes.plot(columns['tmin'], columns['exact'], label='exact')
+  axes.legend()
+  axes.grid(True)
+  axes.set(xlabel='minimum true', ylabel='expected win',
+           title='expected insurance result vs minimum true')
+  fig.savefig(path)
+  plt.close(fig)
+
+class Regression:
+  '''
+  The least squares line win = a + b * true, accumulated with
+  Welford's method so that batches can be merged.
+  '''
+  def __init__(self):
+    self.n = 0
+    self.mean_t = 0.0
+    self.mean_w = 0.0
+    self.ctt = 0.0
+    self.ctw = 0.0
+    self.cww = 0.0
+  def add(self, etrue, win):
+    self.n += 1
+    dt = etrue - self.mean_t
+    dw = win - self.mean_w
+    self.mean_t += dt / self.n
+    self.mean_w += dw / self.n
+    self.ctt += dt * (etrue - self.mean_t)
+    self.ctw += dt * (win - self.mean_w)
+    self.cww += dw * (win - self.mean_w)
+  def merge(self, other):
+    if other.n == 0:
+      return
+    n = self.n + other.n
+    dt = other.mean_t - self.mean_t
+    dw = other.mean_w - self.mean_w
+    factor = float(self.n) * other.n / n
+    self.ctt += other.ctt + factor * dt * dt
+    self.ctw += other.ctw + factor * dt * dw
+    self.cww += other.cww + factor * dw * dw
+    self.mean_t += dt * other.n / n
+    self.mean_w += dw * other.n / n
+    self.n = n
+  def break_even(self):
+    '''
+    The true where the line crosses zero and its standard error by
+    the delta method, or None until the slope is known to be positive
+    '''
+    if self.n < 3 or self.ctt <= 0.0:
+      return None
+    slope = self.ctw / self.ctt
+    if slope <= 0.0:
+      return None
+    intercept = self.mean_w - slope * self.mean_t
+    s2 = max(self.cww - slope * self.ctw, 0.0) / (self.n - 2)
+    var_b = s2 / self.ctt
+    var_a = s2 * (1.0 / self.n + self.mean_t ** 2 / self.ctt)
+    cov_ab = -self.mean_t * s2 / self.ctt
+    ga = -1.0 / slope
+    gb = intercept / slope ** 2
+    var = ga * ga * var_a + gb * gb * var_b + 2.0 * ga * gb * cov_ab
+    return -intercept / slope, math.sqrt(var)
+
+def open_pool(path):
+  '''
+  The shoe_pool.ShoePool at path. shoe_pool lives at the top of the
+  repository, which is only put on the path when a pool is used.
+  '''
+  root = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir)
+  if root not in sys.path:
+    sys.path.append(root)
+  import shoe_pool                  # pylint: disable=import-error,import-outside-toplevel
+  return shoe_pool.open_pool(path)
+
+def play_shoes(recorder, n_shoes, pool=None, first_row=0):
+  'play n_shoes shuffled shoes, or rows first_row, ... of the pool at path pool'
+  if pool is None:
+    for _ in range(n_shoes):
+      play_shoe(recorder)
+    return
+  shoes = open_pool(pool)
+  shoes.check(n_shoes, first_row)
+  for row in range(first_row, first_row + n_shoes):
+    play_shoe(recorder, shoes.n_decks, shoes.row(row))
+
+def play_batch(batch):
+  '''
+  Play a batch of shoes, batch being (seed, n_shoes, start, stop,
+  pool, first_row), and return n_shoes and the Regression of the
+  opportunities with start <= true < stop. With a pool the shoes
+  are its rows from first_row on and the seed is not used.
+  '''
+  seed, n_shoes, start, stop, pool, first_row = batch
+  random.seed(seed)
+  regression = Regression()
+  def a_recorder(result):
+    etrue, win = result
+    if start <= etrue < stop:
+      regression.add(etrue, win)
+  play_shoes(a_recorder, n_shoes, pool, first_row)
+  return n_shoes, regression
 
-  # plot the expected win agains the minimum true values
-  plt.scatter(tmin_s, win_s)
-  plt.grid(True)
-  plt.xlabel("minimum true")
-  plt.ylabel("expected win")
-  plt.axes().set_xticks(numpy.arange(start, stop, 2*step))
-  plt.title("expected insurance result vs minimum true")
-  plt.show()
+def run_to_target(target_se, max_shoes, start, stop, batch_shoes=1000, workers=1, seed=1,
+                  pool=None):
+  '''
+  Play batches of batch_shoes shoes, seeded seed, seed + 1, ..., or
+  taken in turn from the shoe pool at path pool, on workers
+  processes until the standard error of the break-even true is at
+  most target_se or max_shoes have been played. Reports the
+  precision reached and returns the merged Regression.
+  '''
+  if pool is not None:
+    open_pool(pool).check(max_shoes)
+  batches = []
+  n_left = max_shoes
+  while n_left > 0:
+    batches.append((seed + len(batches), min(batch_shoes, n_left), start, stop,
+                    pool, max_shoes - n_left))
+    n_left -= batch_shoes
+  regression = Regression()
+  n_batches = 0
+  n_shoes = 0
+  stopped = 'shoe budget spent'
+  with multiprocessing.Pool(workers) as processes:
+    for batch_shoes_played, result in processes.imap_unordered(play_batch, batches):
+      regression.merge(result)
+      n_batches += 1
+      n_shoes += batch_shoes_played
+      estimate = regression.break_even()
+      if estimate is not None and estimate[1] <= target_se:
+        stopped = 'target met'
+        processes.terminate()
+        break
+  estimate = regression.break_even()
+  if estimate is None:
+    print('break-even true: not found in {0} opportunities'.format(regression.n))
+  else:
+    print('break-even true: {0:+.3f} +/- {1:.3f}, target {2:.3f}'.format(
+        estimate[0], estimate[1], target_se))
+  print('{0} batches, {1} shoes, {2} opportunities, {3}'.format(
+      n_batches, n_shoes, regression.n, stopped))
+  return regression
 
-def run(n_shoes, start, stop):
+def run(n_shoes, start, stop, outputs=(), pool=None):
   '''
   Simulates n_shoes of 6 deck blackjack looking for insurance opportunities.
-  The start and stop are the ranges of critical true values.
+  The start and stop are the ranges of critical true values. outputs
+  are the paths to write the results to, .csv or .npz for the table
+  and .png or .svg for the figure. pool is the path of a shoe pool
+  to take the shoes from.
   '''
   results = []
   def a_recorder(result):
     results.append(result)
-  for _ in range(n_shoes):
-    play_shoe(a_recorder)
-  analyze_results(results, start, stop)
+  play_shoes(a_recorder, n_shoes, pool)
+  columns = analyze_results(results, start, stop)
+  for path in outputs:
+    if path.endswith(('.png', '.svg')):
+      render_curve(path, columns)
+    else:
+      write_table(path, columns)
+  return columns
+
+def import_time(module='insurance', repeats=5):
+  '''
+  The shortest time in seconds to start a fresh interpreter and import
+  module, less the time to start one that imports nothing
+  '''
+  def best(code):
+    times = []
+    for _ in range(repeats):
+      start = time.perf_counter()
+      subprocess.run([sys.executable, '-c', code], check=True,
+                     stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+      times.append(time.perf_counter() - start)
+    return min(times)
+  return best('import ' + module) - best('pass')
+
+def report_import_time():
+  'print the import time of this module and, for comparison, of numpy and matplotlib'
+  print('import insurance: {0:.3f} s'.format(import_time('insurance')))
+  for module in ('numpy', 'matplotlib.pyplot'):
+    try:
+      print('import {0}: {1:.3f} s'.format(module, import_time(module)))
+    except subprocess.CalledProcessError:
+      print('import {0}: not installed'.format(module))
+
+OUTPUT_TYPES = ('.csv', '.npz', '.png', '.svg')
+
+def report_exact(start, stop):
+  'print the exact expected win for each minimum true and the best one'
+  results, best_tmin, best_win = exact_results(start, stop)
+  print('{0:>8} {1:>10}'.format('min true', 'exp win'))
+  for tmin, avg in results:
+    print('{0:>+8.1f} {1:>+10.4f}'.format(tmin, avg))
+  print('best minimum true {0:+.3f}, {1:+.4f} units won per shoe'.format(best_tmin, best_win))
 
 def main():
-  'main entry point: args = n_shoes start stop'
+  'main entry point: args = n_shoes start stop [target_se [workers]] [shoes.pool] [output ...]'
+  outputs = [arg for arg in sys.argv[1:] if arg.endswith(OUTPUT_TYPES)]
+  pools = [arg for arg in sys.argv[1:] if arg.endswith('.pool')]
+  args = [arg for arg in sys.argv[1:] if arg not in outputs and arg not in pools]
+  pool = pools[0] if pools else None
   try:
-    n_shoes = int(sys.argv[1])
-    start = float(sys.argv[2])
-    stop = float(sys.argv[3]) + .1
-    run(n_shoes, start, stop)
-  except Exception: # pylint: disable=broad-except
+    command = args[0]
+    if command == 'exact':
+      start = float(args[1])
+      stop = float(args[2]) + .1
+    elif command != 'import-time':
+      n_shoes = int(args[0])
+      start = float(args[1])
+      stop = float(args[2]) + .1
+      target_se = float(args[3]) if len(args) > 3 else None
+      workers = int(args[4]) if len(args) > 4 else 1
+  except (IndexError, ValueError):
     print()
     print("Analyze insurance bets")
     print()
     print("  Syntax:")
     print()
-    print("    > python insurance.py n_shoes start stop")
+    print("    > python insurance.py n_shoes start stop [target_se [workers]] [shoes.pool] [output ...]")
+    print("    > python insurance.py exact start stop")
+    print("    > python insurance.py import-time")
     print()
     print("    eg.")
     print()
-    print("    > python insurance.py 10000 -5.0 +5.1")
+    print("    > python insurance.py 10000 -5.0 +5.1 insurance.csv insurance.png")
+    print()
+    print("    With a target_se, n_shoes is the most to play and shoes are")
+    print("    played until the break-even true is known to target_se.")
+    print("    The outputs are .csv or .npz files for the table and .png or")
+    print("    .svg files for the figure.")
+    print("    A .pool file made by shoe_pool.py supplies the shoes.")
+    print("    exact prints the exact curve without playing any shoes.")
     print()
 
+    sys.exit(1)
+  if command == 'import-time':
+    report_import_time()
+  elif command == 'exact':
+    report_exact(start, stop)
+  elif target_se is not None:
+    run_to_target(target_se, n_shoes, start, stop, workers=workers, pool=pool)
+  else:
+    run(n_shoes, start, stop, outputs, pool)
+
 if __name__ == '__main__':
   main()
@@ -1,9 +1,20 @@
-'main.py'
+'''main.py
 
-from typing import Iterable
-import matplotlib.pyplot as plt
+The true count through one shoe. The trues are printed, or written
+to the files named on the command line: .csv or .npz for the data
+and .png or .svg for a plot. matplotlib is only imported to draw
+the plot, with a backend that needs no display.
+
+  > python main.py [seed] [output ...]
+'''
+
+import sys
+import csv
+from typing import Iterable, List
 from general import General, SHOE
 
+OUTPUT_TYPES = ('.csv', '.npz', '.png', '.svg')
+
 def get_counts(shoe: SHOE) -> Iterable[int]:
   'returns a sequence of observed card counter counts for a shoe'
   count = 0
@@ -11,9 +22,8 @@ def get_counts(shoe: SHOE) -> Iterable[int]:
     count += General.get_count_value(card)
     yield count
 
-def plot_shoe_trues(seed: int = None) -> None:
-  'display a plot of the true count for a random shoe'
-  n_decks = 6
+def shoe_trues(seed: int = None, n_decks: int = 6) -> List[float]:
+  'the true count after each card of a random shoe up to the cut card'
   shoe = General.get_shoe(n_decks=n_decks, seed=seed)
   card_counts = list(get_counts(shoe))
   observed_counts = card_counts[:int(52 * (float(n_decks) - 1.5))]
@@ -23,16 +33,50 @@ def plot_shoe_trues(seed: int = None) -> None:
     decks_remaining = float(n_decks) - scale * (i_card + 1)
     true = count / decks_remaining
     trues.append(true)
-  _, axes = plt.subplots()
-  axes.plot(list(range(len(observed_counts))), trues)
+  return trues
+
+def write_trues(path: str, trues: List[float]) -> None:
+  'write the card numbers and trues to a .csv or .npz file'
+  if path.endswith('.npz'):
+    import numpy                      # pylint: disable=import-error
+    numpy.savez(path, card=numpy.arange(len(trues)), true=numpy.asarray(trues))
+    return
+  with open(path, 'w', newline='') as fobj:
+    writer = csv.writer(fobj)
+    writer.writerow(['card', 'true'])
+    writer.writerows(enumerate(trues))
+
+def render_trues(path: str, trues: List[float]) -> None:
+  'plot the trues to a .png or .svg file'
+  import matplotlib                 # pylint: disable=import-error
+  matplotlib.use('Agg')
+  import matplotlib.pyplot as plt   # pylint: disable=import-error
+  fig, axes = plt.subplots()
+  axes.plot(list(range(len(trues))), trues)
   axes.set(xlabel='card number', ylabel='true', title='observed true values')
-  # _, _, _ = plt.hist(observed_counts, bins=[x + 0.5 for x in list(range(-20, 21))])
-  plt.grid(True)
-  plt.show()
+  axes.grid(True)
+  fig.savefig(path)
+  plt.close(fig)
+
+def plot_shoe_trues(seed: int = None, outputs: Iterable[str] = ()) -> List[float]:
+  'the trues of a random shoe, written to each of the outputs'
+  trues = shoe_trues(seed)
+  for path in outputs:
+    if path.endswith(('.png', '.svg')):
+      render_trues(path, trues)
+    else:
+      write_trues(path, trues)
+  return trues
 
 def main() -> None:
-  'main entry point'
-  plot_shoe_trues()
+  'main entry point: args = [seed] [output ...]'
+  outputs = [arg for arg in sys.argv[1:] if arg.endswith(OUTPUT_TYPES)]
+  args = [arg for arg in sys.argv[1:] if arg not in outputs]
+  seed = int(args[0]) if args else None
+  trues = plot_shoe_trues(seed, outputs)
+  if not outputs:
+    for i_card, true in enumerate(trues):
+      print('{0:>4} {1:>+7.2f}'.format(i_card, true))
 
 if __name__ == '__main__':
   main()
@@ -0,0 +1,183 @@
+'''trajectories.py
+
+The distribution of the true count against the number of cards
+dealt, over as many shoes as you like.
+
+Shoes are dealt in batches as rows of Hi-Lo count values shuffled
+by NumPy, and a cumsum along each row gives the running counts. The
+running count is a whole number, so the state kept is the number of
+times each running count was seen after each card: a 2-D histogram
+of card position by running count, a few hundred KB whatever the
+number of shoes. The true count after a card is the running count
+over the decks remaining, as in main.shoe_trues, so the histogram of
+true counts in bins of any width and the quantiles of the true
+count at each position come from it exactly.
+
+  > python trajectories.py n_shoes [output ...]
+  > python trajectories.py test
+
+with .npz outputs for the histogram and .csv outputs for the
+quantiles.
+'''
+
+import sys
+import time
+from typing import Iterable, Tuple
+import numpy                      # pylint: disable=import-error
+
+QUANTILES = (0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99)
+
+class TrueHistogram:
+  '''
+  Counts of the running count after each card up to the cut card,
+  merged across batches and processes by adding.
+  '''
+  def __init__(self, n_decks: int = 6, decks_cut: float = 1.5):
+    self.n_decks = n_decks
+    self.decks_cut = decks_cut
+    self.n_cards = 52 * n_decks
+    self.n_positions = int(52 * (float(n_decks) - decks_cut))
+    self.max_count = 20 * n_decks
+    self.n_shoes = 0
+    # [position, running count + max_count]
+    self.counts = numpy.zeros((self.n_positions, 2 * self.max_count + 1), dtype=numpy.int64)
+    self.tags = numpy.array([+1] * (20 * n_decks) + [0] * (12 * n_decks) + [-1] * (20 * n_decks),
+                            dtype=numpy.int8)
+    self.decks_remaining = (self.n_cards - numpy.arange(1, self.n_positions + 1)) / 52.0
+
+  def add_batch(self, shoes: numpy.ndarray) -> None:
+    'add shoes, a 2-D array with the count values of one shoe in each row'
+    running = numpy.cumsum(shoes[:, :self.n_positions], axis=1, dtype=numpy.int16)
+    width = self.counts.shape[1]
+    flat = running + (numpy.arange(self.n_positions, dtype=numpy.int32) * width + self.max_count)
+    self.counts += numpy.bincount(flat.ravel(), minlength=self.counts.size).reshape(self.counts.shape)
+    self.n_shoes += len(shoes)
+
+  def play(self, n_shoes: int, seed: int = None, batch_shoes: int = 10000) -> None:
+    'deal and add n_shoes shuffled shoes'
+    rng = numpy.random.default_rng(seed)
+    while n_shoes > 0:
+      n_batch = min(batch_shoes, n_shoes)
+      shoes = rng.permuted(numpy.broadcast_to(self.tags, (n_batch, self.n_cards)), axis=1)
+      self.add_batch(shoes)
+      n_shoes -= n_batch
+
+  def merge(self, other: 'TrueHistogram') -> None:
+    assert self.counts.shape == other.counts.shape
+    self.counts += other.counts
+    self.n_shoes += other.n_shoes
+
+  def running_counts(self) -> numpy.ndarray:
+    'the running count of each column of counts'
+    return numpy.arange(-self.max_count, self.max_count + 1)
+
+  def trues(self) -> numpy.ndarray:
+    'the true count of each cell of counts'
+    return self.running_counts()[None, :] / self.decks_remaining[:, None]
+
+  def true_histogram(self, width: float = 0.5, low: float = -10.0,
+                     high: float = 10.0) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    '''
+    The bin edges and the [position, bin] counts of the true count
+    in bins of width from low to high, the end bins taking everything
+    beyond them
+    '''
+    edges = numpy.arange(low, high + width / 2.0, width)
+    bins = numpy.clip(numpy.searchsorted(edges, self.trues(), side='right') - 1,
+                      0, len(edges) - 2)
+    answer = numpy.zeros((self.n_positions, len(edges) - 1), dtype=numpy.int64)
+    rows = numpy.broadcast_to(numpy.arange(self.n_positions)[:, None], bins.shape)
+    numpy.add.at(answer, (rows, bins), self.counts)
+    return edges, answer
+
+  def quantiles(self, qs: Iterable[float] = QUANTILES) -> numpy.ndarray:
+    '''
+    [position, q] the true count at each position that a fraction q
+    of the shoes are at or below
+    '''
+    cumulative = numpy.cumsum(self.counts, axis=1)
+    trues = self.trues()
+    answer = numpy.empty((self.n_positions, len(qs)))
+    for i_q, q in enumerate(qs):
+      column = (cumulative < q * self.n_shoes).sum(axis=1)
+      answer[:, i_q] = trues[numpy.arange(self.n_positions), column]
+    return answer
+
+  def save(self, path: str) -> None:
+    numpy.savez_compressed(path, counts=self.counts, n_shoes=self.n_shoes,
+                           n_decks=self.n_decks, decks_cut=self.decks_cut,
+                           n_positions=self.n_positions)
+
+  @classmethod
+  def load(cls, path: str) -> 'TrueHistogram':
+    data = numpy.load(path)
+    answer = cls(int(data['n_decks']), float(data['decks_cut']))
+    if answer.n_positions != int(data['n_positions']):
+      raise ValueError('{0} has {1} positions, not {2}'.format(
+          path, int(data['n_positions']), answer.n_positions))
+    answer.counts[...] = data['counts']
+    answer.n_shoes = int(data['n_shoes'])
+    return answer
+
+def write_quantiles(path: str, histogram: TrueHistogram, qs: Iterable[float] = QUANTILES) -> None:
+  'the quantiles of the true count at each position as a CSV file'
+  qs = tuple(qs)
+  table = numpy.column_stack([numpy.arange(histogram.n_positions), histogram.quantiles(qs)])
+  header = ','.join(['card'] + ['q{0:g}'.format(q) for q in qs])
+  numpy.savetxt(path, table, delimiter=',', header=header, comments='', fmt='%.6g')
+
+def test() -> None:
+  'save and load histograms over a range of cuts and check they come back the same'
+  import os
+  import tempfile
+  path = os.path.join(tempfile.mkdtemp(), 'histogram.npz')
+  n_checked = 0
+  for n_decks in (1, 2, 6, 8):
+    for tenths in range(5, 10 * n_decks - 4):
+      histogram = TrueHistogram(n_decks, tenths / 10.0)
+      histogram.play(20, seed=tenths)
+      histogram.save(path)
+      loaded = TrueHistogram.load(path)
+      assert loaded.decks_cut == histogram.decks_cut, (n_decks, tenths)
+      assert loaded.n_positions == histogram.n_positions, (n_decks, tenths)
+      assert loaded.n_shoes == histogram.n_shoes
+      assert (loaded.counts == histogram.counts).all()
+      n_checked += 1
+  os.remove(path)
+  print('{0} histograms came back the same from .npz'.format(n_checked))
+
+def main() -> None:
+  'main entry point: args = n_shoes [output ...], or test'
+  if sys.argv[1:] == ['test']:
+    test()
+    return
+  try:
+    n_shoes = int(sys.argv[1])
+  except (IndexError, ValueError):
+    print()
+    print("The distribution of the true count through the shoe")
+    print()
+    print("  Syntax:")
+    print()
+    print("    > python trajectories.py n_shoes [histogram.npz] [quantiles.csv]")
+    print("    > python trajectories.py test")
+    print()
+    sys.exit(1)
+  histogram = TrueHistogram()
+  start = time.perf_counter()
+  histogram.play(n_shoes, seed=1)
+  elapsed = time.perf_counter() - start
+  print('{0} shoes in {1:.1f} s, {2:.0f} shoes/s, state {3:.0f} KB'.format(
+      n_shoes, elapsed, n_shoes / elapsed, histogram.counts.nbytes / 1024.0))
+  quantiles = histogram.quantiles()
+  print('{0:>5}'.format('card') + ''.join('{0:>8}'.format('q{0:g}'.format(q)) for q in QUANTILES))
+  for position in range(0, histogram.n_positions, 26):
+    print('{0:>5}'.format(position) + ''.join('{0:>+8.2f}'.format(x) for x in quantiles[position]))
+  for path in sys.argv[2:]:
+    if path.endswith('.npz'):
+      histogram.save(path)
+    else:
+      write_quantiles(path, histogram)
+
+if __name__ == '__main__':
+  main()